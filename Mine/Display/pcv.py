@@ -1,31 +1,136 @@
 import os
+import json
 import time
+import queue
+import shutil
 import argparse
+import threading
 import numpy as np
 import open3d as o3d
 
 from assist.time import TimeTracker
 
+try:
+    # LODキャッシュが無いときに、ファイルを流し読みして間引いた点を先に表示する（density/formats.py）
+    from density.formats import iter_xyz_chunks, read_header
+except ImportError:  # pragma: no cover
+    iter_xyz_chunks = read_header = None
+
+# LOD（--lod）の既定値
+LOD_LEVELS = 8          # 格子で間引く段数（最後にもう1段、残りの全点が付く）
+LOD_BASE_RES = 16       # 段0の格子の1辺の分割数（AABBの最長辺基準）。段ごとに2倍
+LOD_STREAM_CHUNK = 500_000  # 1フレームで追加する点数（描画を止めずに細かい段を流し込む）
+LOD_CACHE_VERSION = 2       # 2: 点は shift を引いた局所座標（float32）で持ち、shift を meta.json に書く
+PREVIEW_SUFFIXES = (".ply", ".pcd", ".xyz", ".pts")  # 流し読みでプレビューを出す形式
+PREVIEW_TEXT_STEP = 64      # 点数がヘッダに無いテキスト形式のプレビューの間引き間隔
+
+
+def build_lod_order(points, levels=LOD_LEVELS, base_res=LOD_BASE_RES, seed=0):
+    """点を粗い段から順に並べる番号と、各段の終わりの位置 ends[levels+1] を返す
+    ・段 l は1辺 base_res*2^l 分割の格子（八分木の l 段目）の各セルから1点ずつ（乱順で最初の点）
+    ・親セルの代表点は子セルの代表点でもあるので、段は入れ子になる（先頭 ends[l] 点が段 l までの表示）
+    ・最後の段（levels）は残りの全点
+    """
+    n = points.shape[0]
+    perm = np.random.default_rng(seed).permutation(n)
+    p = np.asarray(points, dtype=np.float64)[perm]
+    lo = p.min(axis=0)
+    span = max(float((p.max(axis=0) - lo).max()), 1e-12)
+    level = np.full((n,), levels, dtype=np.int16)
+    for lv in range(levels):
+        res = base_res << lv
+        ijk = np.minimum(((p - lo) * (res / span)).astype(np.int64), res - 1)
+        keys = (ijk[:, 0] * res + ijk[:, 1]) * res + ijk[:, 2]
+        _, first = np.unique(keys, return_index=True)
+        level[first[level[first] > lv]] = lv
+    order = perm[np.argsort(level, kind="stable")]
+    ends = np.cumsum(np.bincount(level, minlength=levels + 1))
+    return order, ends
+
+
+class LODCache:
+    """LOD順に並べた点（と色）を入力ファイルの隣の <ファイル名>.lod/ に置く
+    ・points.npy / colors.npy は読み取り専用のmemmapで開くので、段0だけならすぐ表示できる
+    ・points.npy は AABB最小（shift、float64）を引いた局所座標の float32。絶対座標は shift + 点を float64 で求める
+      （絶対座標のままfloat32にすると、1e5 m の座標では刻みが約8e-3 mになる）
+    ・meta.json に入力のサイズと更新時刻、shift を書き、入力が変わっていれば作り直す
+    ・速くなるのは2回目以降に開くとき。初回は流し読みのプレビューを先に表示してから、全点を読んでLODを作る
+    """
+
+    def __init__(self, input_path, levels=LOD_LEVELS, base_res=LOD_BASE_RES):
+        self.input_path = input_path
+        self.dir = input_path + ".lod"
+        self.levels = levels
+        self.base_res = base_res
+
+    def _stamp(self):
+        st = os.stat(self.input_path)
+        return {"version": LOD_CACHE_VERSION, "source_size": st.st_size, "source_mtime_ns": st.st_mtime_ns,
+                "levels": self.levels, "base_res": self.base_res}
+
+    def load(self):
+        """(点, 色 または None, ends, shift)。キャッシュが無いか古ければ None"""
+        meta_path = os.path.join(self.dir, "meta.json")
+        if not os.path.isfile(meta_path):
+            return None
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if any(meta.get(k) != v for k, v in self._stamp().items()):
+                return None
+            points = np.load(os.path.join(self.dir, "points.npy"), mmap_mode="r")
+            colors_path = os.path.join(self.dir, "colors.npy")
+            colors = np.load(colors_path, mmap_mode="r") if os.path.isfile(colors_path) else None
+            return points, colors, np.asarray(meta["ends"], dtype=np.int64), np.asarray(meta["shift"], dtype=np.float64)
+        except (OSError, ValueError, KeyError):
+            return None  # 壊れたキャッシュは作り直す
+
+    def save(self, points, colors, ends, shift):
+        """一時ディレクトリに書いてから置き換える（書き込み中に開いても壊れたキャッシュを読まない）"""
+        tmp = f"{self.dir}.{os.getpid()}.tmp"
+        os.makedirs(tmp, exist_ok=True)
+        np.save(os.path.join(tmp, "points.npy"), points)
+        if colors is not None:
+            np.save(os.path.join(tmp, "colors.npy"), colors)
+        with open(os.path.join(tmp, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(dict(self._stamp(), ends=[int(e) for e in ends], shift=[float(v) for v in shift]), f)
+        if os.path.isdir(self.dir):
+            shutil.rmtree(self.dir)
+        os.replace(tmp, self.dir)
+
+    def build(self, pcd):
+        """点群からLODを作って保存し、(点, 色 または None, ends, shift) を返す（保存できなくても表示は続ける）"""
+        pts = np.asarray(pcd.points)
+        order, ends = build_lod_order(pts, self.levels, self.base_res)
+        shift = pts.min(axis=0).astype(np.float64) if pts.shape[0] > 0 else np.zeros((3,))
+        points = (pts[order] - shift).astype(np.float32)
+        colors = np.asarray(pcd.colors)[order].astype(np.float32) if len(pcd.colors) > 0 else None
+        try:
+            self.save(points, colors, ends, shift)
+        except OSError as e:
+            print(f"LODキャッシュを保存できませんでした（{e}）: {self.dir}")
+        return points, colors, ends, shift
+
 
 class DisplayPCV:
     def __init__(self, input_path):
         self.input_path = input_path
         self.time_tracker = TimeTracker()
 
-    def display(self):
-        """入力パスのファイルを読み込み、点群を表示"""
+    def _check_file(self):
         if os.path.isdir(self.input_path):
             print(f"ディレクトリが指定されました: {self.input_path}")
             files = [f for f in os.listdir(self.input_path)]
             print("ディレクトリ内のファイル:", files)
-            return
+            return False
 
         if not os.path.isfile(self.input_path):
             print("指定されたパスがファイルではありません。")
-            return
+            return False
+        return True
 
-        self.time_tracker.start() # 計測開始
-        
+    def _read_pcd(self):
+        """入力ファイルを点群として読み込む（OFFはメッシュから点をサンプリング）。失敗したら None"""
         ext = os.path.splitext(self.input_path)[1].lower()
         print(f"読み込み中: {self.input_path} (拡張子: {ext})")
 
@@ -34,7 +139,7 @@ class DisplayPCV:
             mesh = o3d.io.read_triangle_mesh(self.input_path)
             if mesh.is_empty():
                 print("メッシュデータの読み込みに失敗しました。")
-                return
+                return None
 
             print(mesh)
             print(f"Vertices数: {len(mesh.vertices)}, Triangles数: {len(mesh.triangles)}")
@@ -42,32 +147,24 @@ class DisplayPCV:
             # 点群サンプリング
             pcd = mesh.sample_points_uniformly(number_of_points=len(mesh.triangles))
             print("メッシュを点群に変換しました。")
-
-            self.time_tracker.stop() # 計測終了
-            self.time_tracker.print_elapsed(str = "読み込み/変換時間")  # 経過時間を表示
-            
-            o3d.visualization.draw_geometries([pcd]) # 表示
+            return pcd
 
         elif ext in [".ply", ".pcd", ".xyz"]:
             # 点群ファイルとして読み込み
             pcd = o3d.io.read_point_cloud(self.input_path)
             if pcd.is_empty():
                 print("点群データの読み込みに失敗しました。")
-                return
+                return None
 
             print(pcd)
             print(f"点数: {len(pcd.points)}")
-
-            self.time_tracker.stop() # 計測終了
-            self.time_tracker.print_elapsed(str = "読み込み/変換時間")  # 経過時間を表示
-            
-            o3d.visualization.draw_geometries([pcd]) # 表示
+            return pcd
 
         elif ext == ".pts":
             points = np.loadtxt(self.input_path)
             if points.ndim != 2 or points.shape[1] < 3:
                 print("不正な .pts ファイル形式です。x y z 座標が必要です。")
-                return
+                return None
             pcd = o3d.geometry.PointCloud()
             pcd.points = o3d.utility.Vector3dVector(points[:, :3])
             print(f".pts 読み込み完了。点数: {points.shape[0]}")
@@ -82,9 +179,172 @@ class DisplayPCV:
                     print(f".seg 読み込み完了。ラベル数: {num_labels}")
                 else:
                     print(".seg の点数が一致しません。カラー付与をスキップ。")
+            return pcd
 
         else:
             print(f"サポートされていないファイル形式: {ext}")
+            return None
+
+    def display(self):
+        """入力パスのファイルを読み込み、点群を表示"""
+        if not self._check_file():
+            return
+
+        self.time_tracker.start() # 計測開始
+        pcd = self._read_pcd()
+        if pcd is None:
+            return
+
+        self.time_tracker.stop() # 計測終了
+        self.time_tracker.print_elapsed(str = "読み込み/変換時間")  # 経過時間を表示
+
+        o3d.visualization.draw_geometries([pcd]) # 表示
+
+    def _iter_preview(self, preview_points):
+        """ファイルを先頭から流し読みし、等間隔に間引いた座標 (n,3) を順に返すイテレータ
+        ・直接読めない形式（OFF、binary_compressedのPCDなど）や density/formats.py が無ければ None
+        """
+        ext = os.path.splitext(self.input_path)[1].lower()
+        if iter_xyz_chunks is None or ext not in PREVIEW_SUFFIXES:
+            return None
+        try:
+            n = read_header(self.input_path).num_points
+        except (OSError, ValueError):
+            return None
+        step = max(n // preview_points, 1) if n > 0 else PREVIEW_TEXT_STEP
+
+        def _gen():
+            seen = 0
+            for chunk in iter_xyz_chunks(self.input_path, LOD_STREAM_CHUNK):
+                # チャンクをまたいでも全体で step 点おきになるように開始位置をずらす
+                yield chunk[(-seen) % step::step]
+                seen += chunk.shape[0]
+        return _gen()
+
+    def display_lod(self, levels=LOD_LEVELS, base_res=LOD_BASE_RES, preview_points=100_000):
+        """粗い段から順に表示するLOD表示
+        ・LODキャッシュ（<ファイル名>.lod/）があれば段0だけ読んで即座に表示し、細かい段を1フレームずつ流し込む
+        ・無ければ、ファイルを流し読みして間引いた点（約 preview_points 点）を読めた分から表示しながら、
+          別スレッドで全点を読んでLODを作って保存する（流し読みできない形式は、全点を読んでから間引いて表示する）
+        """
+        if not self._check_file():
+            return
+
+        self.time_tracker.start() # 計測開始
+        cache = LODCache(self.input_path, levels, base_res)
+        lod = cache.load()
+        pcd = o3d.geometry.PointCloud()
+        building = None
+        previews = None
+        result = {}
+        if lod is not None:
+            print(f"LODキャッシュを使用: {cache.dir}")
+            self._set_points(pcd, lod, 0, lod[2][0])
+            shown = int(lod[2][0])
+        else:
+            preview = self._iter_preview(preview_points)
+            src = None
+            if preview is not None:
+                previews = queue.Queue()
+            else:
+                src = self._read_pcd()
+                if src is None:
+                    return
+                # LODができるまでは等間隔に間引いた点を表示する
+                step = max(len(src.points) // preview_points, 1)
+                pcd = src.uniform_down_sample(step) if step > 1 else src
+
+            def _build():
+                nonlocal src
+                if previews is not None:
+                    try:
+                        for part in preview:
+                            previews.put(part)
+                    except Exception as e:  # プレビューが読めなくても全点の読み込みは続ける
+                        print(f"プレビューの読み込みに失敗しました: {e}")
+                    finally:
+                        previews.put(None)  # プレビューの終わり
+                    src = self._read_pcd()
+                    if src is None:
+                        return
+                try:
+                    result["lod"] = cache.build(src)
+                except Exception as e:  # LODが作れなくても間引いた点の表示は続ける
+                    print(f"LODの作成に失敗しました: {e}")
+
+            building = threading.Thread(target=_build, daemon=True)
+            building.start()
+            shown = 0
+            if previews is not None:
+                # 最初のチャンクの分が読めたら表示を始める
+                first = previews.get()
+                if first is None:
+                    # プレビューが出せなければ、LODができるのを待つ
+                    previews = None
+                    building.join()
+                    lod, building = result.get("lod"), None
+                    if lod is None:
+                        return
+                    self._set_points(pcd, lod, 0, lod[2][0])
+                    shown = int(lod[2][0])
+                else:
+                    pcd.points = o3d.utility.Vector3dVector(np.asarray(first, dtype=np.float64))
+
+        self.time_tracker.stop() # 計測終了
+        self.time_tracker.print_elapsed(str = "最初の表示までの時間")  # 経過時間を表示
+
+        vis = o3d.visualization.Visualizer()
+        vis.create_window(window_name=f"LOD: {os.path.basename(self.input_path)}")
+        vis.add_geometry(pcd)
+        level = 0
+        while vis.poll_events():
+            if previews is not None:
+                # 流し読みのプレビューを読めた分だけ追加する
+                parts = []
+                while True:
+                    try:
+                        parts.append(previews.get_nowait())
+                    except queue.Empty:
+                        break
+                done = any(p is None for p in parts)
+                parts = [p for p in parts if p is not None and p.shape[0] > 0]
+                if parts and lod is None:
+                    pcd.points.extend(o3d.utility.Vector3dVector(np.concatenate(parts).astype(np.float64)))
+                    vis.update_geometry(pcd)
+                if done:
+                    previews = None
+                    vis.reset_view_point(True)  # 最初のチャンクに合わせた視点を全体に合わせ直す
+            if lod is None and building is not None and not building.is_alive():
+                # LODができたら段0から表示し直す（視点はそのまま）
+                lod, building = result.get("lod"), None
+                if lod is not None:
+                    self._set_points(pcd, lod, 0, lod[2][0])
+                    shown = int(lod[2][0])
+                    vis.update_geometry(pcd)
+            elif lod is not None and shown < lod[2][-1]:
+                stop = min(shown + LOD_STREAM_CHUNK, int(lod[2][-1]))
+                self._set_points(pcd, lod, shown, stop, append=True)
+                shown = stop
+                vis.update_geometry(pcd)
+                while level < len(lod[2]) and shown >= lod[2][level]:
+                    print(f"LOD段 {level} を表示: {int(lod[2][level])} 点")
+                    level += 1
+            vis.update_renderer()
+        vis.destroy_window()
+
+    @staticmethod
+    def _set_points(pcd, lod, start, stop, append=False):
+        """LODの [start, stop) の点（と色）を点群に設定する（append なら末尾に追加）。座標は shift を足して絶対座標に戻す"""
+        points, colors, _, shift = lod
+        pts = o3d.utility.Vector3dVector(np.asarray(points[start:stop], dtype=np.float64) + shift)
+        cols = o3d.utility.Vector3dVector(np.asarray(colors[start:stop], dtype=np.float64)) if colors is not None else None
+        if append:
+            pcd.points.extend(pts)
+            if cols is not None:
+                pcd.colors.extend(cols)
+        else:
+            pcd.points = pts
+            pcd.colors = cols if cols is not None else o3d.utility.Vector3dVector()
 
 
 if __name__ == "__main__":
@@ -97,6 +357,9 @@ if __name__ == "__main__":
         default=r"F:\Dataset\PU-GAN\simple\armadillo.off",
         help="ファイルパスを指定してください（例: F:\\Dataset\\PU-GAN\\simple\\armadillo.off）"
     )
+    parser.add_argument("--lod", action="store_true", help="粗い段から順に表示する（LODは <ファイル名>.lod/ にキャッシュ）")
+    parser.add_argument("--lod-levels", type=int, default=LOD_LEVELS, help="LODの段数（格子で間引く段の数）")
+    parser.add_argument("--lod-base-res", type=int, default=LOD_BASE_RES, help="LOD段0の格子の1辺の分割数")
 
     args = parser.parse_args()
 
@@ -105,4 +368,7 @@ if __name__ == "__main__":
         exit()
 
     viewer = DisplayPCV(args.data)
-    viewer.display()
\ No newline at end of file
+    if args.lod:
+        viewer.display_lod(levels=args.lod_levels, base_res=args.lod_base_res)
+    else:
+        viewer.display()
\ No newline at end of file
@@ -1,4 +1,44 @@
+"""処理時間の計測
+・TimeTracker    : 1区間だけの簡易ストップウォッチ（従来どおり）
+・StageProfiler  : 名前付きステージを入れ子で計測するプロファイラ
+  ステージごとに perf_counter_ns の所要時間、その時点までのピークRSS、処理点数と点/秒を記録し、
+  JSON/CSV に書き出せる。無効時の stage() は共有のダミーを返すだけなので、ほぼオーバーヘッドがない
+
+使い方例:
+  from assist.time import profiler
+  profiler.enable()
+  with profiler.stage("load") as st:
+      pts = load(path)
+      st.points = len(pts)
+  with profiler.stage("KDE", points=len(pts)):
+      with profiler.stage("query"):       # 入れ子は "KDE/query" として記録される
+          ...
+
+  @profiler.profile("write")
+  def save(...): ...
+
+  profiler.print_report()
+  profiler.save_report("out/profile.json")  # 拡張子 .csv ならCSV
+"""
+
+import csv
+import functools
+import json
+import os
+import sys
 import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+try:
+    import resource  # Unix のみ
+except ImportError:
+    resource = None
+try:
+    import psutil  # Windows でピークRSSを取るため（無ければRSSは記録しない）
+except ImportError:
+    psutil = None
+
 
 class TimeTracker:
     def __init__(self):
@@ -7,19 +47,20 @@ class TimeTracker:
 
     def start(self):
         """計測開始"""
-        self.start_time = time.time()
+        self.start_time = time.perf_counter()
+        self.end_time = None
         print("計測開始")
 
     def stop(self):
         """計測終了"""
-        self.end_time = time.time()
+        self.end_time = time.perf_counter()
         print("計測終了")
 
     def elapsed(self):
         if self.start_time is None:
             return None
         if self.end_time is None:
-            return time.time() - self.start_time  # 計測中の場合
+            return time.perf_counter() - self.start_time  # 計測中の場合
         return self.end_time - self.start_time
 
     def print_elapsed(self, str):
@@ -27,4 +68,184 @@ class TimeTracker:
             print("計測が開始されていません。")
             return
         elapsed_time = self.elapsed()
-        print(f"{str}: {elapsed_time:.2f} 秒")
\ No newline at end of file
+        print(f"{str}: {elapsed_time:.2f} 秒")
+
+
+def peak_rss_bytes() -> Optional[int]:
+    """このプロセスのこれまでのピークRSS[byte]（取れない環境では None）"""
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return int(peak) if sys.platform == "darwin" else int(peak) * 1024  # Linux はKB単位
+    if psutil is not None:
+        info = psutil.Process().memory_info()
+        return int(getattr(info, "peak_wset", info.rss))
+    return None
+
+
+class _Stage:
+    """計測中/計測済みの1ステージ（with の as で受け取り、points を後から設定できる）"""
+    __slots__ = ("profiler", "path", "points", "ns", "peak_rss", "seq", "_t0")
+
+    def __init__(self, profiler, path: str, points: Optional[int]):
+        self.profiler = profiler
+        self.path = path
+        self.points = points
+        self.ns = 0
+        self.peak_rss = None
+        self.seq = 0
+        self._t0 = 0
+
+    @property
+    def seconds(self) -> float:
+        return self.ns * 1e-9
+
+    def __enter__(self):
+        self.seq = self.profiler._seq = self.profiler._seq + 1
+        self.profiler._stack.append(self.path)
+        self._t0 = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        self.ns = time.perf_counter_ns() - self._t0
+        self.peak_rss = peak_rss_bytes()
+        self.profiler._stack.pop()
+        self.profiler.records.append(self)
+        return False
+
+
+class _NullStage:
+    """無効時に返すダミー（何も記録しない）"""
+    __slots__ = ()
+    path = ""
+    ns = 0
+    seconds = 0.0
+    peak_rss = None
+
+    @property
+    def points(self):
+        return None
+
+    @points.setter
+    def points(self, value):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+REPORT_COLUMNS = ("stage", "calls", "seconds", "mean_seconds", "peak_rss_mb", "points", "points_per_sec")
+
+
+class StageProfiler:
+    """名前付きステージの入れ子プロファイラ
+    ・ステージ名は親子を "/" でつないだパス（例: "compute/KDE"）で記録する
+    ・同じパスの複数回の計測はレポートで合算する（calls, seconds, points の合計。ピークRSSは最大）
+    ・スレッド間では共有しないこと（入れ子の判定は1本のスタックで行う）
+    """
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = bool(enabled)
+        self.records: List[_Stage] = []
+        self._stack: List[str] = []
+        self._seq = 0
+
+    def enable(self, enabled: bool = True) -> "StageProfiler":
+        self.enabled = bool(enabled)
+        return self
+
+    def reset(self) -> None:
+        self.records = []
+        self._stack = []
+        self._seq = 0
+
+    def stage(self, name: str, points: Optional[int] = None):
+        """ステージを計測するコンテキストマネージャ（無効時は何もしない）"""
+        if not self.enabled:
+            return _NULL_STAGE
+        path = f"{self._stack[-1]}/{name}" if self._stack else name
+        return _Stage(self, path, points)
+
+    def profile(self, name: Optional[str] = None, points=None):
+        """関数全体をステージとして計測するデコレータ
+        ・name 省略時は関数名
+        ・points に関数を渡すと、戻り値から点数を求める（例: points=len）
+        """
+        def deco(fn):
+            stage_name = name or fn.__name__
+
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return fn(*args, **kwargs)
+                with self.stage(stage_name) as st:
+                    out = fn(*args, **kwargs)
+                    if points is not None:
+                        st.points = points(out)
+                return out
+            return wrapper
+        return deco
+
+    # --- レポート ---
+    def report(self) -> List[Dict]:
+        """ステージのパスごとに集計した行（最初に開始した順なので、親は子より前に来る）"""
+        rows: Dict[str, Dict] = {}
+        for r in self.records:
+            row = rows.setdefault(r.path, {"stage": r.path, "seq": r.seq, "calls": 0, "ns": 0, "peak_rss": None,
+                                           "points": None})
+            row["seq"] = min(row["seq"], r.seq)
+            row["calls"] += 1
+            row["ns"] += r.ns
+            if r.peak_rss is not None:
+                row["peak_rss"] = max(row["peak_rss"] or 0, r.peak_rss)
+            if r.points is not None:
+                row["points"] = (row["points"] or 0) + int(r.points)
+        out = []
+        for row in sorted(rows.values(), key=lambda x: x["seq"]):
+            sec = row["ns"] * 1e-9
+            out.append({
+                "stage": row["stage"],
+                "calls": row["calls"],
+                "seconds": round(sec, 6),
+                "mean_seconds": round(sec / row["calls"], 6),
+                "peak_rss_mb": round(row["peak_rss"] / 2 ** 20, 1) if row["peak_rss"] is not None else None,
+                "points": row["points"],
+                "points_per_sec": round(row["points"] / sec, 1) if row["points"] is not None and sec > 0 else None,
+            })
+        return out
+
+    def print_report(self) -> None:
+        rows = self.report()
+        if not rows:
+            return
+        print(f"{'stage':<32} {'calls':>5} {'sec':>10} {'peakRSS[MB]':>12} {'points':>12} {'pts/s':>14}")
+        for r in rows:
+            depth = r["stage"].count("/")
+            label = "  " * depth + r["stage"].rsplit("/", 1)[-1]
+            rss = "-" if r["peak_rss_mb"] is None else f"{r['peak_rss_mb']:.1f}"
+            pts = "-" if r["points"] is None else f"{r['points']:,}"
+            pps = "-" if r["points_per_sec"] is None else f"{r['points_per_sec']:,.0f}"
+            print(f"{label:<32} {r['calls']:>5} {r['seconds']:>10.3f} {rss:>12} {pts:>12} {pps:>14}")
+
+    def save_report(self, path) -> Path:
+        """レポートを書き出す（拡張子 .csv ならCSV、それ以外はJSON）"""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        rows = self.report()
+        if path.suffix.lower() == ".csv":
+            with path.open("w", newline="", encoding="utf-8") as f:
+                w = csv.DictWriter(f, fieldnames=REPORT_COLUMNS)
+                w.writeheader()
+                w.writerows(rows)
+        else:
+            with path.open("w", encoding="utf-8") as f:
+                json.dump({"pid": os.getpid(), "stages": rows}, f, ensure_ascii=False, indent=1)
+        return path
+
+
+# スクリプト間で共有する既定のプロファイラ（既定では無効）
+profiler = StageProfiler(enabled=False)
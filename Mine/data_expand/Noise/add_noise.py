@@ -1,5 +1,11 @@
+import sys
+from pathlib import Path
 import numpy as np
 
+# 共有のボクセル索引（Mine/density/voxel_grid.py）
+sys.path.append(str(Path(__file__).resolve().parents[2] / "density"))
+from voxel_grid import VoxelGrid
+
 def add_noise_to_random_voxel(
     points: np.ndarray,
     voxel_size: float,
@@ -22,26 +28,19 @@ def add_noise_to_random_voxel(
         raise ValueError("pointsは(N,3)の配列である必要がある")
 
     rng = np.random.default_rng(seed)
-    pmin = np.min(points, axis=0)
-    voxel_indices = np.floor((points - pmin) / voxel_size).astype(np.int32)
-
-    # 各occupied voxelに属する点のインデックスを収集
-    voxel_to_indices = {}
-    for i, idx in enumerate(voxel_indices):
-        key = tuple(idx)
-        voxel_to_indices.setdefault(key, []).append(i)
 
-    occupied_keys = list(voxel_to_indices.keys())
-    if len(occupied_keys) == 0:
+    # occupied voxel（点が存在するボクセル）の索引を作る
+    grid = VoxelGrid(points, voxel_size)
+    if grid.num_voxels == 0:
         raise ValueError("occupied voxelが見つかりませんでした")
 
-    select_k = min(3, len(occupied_keys))
-    selected_keys = rng.choice(occupied_keys, size=select_k, replace=False)
+    select_k = min(3, grid.num_voxels)
+    selected = rng.choice(grid.num_voxels, size=select_k, replace=False)
 
     # ノイズを加える
     points_new = points.copy()
-    for key in selected_keys:
-        indices = voxel_to_indices[key]
+    for v in selected:
+        indices = grid.point_indices(v)
         noise = rng.normal(loc=0.0, scale=noise_std, size=(len(indices), 3))
         points_new[indices] += noise
 
@@ -1,9 +1,14 @@
 import os
+import sys
+from pathlib import Path
 import numpy as np
 import open3d as o3d
 
 from file_road import get_files, get_single_file_name
 
+sys.path.append(str(Path(__file__).resolve().parents[2] / "density"))
+from formats import read_xyz
+
 """
 # 入力と出力ファイル
 input_off = r"F:\Experiments\MasterEx\demo\AncientTurtl_aligned.off"
@@ -21,33 +26,13 @@ def convert_off_to_pcd(input_path, output_path):
 
     for file in input_files:
         if file.lower().endswith('.off'):  # 拡張子が.offの場合のみ処理
-            # OFFファイルを読み込み
-            with open(file, 'r') as f:
-                lines = f.readlines()
-
-
-            # BOM除去
-            header_line = lines[0].strip().replace('\ufeff', '')
-
-            # OFF判定 + 頂点数・面数取得
-            if header_line == "OFF":
-                # 通常形式
-                n_vertices, n_faces, _ = map(int, lines[1].strip().split())
-                vertex_start_index = 2
-            elif header_line.startswith("OFF"):
-                # 省略形式
-                parts = header_line[3:].strip().split()
-                n_vertices, n_faces, _ = map(int, parts)
-                vertex_start_index = 1
-            else:
-                print(f"スキップ: {file} はOFF形式ではありません (先頭行: {header_line})")
+            # OFFファイルを読み込み（ヘッダ解析は通常形式・省略形式・BOMに対応。頂点行だけを数値化）
+            try:
+                vertices = read_xyz(Path(file))
+            except ValueError as e:
+                print(f"スキップ: {file} はOFF形式ではありません ({e})")
                 continue
-
-            # 頂点数と面数を取得
-            #n_vertices, n_faces, _ = map(int, lines[1].strip().split())
-
-            # 頂点座標の読み込み
-            vertices = np.array([list(map(float, line.strip().split())) for line in lines[2:2 + n_vertices]])
+            n_vertices = vertices.shape[0]
 
             print(f"変換中: {file}, 頂点数: {n_vertices}")
 
@@ -1,9 +1,14 @@
 import os
+import sys
+from pathlib import Path
 import numpy as np
 import open3d as o3d
 
 from file_road import get_files, get_single_file_name
 
+sys.path.append(str(Path(__file__).resolve().parents[2] / "density"))
+from formats import read_xyz
+
 # 入力と出力ファイル
 input_file_path = r"..\..\Dataset\PartAnnotation\04379243\points"
 input_files = get_files(input_file_path)
@@ -18,12 +23,8 @@ def convert_pts_to_pcd(input_files, output_path):
     
     for file in input_files:
         if file.lower().endswith('.pts'):  # .ptsファイルのみ処理
-            # PTSファイルを読み込み（各行: x y z）
-            with open(file, 'r') as f:
-                lines = f.readlines()
-
-            # 数値データに変換
-            vertices = np.array([list(map(float, line.strip().split())) for line in lines])
+            # PTSファイルを読み込み（各行: x y z）。np.loadtxtで一括して数値化する
+            vertices = read_xyz(Path(file))
 
             print(f"変換中: {file}, 頂点数: {len(vertices)}")
 
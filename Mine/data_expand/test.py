@@ -1,9 +1,14 @@
 import os
+import sys
 import numpy as np
 import open3d as o3d
 from pathlib import Path
 
-from DownSample.partial import numpy_to_pcd, voxel_index, fps_indices
+from DownSample.partial import numpy_to_pcd, fps_indices
+
+# 共有のボクセル索引（Mine/density/voxel_grid.py）
+sys.path.append(str(Path(__file__).resolve().parents[1] / "density"))
+from voxel_grid import VoxelGrid
 
 # ---------- 設定 ----------
 PCD_PATH = r"F:\Experiments\MasterEx\pcd-dataset\PU-GAN\complex\AncientTurtl_aligned.pcd"
@@ -20,47 +25,31 @@ if pcd.is_empty():
     raise RuntimeError(f"点群が読み込めない: {PCD_PATH}")
 pts = np.asarray(pcd.points, dtype=np.float64)
 
-# ---------- Voxel分割 ----------
-pmin = np.min(pts, axis=0)
-v_indices = voxel_index(pts, pmin, VOXEL_SIZE)
-
-# ---------- occupied voxel（点が存在するボクセル）を収集 ----------
-voxel_to_indices = {}
-for i, idx in enumerate(v_indices):
-    key = tuple(idx)
-    voxel_to_indices.setdefault(key, []).append(i)
+# ---------- Voxel分割（occupied voxelの索引） ----------
+grid = VoxelGrid(pts, VOXEL_SIZE)
 
 # ---------- occupied voxel からランダムに複数個選択 ----------
 rng = np.random.default_rng()
-occupied_keys = list(voxel_to_indices.keys())
-select_k = min(3, len(occupied_keys))
-chosen_keys = rng.choice(occupied_keys, size=select_k, replace=False)
+select_k = min(3, grid.num_voxels)
+chosen = rng.choice(grid.num_voxels, size=select_k, replace=False)
 
 # ---------- FPS＋ノイズ（選ばれたボクセルのみ） ----------
-kept_points = []
 noisy_points = []
 original_points = []
 
-for key, indices in voxel_to_indices.items():
-    voxel_pts = pts[indices]
-    if key in chosen_keys:
-        k = max(3, int(len(voxel_pts) * DS_RATIO1))
-        if len(voxel_pts) < k:
-            continue  # 小さすぎる場合はスキップ
-        idx = fps_indices(voxel_pts, k, seed=rng.integers(0, 10000))
-        selected = voxel_pts[idx]
-        noise = rng.normal(loc=0.0, scale=NOISE_STD, size=selected.shape)
-        noisy_points.append(selected + noise)
-        original_points.append(selected)
-    else:
-        """
-        k = max(3, int(len(voxel_pts) * DS_RATIO2))
-        if len(voxel_pts) < k:
-            continue  # 小さすぎる場合はスキップ
-        idx = fps_indices(voxel_pts, k, seed=rng.integers(0, 10000))
-        selected = voxel_pts[idx]
-        """
-        kept_points.append(voxel_pts)
+for v in chosen:
+    voxel_pts = grid.voxel_points(v)
+    k = max(3, int(len(voxel_pts) * DS_RATIO1))
+    if len(voxel_pts) < k:
+        continue  # 小さすぎる場合はスキップ
+    idx = fps_indices(voxel_pts, k, seed=rng.integers(0, 10000))
+    selected = voxel_pts[idx]
+    noise = rng.normal(loc=0.0, scale=NOISE_STD, size=selected.shape)
+    noisy_points.append(selected + noise)
+    original_points.append(selected)
+
+# 選ばれなかったボクセルの点はそのまま残す
+kept_points = [pts[~np.isin(grid.inverse, chosen)]]
 
 # ---------- 統合 ----------
 kept = np.concatenate(kept_points, axis=0)
@@ -1,10 +1,12 @@
 import os
+import sys
 import numpy as np
 import open3d as o3d
 from pathlib import Path
 
-def voxel_index(points: np.ndarray, origin: np.ndarray, voxel_size: float) -> np.ndarray:
-    return np.floor((points - origin) / voxel_size).astype(np.int32)
+# 共有のボクセル索引（Mine/density/voxel_grid.py）
+sys.path.append(str(Path(__file__).resolve().parents[1] / "density"))
+from voxel_grid import VoxelGrid
 
 PCD_PATH = r"F:\Experiments\MasterEx\pcd-dataset\PU-GAN\complex\AncientTurtl_aligned.pcd"
 VOXEL_SIZE = 0.05
@@ -17,13 +19,14 @@ if pcd.is_empty():
     raise RuntimeError(f"点群が読み込めない: {PCD_PATH}")
 pts = np.asarray(pcd.points, dtype=np.float64)
 
-pmin = np.min(pts, axis=0)
-v_indices = voxel_index(pts, pmin, VOXEL_SIZE)
+# 原点はAABB最小（floorでボクセル番号を求める）
+grid = VoxelGrid(pts, VOXEL_SIZE)
 
 for i in range(20):
-    #print(f"p:{pmin}, v:{v_indices[i]}")
+    #print(f"p:{grid.origin}, v:{grid.index_ijk[grid.inverse[i]]}")
     print(f'{np.floor((2.4 - (-1.0)) / 0.5).astype(np.int32)}')
 
-print(f"{np.random.default_rng()}\n {list(voxel_to_indices.keys())}
-select_k = min(3, len(occupied_keys))
-chosen_keys = rng.choice(occupied_keys, size=select_k, replace=False)")
\ No newline at end of file
+rng = np.random.default_rng()
+print(f"{rng}\n {grid.index_ijk[:10].tolist()}")
+select_k = min(3, grid.num_voxels)
+chosen_keys = rng.choice(grid.num_voxels, size=select_k, replace=False)
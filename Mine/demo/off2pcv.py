@@ -1,9 +1,14 @@
 import os
+import sys
+from pathlib import Path
 import numpy as np
 import open3d as o3d
 
 from data_expand.file_road import get_files, get_single_file_name
 
+sys.path.append(str(Path(__file__).resolve().parents[1] / "density"))
+from formats import read_xyz
+
 # 入力と出力ファイル
 input_file_path = r"..\..\Dataset\ModelNet40\cone\train"
 input_files = get_files(input_file_path)
@@ -17,29 +22,13 @@ def convert_off_to_pcd(input_files, output_path):
 
     for idx, file in enumerate(input_files):
         if file.lower().endswith('.off'):
-            with open(file, 'r') as f:
-                lines = f.readlines()
-
-            # BOM除去
-            header_line = lines[0].strip().replace('\ufeff', '')
-
-            # OFF判定 + 頂点数・面数取得
-            if header_line == "OFF":
-                n_vertices, n_faces, _ = map(int, lines[1].strip().split())
-                vertex_start_index = 2
-            elif header_line.startswith("OFF"):
-                parts = header_line[3:].strip().split()
-                n_vertices, n_faces, _ = map(int, parts)
-                vertex_start_index = 1
-            else:
-                print(f"スキップ: {file} はOFF形式ではありません (先頭行: {header_line})")
+            # OFF判定・頂点数取得（BOM・省略形式にも対応）と頂点座標の読み込み
+            try:
+                vertices = read_xyz(Path(file))
+            except ValueError as e:
+                print(f"スキップ: {file} はOFF形式ではありません ({e})")
                 continue
-
-            # 頂点座標の読み込み
-            vertices = np.array([
-                list(map(float, line.strip().split()))
-                for line in lines[vertex_start_index:vertex_start_index + n_vertices]
-            ])
+            n_vertices = vertices.shape[0]
 
             print(f"変換中: {file}, 頂点数: {n_vertices}")
 
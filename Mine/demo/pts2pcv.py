@@ -1,9 +1,14 @@
 import os
+import sys
+from pathlib import Path
 import numpy as np
 import open3d as o3d
 
 from data_expand.file_road import get_files, get_single_file_name
 
+sys.path.append(str(Path(__file__).resolve().parents[1] / "density"))
+from formats import read_xyz
+
 # 入力と出力ファイル
 input_file_path = r"..\..\Dataset\PartAnnotation\03636649\points"
 input_files = get_files(input_file_path)
@@ -14,12 +19,8 @@ def convert_one_pts_to_pcd(input_file, output_path):
         os.makedirs(output_path)  # 出力フォルダがなければ作成
 
     if input_file.lower().endswith('.pts'):  # .ptsファイルのみ処理
-        # PTSファイルを読み込み（各行: x y z）
-        with open(input_file, 'r') as f:
-            lines = f.readlines()
-
-        # 数値データに変換
-        vertices = np.array([list(map(float, line.strip().split())) for line in lines])
+        # PTSファイルを読み込み（各行: x y z）。np.loadtxtで一括して数値化する
+        vertices = read_xyz(Path(input_file))
 
         print(f"変換中: {input_file}, 頂点数: {len(vertices)}")
 
@@ -9,11 +9,25 @@ from utility import aabb_of_points
 import numpy as np
 from typing import Tuple
 
-def parse_args() -> argparse.Namespace:
+# detect2.py（旧版のスクリプト）が扱うモード
+DETECT2_MODES = ["voxel", "kde"]
+
+
+def _build_parser(full: bool) -> argparse.ArgumentParser:
+    """detect.py（full=True）と detect2.py（full=False）の引数
+    ・detect2.py は voxel/kde だけを扱い、精度・キャッシュ・プロファイル・ストリーミング・出力形式・
+      適応帯域幅/疎グリッドのKDE・pyramid/point を使わないので、それらの引数は持たない（黙って無視しない）
+    """
     p = argparse.ArgumentParser(description="点群密度解析システム（Voxel/KDE）")
-    p.add_argument("--input", type=Path, required=True, help="入力点群ファイル（.pcd/.plyなど）")
-    p.add_argument("--mode", choices=["voxel", "kde"], required=True, help="密度計算モード")
-    p.add_argument("--voxel-size", nargs=3, type=float, required=True, metavar=("SX", "SY", "SZ"), help="ボクセルサイズ[m]")
+    p.add_argument("--input", type=Path, required=True,
+                help="入力点群ファイル（.pcd/.plyなど）。--batch時はディレクトリまたはグロブ")
+    if full:
+        p.add_argument("--mode", choices=["voxel", "kde", "pyramid", "point"], required=True,
+                    help="密度計算モード（pyramid: 多解像度ボクセル密度を1回の走査で計算 / point: 入力点ごとの密度）")
+    else:
+        p.add_argument("--mode", choices=DETECT2_MODES, required=True, help="密度計算モード")
+    p.add_argument("--voxel-size", nargs=3, type=float, default=None, metavar=("SX", "SY", "SZ"),
+                help="ボクセルサイズ[m]（point以外のモードで必須）")
     # 未指定なら detect.py 側で入力から自動生成
     p.add_argument("--output-prefix", type=Path, required=False, default=None,
                 help="出力の接頭辞（未指定時は入力パスから自動生成）")
@@ -23,17 +37,108 @@ def parse_args() -> argparse.Namespace:
                 help="入力パスをこの直下にミラーして出力する（既定: out）")
 
 
+    # 精度
+    if full:
+        p.add_argument("--dtype", choices=["float64", "float32"], default="float64",
+                    help="点群と密度/KDE値の精度。float32の点群はAABB最小を引いた局所座標で持ち、出力の座標はfloat64の絶対座標")
+
+    # バッチ（ディレクトリ/グロブ単位の一括処理）
+    p.add_argument("--batch", action="store_true",
+                help="--input 配下の全ファイルを --workers 個のプロセスで処理する（完了分はマニフェストで再開時にスキップ）")
+    p.add_argument("--pattern", type=str, default="*.pcd", help="--batch で --input がディレクトリのときの検索パターン")
+    p.add_argument("--manifest", type=Path, default=None, help="バッチのマニフェスト（既定: <out-root>/manifest.jsonl）")
+    p.add_argument("--force", action="store_true", help="マニフェストを無視して全ファイルを再計算する")
+
+    if full:
+        # 結果キャッシュ（同じ入力・同じパラメータの再計算を省く）
+        p.add_argument("--no-cache", action="store_true", help="結果キャッシュを使わない（読みも書きもしない）")
+        p.add_argument("--cache-dir", type=Path, default=None, help="結果キャッシュの場所（既定: <out-root>/.cache）")
+        p.add_argument("--cache-max-gb", type=float, default=4.0, help="結果キャッシュの上限[GB]（超えたら古い順に消す）")
+
+        # プロファイル（段ごとの時間・ピークメモリ・点/秒）
+        p.add_argument("--profile", action="store_true", help="読み込み/ボクセル化/KDE/書き出しなどの段ごとの計測結果を表示する")
+        p.add_argument("--profile-out", type=Path, default=None, help="計測結果の保存先（.json または .csv。指定すれば --profile なしでも計測する）")
+
+        # ストリーミング（アウトオブコア）
+        p.add_argument("--stream", action="store_true", help="点群をチャンク単位で読み、全点をメモリに載せずに集計する")
+        p.add_argument("--chunk-size", type=int, default=1_000_000, help="--stream時の1チャンクの点数")
+
+        # 並列実行（タイル分割＋プロセスプール）
+        p.add_argument("--workers", type=int, default=1, help="並列プロセス数（1なら単一プロセス。--batch時はファイル単位で並列化する）")
+    else:
+        p.add_argument("--workers", type=int, default=1, help="--batch時にファイル単位で並列化するプロセス数")
+
     # voxel
     p.add_argument("--voxel-origin", nargs=3, type=float, default=None, metavar=("OX", "OY", "OZ"), help="ボクセル原点（未指定はAABB最小）")
 
+    # pyramid
+    if full:
+        p.add_argument("--pyramid-levels", type=int, default=4, help="ピラミッドの段数（基準, ×2, ×4, ...）")
+
     # kde
     p.add_argument("--grid-U", type=int, default=16, help="RoIグリッド解像度（U×U×U）")
     p.add_argument("--radius", type=float, default=0.3, help="Ball Query半径[m]")
     p.add_argument("--sigma", type=float, default=0.25, help="KDE帯域幅σ[m]")
     p.add_argument("--roi", nargs='+', default=["auto"], help="RoI: auto または xmin ymin zmin xmax ymax zmax")
+    p.add_argument("--kde-engine", choices=["loop", "batched", "binned"], default="batched",
+                help="KDEの実装（loop: 1点ずつ探索 / batched: 一括探索 / binned: 格子ビニング＋FFT近似。既定: batched）")
+    if full:
+        p.add_argument("--kde-bandwidth", choices=["fixed", "knn"], default="fixed",
+                    help="KDEの帯域幅（fixed: --sigma を全体で使う / knn: k近傍距離から点ごとに決める適応帯域幅）")
+        p.add_argument("--knn-k", type=int, default=8, help="--kde-bandwidth knn のk（k番目の近傍重心までの距離を使う）")
+        p.add_argument("--knn-alpha", type=float, default=1.0, help="--kde-bandwidth knn の帯域幅の倍率（σ = α·d_k）")
+        p.add_argument("--adaptive-estimator", choices=["sample", "balloon"], default="sample",
+                    help="適応帯域幅の推定量（sample: 重心ごとのσ / balloon: グリッド点ごとのσ）")
+        p.add_argument("--kernel-support", type=float, default=4.0, help="適応帯域幅でカーネルを打ち切る距離（σの倍数）")
+        p.add_argument("--kde-grid", choices=["dense", "sparse"], default="dense",
+                    help="KDEのグリッド（dense: U×U×U全点 / sparse: 重心から --radius 以内の格子点だけを評価し、(座標,値)の疎な配列で出力）")
+        p.add_argument("--refine-levels", type=int, default=0,
+                    help="--kde-grid sparse で、勾配の大きいセルを八分木状に細分する段数")
+        p.add_argument("--refine-quantile", type=float, default=0.9,
+                    help="細分するセルの勾配の分位（0.9なら各段で勾配が上位10%%のセルを細分）")
+        # point
+        p.add_argument("--point-estimator", choices=["count", "kde"], default="count",
+                    help="--mode point の密度（count: --radius 内の点数/球の体積 / kde: --radius 内のガウスカーネル平均（--sigma））")
+
+        p.add_argument("--output-format", nargs="+", choices=["csv", "npz", "npy", "parquet", "arrow"], default=["csv", "npy"],
+                    help="結果の出力形式（複数可。既定: csv npy）。csv: CSV / npz: 圧縮NPZ（従来形式）/ "
+                         "npy: 結果ディレクトリ（<名前>_result/、メモリマップで読める）/ parquet / arrow: Arrow IPC。"
+                         "pyramid は npz なら全レベルを <名前>_pyramid.npz に、それ以外はレベルごとに <名前>_L<l> に書く")
     p.add_argument("--export-ply", action="store_true", help="可視化用PLYを書き出す")
 
-    return p.parse_args()
+    # 低密度の抽出（voxelモード）
+    p.add_argument("--lowest-k", type=int, default=10, help="detect2.py で書き出す低密度ボクセルの個数（Top-K）")
+    p.add_argument("--low-regions", action="store_true",
+                help="隣接する低密度ボクセルを連結成分（低密度領域）にまとめ、領域ごとの統計を書き出す")
+    p.add_argument("--low-threshold", type=float, default=None, help="低密度とみなす密度の上限（絶対値）")
+    p.add_argument("--low-percentile", type=float, default=None,
+                help="低密度とみなす密度の上限（密度分布のパーセンタイル。--low-threshold と併用不可。既定: 10）")
+    p.add_argument("--connectivity", type=int, choices=[6, 26], default=26, help="低密度領域の連結の定義（6/26近傍）")
+    p.add_argument("--region-min-voxels", type=int, default=1, help="これより小さい低密度領域は出力しない")
+
+    return p
+
+
+def _check_args(p: argparse.ArgumentParser, args: argparse.Namespace) -> argparse.Namespace:
+    if args.voxel_size is None and args.mode != "point":
+        p.error(f"--mode {args.mode} では --voxel-size が必要")
+    if getattr(args, "stream", False) and args.mode == "point":
+        p.error("--mode point は全点を使うので --stream とは併用できない")
+    if args.low_threshold is None and args.low_percentile is None:
+        args.low_percentile = 10.0
+    return args
+
+
+def parse_args() -> argparse.Namespace:
+    """detect.py の引数"""
+    p = _build_parser(full=True)
+    return _check_args(p, p.parse_args())
+
+
+def parse_detect2_args() -> argparse.Namespace:
+    """detect2.py の引数（voxel/kde のみ。detect2.py が使わない引数は受け付けない）"""
+    p = _build_parser(full=False)
+    return _check_args(p, p.parse_args())
 
 
 def parse_roi(arg: List[str], points: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
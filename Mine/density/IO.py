@@ -1,37 +1,104 @@
 """
 PointCloudIOクラス
 点群の読み込みと書き出しを担当します。
-このクラスは、Open3Dライブラリを使用して点群データを処理します。
+PCD/PLY/OFF/XYZ/PTSは formats.py で直接読み、それ以外の形式と書き出しにはOpen3Dを使います。
+（直接読める形式だけを扱うなら、Open3Dが無い環境でも読み込みは動きます）
 """
 
 import numpy as np
 from pathlib import Path   
-import open3d as o3d
-from typing import Tuple, Union
+from typing import Iterator, Optional, Tuple, Union
 import os
 
-from utility import ensure_dir, aabb_of_points, voxel_index, voxel_center_from_index
+try:
+    import open3d as o3d
+except ImportError:  # pragma: no cover
+    o3d = None
+
+from utility import ensure_dir, aabb_of_points, voxel_index, voxel_center_from_index, local_shift, as_shift
+from formats import iter_xyz_chunks, scan_aabb, read_xyz, read_cloud, shift_to_local, UnsupportedFormatError
+
+
+def _require_open3d() -> None:
+    if o3d is None:
+        raise ImportError("この形式の読み書きにはOpen3Dが必要である。`pip install open3d` を実行すること。")
 
 
 class PointCloudIO:
     """点群の読み込み/書き出しを担当"""
 
     @staticmethod
-    def load_points(path: Path) -> np.ndarray:
-        """PCD/PLY等をOpen3Dで読み込み、Nx3のnumpy配列を返す
+    def load_points(path: Path, dtype=np.float64, shift: Optional[np.ndarray] = None) -> np.ndarray:
+        """PCD/PLY等を読み込み、Nx3のnumpy配列（dtype）を返す
         ・座標以外の属性（法線・色・強度など）は無視
+        ・float32のPCDを dtype=float32 で読めば、変換もコピーも1回で済む
+        ・PCD/PLY/OFF/XYZ/PTSは直接読む（バイナリはmemmapからxyzだけを1回コピー）
+        ・それ以外（binary_compressedのPCDなど）はOpen3Dで読む
+        ・shift を与えると、float64 のまま shift を引いてから dtype にした局所座標を返す
         """
-        pcd = o3d.io.read_point_cloud(str(path))
-        if pcd is None or len(pcd.points) == 0:
+        try:
+            pts = read_xyz(Path(path), dtype=dtype, shift=shift)
+        except UnsupportedFormatError:
+            _require_open3d()
+            pcd = o3d.io.read_point_cloud(str(path))
+            if pcd is None or len(pcd.points) == 0:
+                raise ValueError(f"点群が空、または読み込めない: {path}")
+            xyz = np.asarray(pcd.points)
+            pts = np.asarray(xyz, dtype=dtype) if shift is None else shift_to_local(xyz, shift, dtype)
+        if pts.shape[0] == 0:
             raise ValueError(f"点群が空、または読み込めない: {path}")
-        pts = np.asarray(pcd.points, dtype=np.float64)
         return pts
 
+    @staticmethod
+    def load_local_points(path: Path, dtype=np.float64) -> Tuple[np.ndarray, np.ndarray]:
+        """点群を局所座標で読み、(点[N,3]（dtype）, 局所原点 shift[3]（float64）) を返す
+        ・絶対座標は shift + 点（float64で足す）。shift は utility.local_shift（float32 ならAABB最小、float64 なら0）
+        ・float32 は先にAABBだけ走査してから、チャンクごとに shift を引いて変換する
+          （絶対座標のままfloat32にすると、1e5 m の座標では刻みが約8e-3 mになり、ボクセルの所属が変わる）
+        """
+        if np.dtype(dtype) == np.float64:
+            return PointCloudIO.load_points(path, dtype), as_shift(None)
+        try:
+            pmin, _, _ = scan_aabb(Path(path))
+        except UnsupportedFormatError:
+            _require_open3d()
+            pcd = o3d.io.read_point_cloud(str(path))
+            if pcd is None or len(pcd.points) == 0:
+                raise ValueError(f"点群が空、または読み込めない: {path}")
+            xyz = np.asarray(pcd.points)
+            shift = local_shift(xyz.min(axis=0), dtype)
+            return shift_to_local(xyz, shift, dtype), shift
+        shift = local_shift(pmin, dtype)
+        return PointCloudIO.load_points(path, dtype, shift), shift
+
+    @staticmethod
+    def load_cloud(path: Path) -> np.ndarray:
+        """点群を全属性付きの構造化配列で読む（rec["x"], rec["intensity"] など）
+        ・バイナリPCD/PLYは読み取り専用のmemmapをそのまま返す
+        """
+        return read_cloud(Path(path))
+
+    @staticmethod
+    def iter_points(path: Path, chunk_size: int = 1_000_000, dtype=np.float64,
+                    shift: Optional[np.ndarray] = None) -> Iterator[np.ndarray]:
+        """PCD/PLY/XYZを chunk_size 点ずつ読み、(n,3)のnumpy配列を順に返す
+        ・ファイル全体を読み込まないので、RAMより大きい点群にも使える
+        ・shift を与えると、チャンクごとに shift を引いた局所座標を返す（load_points と同じ）
+        """
+        return iter_xyz_chunks(Path(path), chunk_size, dtype, shift)
+
+    @staticmethod
+    def scan_aabb(path: Path, chunk_size: int = 1_000_000) -> Tuple[np.ndarray, np.ndarray]:
+        """ファイルをチャンク単位で1回走査し、AABB (min_xyz, max_xyz) を返す"""
+        pmin, pmax, _ = scan_aabb(Path(path), chunk_size)
+        return pmin, pmax
+
     @staticmethod
     def save_points_with_scalar(points: np.ndarray, scalar: np.ndarray, out_ply: Path) -> None:
         """各点にスカラー値（例：密度）を持つ点群をPLYで保存
         ・可視化しやすいようにスカラーを0-1で正規化して色付け（グレースケール）
         """
+        _require_open3d()
         ensure_dir(out_ply)
         s = scalar.astype(np.float64)
         if s.size == 0:
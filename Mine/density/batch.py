@@ -0,0 +1,197 @@
+# density/batch.py
+# -*- coding: utf-8 -*-
+"""ディレクトリ/グロブ単位のバッチ実行と再開用マニフェスト
+・入力ファイルをプロセスプールに流し、Python/Open3D/NumPyの起動コストをワーカー数回分に抑える
+・完了したファイルはマニフェスト（JSON Lines、追記のみ）に入力ハッシュとパラメータ付きで記録する
+・再実行時は「入力もパラメータも同じで出力が揃っている」ファイルを飛ばすので、中断したバッチを再開できる
+"""
+
+import glob
+import hashlib
+import json
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from utility import ensure_dir, derive_output_prefix
+
+_GLOB_CHARS = ("*", "?", "[")
+
+
+def expand_inputs(spec: Path, pattern: str = "*.pcd") -> Tuple[List[Path], Optional[Path]]:
+    """ディレクトリまたはグロブから入力ファイルを列挙する
+    戻り値: (入力ファイル一覧, 出力をミラーする基準ディレクトリ)
+    ・ディレクトリ: 配下を再帰的に pattern で探す
+    ・グロブ    : そのまま展開する（** も可）。基準はグロブ記号より手前のディレクトリ
+    """
+    s = str(spec)
+    if any(c in s for c in _GLOB_CHARS):
+        files = [Path(p) for p in glob.glob(s, recursive=True)]
+        head = []
+        for part in Path(s).parts:
+            if any(c in part for c in _GLOB_CHARS):
+                break
+            head.append(part)
+        base = Path(*head) if head else Path(".")
+    elif Path(spec).is_dir():
+        files = list(Path(spec).rglob(pattern))
+        base = Path(spec)
+    else:
+        raise ValueError(f"--batch の --input はディレクトリかグロブである必要がある: {spec}")
+    files = sorted(p for p in files if p.is_file())
+    if not files:
+        raise ValueError(f"入力ファイルが見つからない: {spec}（pattern={pattern}）")
+    return files, base
+
+
+def file_digest(path: Path, block_size: int = 1 << 20) -> str:
+    """ファイル内容のSHA-1"""
+    h = hashlib.sha1()
+    with Path(path).open("rb") as f:
+        while True:
+            b = f.read(block_size)
+            if not b:
+                break
+            h.update(b)
+    return h.hexdigest()
+
+
+# 計算結果に影響しない引数（マニフェストのパラメータハッシュから除く）
+_NON_PARAM_ARGS = ("input", "output_prefix", "out_root", "batch", "pattern", "manifest", "force", "workers",
+                   "no_cache", "cache_dir", "cache_max_gb", "profile", "profile_out")
+
+
+def job_params(args) -> Dict:
+    """argparseの結果から、出力に影響する引数だけを取り出す"""
+    return {k: v for k, v in vars(args).items() if k not in _NON_PARAM_ARGS}
+
+
+def params_digest(params: Dict) -> str:
+    """計算パラメータのハッシュ（キー順に依らない）"""
+    return hashlib.sha1(json.dumps(params, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+class BatchManifest:
+    """完了済み入力の記録（JSON Lines）
+    ・1行1ファイル。同じ入力が複数行あれば最後の行を採用する
+    ・書き込みは親プロセスだけが行うので、ロックは不要
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.entries: Dict[str, Dict] = {}
+        if self.path.exists():
+            with self.path.open("r", encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        e = json.loads(line)
+                    except json.JSONDecodeError:
+                        # 中断で途中まで書かれた最終行は無視する
+                        continue
+                    self.entries[e["input"]] = e
+
+    @staticmethod
+    def key(path: Path) -> str:
+        return str(Path(path).resolve())
+
+    def is_up_to_date(self, path: Path, params_hash: str) -> bool:
+        """前回と同じ入力・同じパラメータで、出力がすべて残っていれば True
+        ・サイズと更新時刻が一致すればハッシュ計算は省く（数千ファイルを読み直さないため）
+        """
+        e = self.entries.get(self.key(path))
+        if e is None or e.get("params") != params_hash:
+            return False
+        if not all(Path(o).exists() for o in e.get("outputs", [])):
+            return False
+        st = Path(path).stat()
+        if e.get("size") == st.st_size and e.get("mtime_ns") == st.st_mtime_ns:
+            return True
+        return e.get("size") == st.st_size and e.get("sha1") == file_digest(path)
+
+    def record(self, path: Path, params_hash: str, outputs: List[Path], seconds: float) -> None:
+        st = Path(path).stat()
+        e = {
+            "input": self.key(path),
+            "size": st.st_size,
+            "mtime_ns": st.st_mtime_ns,
+            "sha1": file_digest(path),
+            "params": params_hash,
+            "outputs": [str(o) for o in outputs],
+            "seconds": round(seconds, 3),
+            "finished": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        }
+        self.entries[e["input"]] = e
+        ensure_dir(self.path)
+        with self.path.open("a", encoding="utf-8") as f:
+            f.write(json.dumps(e, ensure_ascii=False) + "\n")
+            f.flush()
+
+
+def _timed(job: Callable, args, input_path: Path, output_prefix: Path) -> Tuple[List[Path], float]:
+    t0 = time.perf_counter()
+    outputs = job(args, input_path, output_prefix)
+    return outputs, time.perf_counter() - t0
+
+
+def run_batch(job: Callable, args) -> Dict[str, int]:
+    """args.input（ディレクトリ/グロブ）の全ファイルに job(args, input_path, output_prefix) を適用する
+    ・job は出力ファイルのリストを返す、モジュール直下の関数（プロセス間で受け渡すため）
+    ・出力は derive_output_prefix で args.out_root 配下にミラーする
+    ・マニフェストは args.manifest（未指定なら <out_root>/manifest.jsonl）
+    ・args.workers 個のプロセスでファイル単位に並列化し、args.force ならマニフェストを無視する
+    ・失敗したファイルはマニフェストに記録しないので、次回の実行で再試行される
+    戻り値: {"done": 完了数, "skipped": スキップ数, "failed": 失敗数}
+    """
+    workers = int(args.workers)
+    if workers <= 0:
+        raise ValueError("workersは正の整数である必要がある")
+    if args.output_prefix is not None:
+        raise ValueError("--batch では --output-prefix ではなく --out-root を指定すること")
+    files, base = expand_inputs(args.input, args.pattern)
+    manifest = BatchManifest(args.manifest or Path(args.out_root) / "manifest.jsonl")
+    # 同じ出力先でも detect.py と detect2.py は出力が違うので、ジョブのスクリプト名もハッシュに含める
+    p_hash = params_digest(dict(job_params(args), job=Path(job.__code__.co_filename).stem))
+
+    todo = [f for f in files if args.force or not manifest.is_up_to_date(f, p_hash)]
+    stats = {"done": 0, "skipped": len(files) - len(todo), "failed": 0}
+    print(f"[Batch] 入力 {len(files)} 件（スキップ {stats['skipped']} 件, 実行 {len(todo)} 件）")
+    # 大きいファイルから投入し、最後に1つだけ長いジョブが残るのを避ける
+    todo.sort(key=lambda f: f.stat().st_size, reverse=True)
+
+    def _finish(f: Path, outputs: List[Path], seconds: float) -> None:
+        manifest.record(f, p_hash, outputs, seconds)
+        stats["done"] += 1
+        print(f"[Batch] ({stats['done'] + stats['failed']}/{len(todo)}) {f} {seconds:.2f}s")
+
+    def _fail(f: Path, e: BaseException) -> None:
+        stats["failed"] += 1
+        print(f"[Batch] 失敗: {f}: {e}", file=sys.stderr)
+
+    if workers == 1:
+        for f in todo:
+            try:
+                outputs, sec = _timed(job, args, f, derive_output_prefix(f, args.out_root, base))
+            except Exception as e:
+                _fail(f, e)
+                continue
+            _finish(f, outputs, sec)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futs = {pool.submit(_timed, job, args, f, derive_output_prefix(f, args.out_root, base)): f
+                    for f in todo}
+            for fut in as_completed(futs):
+                f = futs[fut]
+                try:
+                    outputs, sec = fut.result()
+                except Exception as e:
+                    _fail(f, e)
+                    continue
+                _finish(f, outputs, sec)
+
+    print(f"[Batch] 完了 {stats['done']} 件, スキップ {stats['skipped']} 件, 失敗 {stats['failed']} 件")
+    return stats
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+目的：密度計算まわり（読み込み・ボクセル密度・KDE各エンジン・結果の書き出し）のベンチマークと性能回帰の検出
+備考：
+- 合成点群はシード固定で、次の3種類を作る（単位立方体内）
+    uniform   : 一様乱数
+    clustered : ガウス分布のクラスタの集まり（局所的に密な部分と空の部分がある）
+    decimated : 一様点群のうち、粗いボクセル数個だけ点を1/10に間引いたもの（partial.py の部分ダウンサンプルに相当。
+                FPSの代わりにランダムに残す）
+- 段ごとに最短時間（--repeat 回の最小）と、その段で確保したメモリのピーク（tracemalloc。NumPyの配列も含む）を記録する
+  時間は tracemalloc を止めて測り、ピークは別にもう1回実行して測る（--no-memory で省略）
+- --save-baseline で結果をJSONに保存し、--baseline で比較する。
+  基準より --threshold（割合）以上遅く、かつ差が --min-seconds 以上の段があれば一覧を出して終了コード1で終わる
+- kde_loop は Open3D の KDTree を使うので、Open3D が無い環境では注記を出して計測しない
+  （--loop-max-points を超える点数でも計測しない）
+- 1e8点の一様点群は float64 で 2.4GB になる。大きい点数では --dtype float32 にするか段を絞る（--stages）こと
+- voxel_tiled は --workers の各プロセス数でタイル並列のボクセル密度（TiledDensityExecutor）を測り、
+  voxel_w<プロセス数> の段として記録する（プロセス数によるスケーリング。子プロセスと共有メモリはピークに入らない）
+
+・ターミナル上でのデバッグ例
+python density/bench/bench_density.py --points 10000 100000 1000000 --save-baseline density/bench/baseline.json
+python density/bench/bench_density.py --points 10000 100000 1000000 --baseline density/bench/baseline.json --threshold 0.25
+python density/bench/bench_density.py --points 100000000 --dists uniform --stages voxel io_stream --dtype float32 --repeat 1
+python density/bench/bench_density.py --points 20000000 --dists uniform --stages voxel_tiled --workers 1 2 4 8 --repeat 1
+"""
+
+import argparse
+import json
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Callable, Dict, List
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from IO import PointCloudIO  # noqa: E402
+from cal_den import VoxelDensityCalculator  # noqa: E402
+from csv_npz import save_voxel_outputs, save_kde_outputs  # noqa: E402
+from kde import PDVKDEDensityCalculator, o3d as kde_o3d  # noqa: E402  kde_o3d: Open3Dが無ければ None
+from tiling import TiledDensityExecutor  # noqa: E402
+
+DISTS = ("uniform", "clustered", "decimated")
+STAGES = ("io_load", "io_stream", "voxel", "voxel_tiled", "kde_loop", "kde_batched", "kde_binned",
+          "write_csv", "write_npz", "write_npy")
+
+
+# =========================
+# 合成点群
+# =========================
+def make_cloud(dist: str, n: int, seed: int, dtype=np.float64) -> np.ndarray:
+    """シード固定の合成点群（単位立方体付近、(n',3)）。decimated は間引いた分だけ n より少ない"""
+    rng = np.random.default_rng(seed)
+    if dist == "uniform":
+        return rng.random((n, 3), dtype=np.float64).astype(dtype, copy=False)
+    if dist == "clustered":
+        k = 32
+        centers = rng.random((k, 3))
+        scales = rng.uniform(0.01, 0.06, size=k)
+        label = rng.integers(0, k, size=n)
+        pts = centers[label] + rng.standard_normal((n, 3)) * scales[label, None]
+        return pts.astype(dtype, copy=False)
+    if dist == "decimated":
+        # partial.py と同じく、点のある粗いボクセルを3個選び、その中の点を1/10に減らす
+        pts = rng.random((n, 3))
+        coarse = 0.25
+        ijk = np.floor(pts / coarse).astype(np.int64)
+        key = (ijk[:, 0] * 4 + ijk[:, 1]) * 4 + ijk[:, 2]
+        chosen = rng.choice(np.unique(key), size=3, replace=False)
+        in_chosen = np.isin(key, chosen)
+        keep = ~in_chosen | (rng.random(n) < 0.1)
+        return pts[keep].astype(dtype, copy=False)
+    raise ValueError(f"未知の分布: {dist}（{DISTS} のいずれか）")
+
+
+def write_binary_pcd(path: Path, pts: np.ndarray) -> Path:
+    """xyzだけのバイナリPCDを書く（Open3Dなしで読み込みの計測に使う）"""
+    pts = np.ascontiguousarray(pts, dtype=np.float32)
+    n = pts.shape[0]
+    header = ("# .PCD v0.7 - Point Cloud Data file format\nVERSION 0.7\nFIELDS x y z\nSIZE 4 4 4\nTYPE F F F\n"
+              f"COUNT 1 1 1\nWIDTH {n}\nHEIGHT 1\nVIEWPOINT 0 0 0 1 0 0 0\nPOINTS {n}\nDATA binary\n")
+    with path.open("wb") as f:
+        f.write(header.encode("ascii"))
+        f.write(pts.tobytes())
+    return path
+
+
+# =========================
+# 計測
+# =========================
+def measure(fn: Callable[[], object], repeat: int, memory: bool = True):
+    """repeat回実行して (最短時間[s], 確保メモリのピーク[byte] または None, 最後の戻り値) を返す
+    ・時間は tracemalloc を止めた状態で測る（確保ごとの記録の分だけ、Pythonの処理が多い段が遅く見えるため）
+    ・ピークは memory のときだけ、tracemalloc を動かしてもう1回実行して測る（戻り値は捨てる）
+    """
+    best, out = float("inf"), None
+    for _ in range(repeat):
+        out = None  # 前回の戻り値を捨ててから測る
+        t0 = time.perf_counter()
+        out = fn()
+        best = min(best, time.perf_counter() - t0)
+    peak = None
+    if memory:
+        tracemalloc.start()
+        try:
+            fn()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return best, peak, out
+
+
+def run_case(dist: str, n: int, args, tmp: Path) -> List[Dict]:
+    """1つの (分布, 点数) について、指定された段をすべて計測する"""
+    pts = make_cloud(dist, n, args.seed, dtype=np.dtype(args.dtype))
+    rows = []
+
+    def record(stage: str, fn: Callable[[], object], repeat: int = args.repeat):
+        sec, peak, out = measure(fn, repeat, memory=not args.no_memory)
+        peak_mb = peak / 2 ** 20 if peak is not None else None
+        rows.append({"dist": dist, "n": n, "points": int(pts.shape[0]), "stage": stage,
+                     "seconds": sec, "peak_mb": peak_mb, "points_per_sec": pts.shape[0] / sec if sec > 0 else None})
+        peak_str = f"{peak_mb:>10.1f}" if peak_mb is not None else f"{'-':>10}"
+        print(f"{dist:>10} {n:>11d} {stage:>12} {sec:>10.4f} {peak_str} {pts.shape[0] / max(sec, 1e-12):>14,.0f}")
+        return out
+
+    want = set(args.stages)
+    vox = (args.voxel_size,) * 3
+
+    if want & {"io_load", "io_stream"}:
+        pcd = write_binary_pcd(tmp / f"{dist}_{n}.pcd", pts)
+        if "io_load" in want:
+            record("io_load", lambda: PointCloudIO.load_local_points(pcd, dtype=args.dtype))
+        if "io_stream" in want:
+            record("io_stream", lambda: sum(c.shape[0] for c in PointCloudIO.iter_points(pcd, 1_000_000, args.dtype)))
+        pcd.unlink()
+
+    vres = None
+    if want & {"voxel", "write_csv", "write_npz", "write_npy"}:
+        calc = VoxelDensityCalculator(vox, dtype=args.dtype)
+        vres = record("voxel", lambda: calc.compute(pts)) if "voxel" in want else calc.compute(pts)
+
+    if "voxel_tiled" in want:
+        calc = VoxelDensityCalculator(vox, dtype=args.dtype)
+        for w in args.workers:
+            executor = TiledDensityExecutor(w)
+            record(f"voxel_w{w}", lambda: executor.compute_voxel(calc, pts))
+
+    kres = None
+    for engine in ("loop", "batched", "binned"):
+        stage = f"kde_{engine}"
+        if stage not in want or (engine == "loop" and pts.shape[0] > args.loop_max_points):
+            continue
+        kcalc = PDVKDEDensityCalculator(vox, args.grid_U, args.radius, args.sigma, engine=engine, dtype=args.dtype)
+        kres = record(stage, lambda: kcalc.compute(pts))
+
+    for fmt in ("csv", "npz", "npy"):
+        stage = f"write_{fmt}"
+        if stage not in want:
+            continue
+        prefix = tmp / f"{dist}_{n}_{fmt}"
+        record(stage, lambda: save_voxel_outputs(prefix, vres, [fmt]))
+        if kres is not None:
+            record(f"{stage}_kde", lambda: save_kde_outputs(prefix.with_name(prefix.name + "_kde"), kres, [fmt]))
+    return rows
+
+
+# =========================
+# 基準との比較
+# =========================
+def case_key(row: Dict) -> str:
+    return f"{row['dist']}/{row['n']}/{row['stage']}"
+
+
+def compare_baseline(rows: List[Dict], baseline: Dict, threshold: float, min_seconds: float) -> List[str]:
+    """基準より遅くなった段の説明を返す（基準に無い段は比べない）"""
+    base = {case_key(r): r for r in baseline["results"]}
+    regressions = []
+    for r in rows:
+        b = base.get(case_key(r))
+        if b is None:
+            continue
+        ratio = r["seconds"] / b["seconds"] if b["seconds"] > 0 else float("inf")
+        if ratio > 1.0 + threshold and r["seconds"] - b["seconds"] >= min_seconds:
+            regressions.append(f"{case_key(r)}: {b['seconds']:.4f}s → {r['seconds']:.4f}s（×{ratio:.2f}）")
+    return regressions
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="密度計算ベンチマーク（合成点群・段ごとの時間とメモリ・基準との比較）")
+    ap.add_argument("--points", nargs="+", type=int, default=[10_000, 100_000, 1_000_000],
+                    help="点数（複数可。1e4〜1e8を想定）")
+    ap.add_argument("--dists", nargs="+", choices=DISTS, default=list(DISTS), help="合成点群の分布（複数可）")
+    ap.add_argument("--stages", nargs="+", choices=STAGES, default=list(STAGES), help="計測する段（複数可）")
+    ap.add_argument("--dtype", choices=["float64", "float32"], default="float64", help="点群と結果の精度")
+    ap.add_argument("--voxel-size", type=float, default=0.02, help="ボクセルサイズ")
+    ap.add_argument("--grid-U", type=int, default=32, help="KDEのグリッド分割数")
+    ap.add_argument("--radius", type=float, default=0.1, help="KDEの探索半径")
+    ap.add_argument("--sigma", type=float, default=0.05, help="KDEの帯域幅σ")
+    ap.add_argument("--workers", nargs="+", type=int, default=[1, 2, 4], help="voxel_tiled で測るプロセス数（複数可）")
+    ap.add_argument("--loop-max-points", type=int, default=100_000, help="kde_loop を計測する最大点数（遅いため）")
+    ap.add_argument("--repeat", type=int, default=3, help="各計測の反復回数（最短値を採用）")
+    ap.add_argument("--no-memory", action="store_true", help="メモリのピークを測らない（ピーク用の追加の1回を省く）")
+    ap.add_argument("--seed", type=int, default=0, help="乱数シード")
+    ap.add_argument("--save-baseline", type=Path, default=None, help="結果を基準JSONとして保存する")
+    ap.add_argument("--baseline", type=Path, default=None, help="比較する基準JSON")
+    ap.add_argument("--threshold", type=float, default=0.25, help="回帰とみなす遅くなり方（0.25 = 25%%）")
+    ap.add_argument("--min-seconds", type=float, default=0.02, help="これより小さい差は計測誤差として無視する[s]")
+    args = ap.parse_args()
+    if "kde_loop" in args.stages and kde_o3d is None:
+        print("[bench] Open3Dが無いので kde_loop は計測しない（loopエンジンはOpen3Dが必要）")
+        args.stages = [s for s in args.stages if s != "kde_loop"]
+
+    rows: List[Dict] = []
+    print(f"{'dist':>10} {'N':>11} {'stage':>12} {'sec':>10} {'peak[MB]':>10} {'pts/s':>14}")
+    with tempfile.TemporaryDirectory(prefix="bench_density_") as d:
+        for n in args.points:
+            for dist in args.dists:
+                rows += run_case(dist, n, args, Path(d))
+
+    if args.save_baseline is not None:
+        args.save_baseline.parent.mkdir(parents=True, exist_ok=True)
+        doc = {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "machine": {"python": platform.python_version(), "numpy": np.__version__,
+                        "platform": platform.platform(), "processor": platform.processor()},
+            "params": {k: v for k, v in vars(args).items() if k not in ("save_baseline", "baseline")},
+            "results": rows,
+        }
+        with args.save_baseline.open("w", encoding="utf-8") as f:
+            json.dump(doc, f, ensure_ascii=False, indent=1)
+        print(f"[Bench] 基準を保存: {args.save_baseline}")
+
+    if args.baseline is not None:
+        with args.baseline.open("r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare_baseline(rows, baseline, args.threshold, args.min_seconds)
+        if regressions:
+            print(f"[Bench] 性能回帰 {len(regressions)} 件（閾値 +{args.threshold * 100:.0f}%）:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print(f"[Bench] 回帰なし（基準: {args.baseline}）")
+
+
+if __name__ == "__main__":
+    main()
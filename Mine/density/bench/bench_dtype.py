@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+目的：--dtype float32 と float64 の精度・速度・メモリを比べる（精度レポート）
+備考：
+- 合成点群（一様乱数）を原点付近と大きなオフセット（測量座標相当）の両方に置いて計測する
+- float32 は detect.py と同じく、AABB最小を引いた局所座標にしてから変換した点群を使う（IO.load_local_points 相当）
+- ボクセル: 点の所属ボクセルの不一致数、（共通ボクセルでの）中心座標・密度の最大誤差
+- KDE    : グリッド値の最大相対誤差（最大値で正規化）
+- メモリは結果配列（と入力点群）の合計バイト数
+
+・ターミナル上でのデバッグ例
+python density/bench/bench_dtype.py --points 1000000 --voxel-size 0.01 --offset 0 100000
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from utility import voxel_index, pack_voxel_keys, local_shift  # noqa: E402
+from formats import shift_to_local  # noqa: E402
+from cal_den import VoxelDensityCalculator  # noqa: E402
+from kde import PDVKDEDensityCalculator  # noqa: E402
+
+
+def best_of(fn, repeat: int):
+    """repeat回実行して最短時間と最後の戻り値を返す"""
+    best, out = float("inf"), None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = fn()
+        best = min(best, time.perf_counter() - t0)
+    return best, out
+
+
+def nbytes(*arrays) -> int:
+    return int(sum(a.nbytes for a in arrays))
+
+
+def common_voxels(ijk_a: np.ndarray, ijk_b: np.ndarray):
+    """両方の結果にあるボクセルの行番号 (ia, ib)"""
+    keys, _, _ = pack_voxel_keys(np.concatenate([ijk_a, ijk_b]))
+    _, ia, ib = np.intersect1d(keys[:ijk_a.shape[0]], keys[ijk_a.shape[0]:], assume_unique=True, return_indices=True)
+    return ia, ib
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="float32/float64 の精度レポート（ボクセル密度・KDE）")
+    ap.add_argument("--points", nargs="+", type=int, default=[1_000_000], help="点数（複数可）")
+    ap.add_argument("--voxel-size", type=float, default=0.01, help="ボクセルサイズ（単位立方体内の一様点群）")
+    ap.add_argument("--offset", nargs="+", type=float, default=[0.0, 1.0e5], help="点群に足す座標オフセット（複数可）")
+    ap.add_argument("--grid-U", type=int, default=32, help="KDEのグリッド分割数")
+    ap.add_argument("--kde-points", type=int, default=200_000, help="KDEに使う点数（先頭から）")
+    ap.add_argument("--repeat", type=int, default=3, help="各計測の反復回数（最短値を採用）")
+    ap.add_argument("--seed", type=int, default=0, help="乱数シード")
+    args = ap.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    vox = (args.voxel_size,) * 3
+    print("[Voxel]")
+    print(f"{'N':>10} {'offset':>10} {'mismatch':>9} {'center_err':>11} {'dens_rel':>9}"
+          f" {'f64[s]':>8} {'f32[s]':>8} {'f64[MB]':>8} {'f32[MB]':>8}")
+    for n in args.points:
+        base = rng.random((n, 3))
+        for off in args.offset:
+            p64 = base + off
+            # --dtype float32 の読み込み結果に相当する（局所座標の float32 と局所原点）
+            origin = p64.min(axis=0)
+            shift = local_shift(origin, np.float32)
+            p32 = shift_to_local(p64, shift, np.float32)
+            c64 = VoxelDensityCalculator(vox)
+            c32 = VoxelDensityCalculator(vox, dtype=np.float32)
+            t64, r64 = best_of(lambda: c64.compute(p64, origin=origin), args.repeat)
+            t32, r32 = best_of(lambda: c32.compute(p32, origin=origin, shift=shift), args.repeat)
+
+            # 入力を float32 に丸めたことで別のボクセルへ移った点の数
+            ijk64 = voxel_index(p64, origin, c64.voxel_size)
+            ijk32 = voxel_index(p32, origin - shift, c32.voxel_size)
+            mismatch = int(np.count_nonzero(np.any(ijk64 != ijk32, axis=1)))
+            # 中心・密度の誤差は、両方にあるボクセルで点数が同じものについて測る（丸め誤差だけを見る）
+            ia, ib = common_voxels(r64.index_ijk, r32.index_ijk)
+            same = r64.counts[ia] == r32.counts[ib]
+            ia, ib = ia[same], ib[same]
+            center_err = float(np.max(np.abs(r64.centers[ia] - r32.centers[ib].astype(np.float64)), initial=0.0))
+            dens_rel = float(np.max(np.abs(r64.density[ia] - r32.density[ib]) / r64.density[ia], initial=0.0))
+            mb64 = nbytes(p64, r64.centers, r64.density) / 1e6
+            mb32 = nbytes(p32, r32.centers, r32.density) / 1e6
+            print(f"{n:>10d} {off:>10.0f} {mismatch:>9d} {center_err:>11.2e} {dens_rel:>9.1e} {t64:>8.3f} {t32:>8.3f} {mb64:>8.1f} {mb32:>8.1f}")
+
+    print("[KDE]")
+    print(f"{'N':>10} {'offset':>10} {'max_rel':>9} {'f64[s]':>8} {'f32[s]':>8}")
+    n = min(args.kde_points, max(args.points))
+    base = rng.random((n, 3))
+    kde_vox = (0.02,) * 3
+    for off in args.offset:
+        p64 = base + off
+        shift = local_shift(p64.min(axis=0), np.float32)
+        p32 = shift_to_local(p64, shift, np.float32)
+        k64 = PDVKDEDensityCalculator(kde_vox, args.grid_U, radius=0.1, sigma=0.05)
+        k32 = PDVKDEDensityCalculator(kde_vox, args.grid_U, radius=0.1, sigma=0.05, dtype=np.float32)
+        t64, r64 = best_of(lambda: k64.compute(p64), args.repeat)
+        t32, r32 = best_of(lambda: k32.compute(p32, shift=shift), args.repeat)
+        scale = float(np.max(r64.kde_values)) or 1.0
+        max_rel = float(np.max(np.abs(r64.kde_values - r32.kde_values.astype(np.float64)))) / scale
+        print(f"{n:>10d} {off:>10.0f} {max_rel:>9.1e} {t64:>8.3f} {t32:>8.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+目的：ボクセル集約の旧実装 np.unique(ijk, axis=0) と group_voxels（int64キー）の速度を比べる
+備考：
+- 合成点群（一様乱数）を使い、点数とボクセルサイズを変えて計測する
+- 両者の出力（ユニークなインデックス・inverse・カウント・重心和）が一致することも確認する
+
+・ターミナル上でのデバッグ例
+python density/bench/bench_voxel_key.py --points 1000000 10000000 --voxel-size 0.01 --repeat 3
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from utility import voxel_index, group_voxels  # noqa: E402
+
+
+def legacy_group(ijk: np.ndarray, points: np.ndarray):
+    """旧実装（VoxelDensityCalculator / compute_voxel_centroids と同じ処理）"""
+    uniq, inverse, counts = np.unique(ijk, axis=0, return_inverse=True, return_counts=True)
+    inverse = inverse.reshape(-1)
+    sums = np.zeros((uniq.shape[0], 3), dtype=np.float64)
+    np.add.at(sums, inverse, points)
+    return uniq, inverse, counts, sums
+
+
+def best_of(fn, repeat: int):
+    """repeat回実行して最短時間と最後の戻り値を返す"""
+    best, out = float("inf"), None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = fn()
+        best = min(best, time.perf_counter() - t0)
+    return best, out
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="ボクセル集約ベンチマーク（np.unique(axis=0) vs group_voxels）")
+    ap.add_argument("--points", nargs="+", type=int, default=[100_000, 1_000_000, 5_000_000], help="点数（複数可）")
+    ap.add_argument("--voxel-size", type=float, default=0.01, help="ボクセルサイズ（単位立方体内の一様点群）")
+    ap.add_argument("--repeat", type=int, default=3, help="各計測の反復回数（最短値を採用）")
+    ap.add_argument("--seed", type=int, default=0, help="乱数シード")
+    args = ap.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    vox = np.full((3,), args.voxel_size, dtype=np.float64)
+    print(f"{'N':>12} {'voxels':>10} {'unique[s]':>10} {'group[s]':>10} {'speedup':>8}")
+    for n in args.points:
+        pts = rng.random((n, 3))
+        ijk = voxel_index(pts, pts.min(axis=0), vox)
+        t_old, old = best_of(lambda: legacy_group(ijk, pts), args.repeat)
+        t_new, new = best_of(lambda: group_voxels(ijk, pts), args.repeat)
+
+        # 出力一致の確認
+        assert np.array_equal(old[0], new[0]), "ユニークなインデックスが一致しない"
+        assert np.array_equal(old[1], new[1]), "inverseが一致しない"
+        assert np.array_equal(old[2], new[2]), "カウントが一致しない"
+        assert np.allclose(old[3], new[3], rtol=1e-12, atol=0.0), "重心和が一致しない"
+        print(f"{n:>12d} {old[0].shape[0]:>10d} {t_old:>10.3f} {t_new:>10.3f} {t_old / t_new:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+# density/boxmesh.py
+# -*- coding: utf-8 -*-
+"""ボクセルの箱メッシュを配列演算でまとめて作る
+・8頂点/12三角形の箱テンプレートを全ボクセル中心にブロードキャストし、頂点・三角形の配列を一度に確保する
+  （create_box を1個ずつ作って mesh += box で結合すると、結合のたびにメッシュ全体がコピーされて2乗時間になる）
+・頂点はボクセルごとに持つので、重複頂点/非多様体辺の後処理は要らない
+・cull_shared=True で、隣り合う占有ボクセル同士が接する面を省く（外から見えない内部の面）。
+  面が1枚も残らないボクセルは頂点ごと除く
+・max_boxes で箱の数に上限を付ける。既定は密度の分位ごとに均等に間引く（低密度のボクセルも同じ割合で残る）。
+  keep="lowest" なら密度の低い順、"highest" なら高い順に残す
+
+使い方例:
+  keep = select_boxes(density, max_boxes=200_000)                  # 分位ごとに均等
+  keep = select_boxes(density, max_boxes=200_000, keep="lowest")   # 低密度のボクセルだけを見る
+  verts, tris, box = voxel_box_arrays(centers[keep], voxel_size * 0.95, voxel_size, cull_shared=True)
+  colors = np.repeat(rgb[keep][box], BOX_VERTS, axis=0)
+"""
+
+from typing import Optional, Tuple
+import numpy as np
+
+BOX_VERTS = 8
+
+# 単位立方体の角（番号 = ix + 2*iy + 4*iz）。中心を原点にしている
+_CORNERS = np.array([[(i >> 0) & 1, (i >> 1) & 1, (i >> 2) & 1] for i in range(BOX_VERTS)], dtype=np.float64) - 0.5
+
+# 面ごとの2三角形（外向きが表）。面の順は _FACE_OFFSETS と揃える
+_FACE_TRIS = np.array([
+    [[0, 4, 6], [0, 6, 2]],  # -x
+    [[1, 3, 7], [1, 7, 5]],  # +x
+    [[0, 1, 5], [0, 5, 4]],  # -y
+    [[2, 6, 7], [2, 7, 3]],  # +y
+    [[0, 2, 3], [0, 3, 1]],  # -z
+    [[4, 5, 7], [4, 7, 6]],  # +z
+], dtype=np.int64)
+
+_FACE_OFFSETS = np.array([[-1, 0, 0], [1, 0, 0], [0, -1, 0], [0, 1, 0], [0, 0, -1], [0, 0, 1]], dtype=np.int64)
+
+
+# max_boxes で間引くときの残し方
+KEEP_MODES = ("stratified", "lowest", "highest")
+
+
+def select_boxes(values: np.ndarray, max_boxes: Optional[int], keep: str = "stratified") -> np.ndarray:
+    """値（密度）に応じて最大 max_boxes 個を選んだ番号を返す（元の順に並べ直す）
+    ・stratified: 値の順に並べて等間隔の順位を取る（各分位から同じ割合で残すので、分布の形が保たれる）
+    ・lowest / highest: 値の低い順 / 高い順
+    ・max_boxes が None か全数以上なら全ボクセル
+    """
+    if keep not in KEEP_MODES:
+        raise ValueError(f"keepは {KEEP_MODES} のいずれかである必要がある")
+    n = int(values.shape[0])
+    if max_boxes is None or max_boxes >= n:
+        return np.arange(n)
+    if max_boxes <= 0:
+        raise ValueError("max_boxesは正の整数である必要がある")
+    v = np.asarray(values, dtype=np.float64)
+    if keep == "stratified":
+        order = np.argsort(v, kind="stable")
+        ranks = ((np.arange(max_boxes) + 0.5) * (n / max_boxes)).astype(np.int64)
+        sel = order[ranks]
+    else:
+        sel = np.argpartition(v if keep == "lowest" else -v, max_boxes - 1)[:max_boxes]
+    return np.sort(sel)
+
+
+def visible_faces(centers: np.ndarray, voxel_size) -> np.ndarray:
+    """各ボクセルの6面のうち、隣に占有ボクセルが無い（外から見える）面を (M,6) の真偽で返す
+    ・centers は同じ格子上のボクセル中心であること（格子番号は最小の中心からの距離を丸めて求める）
+    """
+    vox = np.broadcast_to(np.asarray(voxel_size, dtype=np.float64), (3,))
+    ijk = np.rint((centers - centers.min(axis=0)) / vox).astype(np.int64) + 1  # 隣（-1）も非負になるようにずらす
+    dims = ijk.max(axis=0) + 2
+    keys = (ijk[:, 0] * dims[1] + ijk[:, 1]) * dims[2] + ijk[:, 2]
+    order = np.sort(keys)
+
+    vis = np.empty((centers.shape[0], 6), dtype=bool)
+    for f, off in enumerate(_FACE_OFFSETS):
+        nk = keys + (off[0] * dims[1] + off[1]) * dims[2] + off[2]
+        pos = np.minimum(np.searchsorted(order, nk), order.shape[0] - 1)
+        vis[:, f] = order[pos] != nk
+    return vis
+
+
+def voxel_box_arrays(centers: np.ndarray, box_size, voxel_size=None,
+                     cull_shared: bool = False) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """全ボクセルの箱メッシュを (頂点[8K,3], 三角形[T,3] int32, 箱の元の番号[K]) で返す
+    ・box_size は箱の実サイズ（スカラーか(3,)）、voxel_size は隣接判定に使う格子間隔（省略時は box_size）
+    ・頂点は箱ごとに8個ずつ並ぶので、箱単位の色は np.repeat(rgb[box], BOX_VERTS, axis=0) で付けられる
+    """
+    centers = np.asarray(centers, dtype=np.float64)
+    size = np.broadcast_to(np.asarray(box_size, dtype=np.float64), (3,))
+    m = centers.shape[0]
+    if m == 0:
+        return np.zeros((0, 3)), np.zeros((0, 3), dtype=np.int32), np.zeros((0,), dtype=np.int64)
+
+    if cull_shared:
+        vis = visible_faces(centers, size if voxel_size is None else voxel_size)
+        box = np.flatnonzero(vis.any(axis=1))
+        vis = vis[box]
+    else:
+        box = np.arange(m)
+        vis = np.ones((m, 6), dtype=bool)
+
+    k = box.shape[0]
+    verts = (centers[box, None, :] + _CORNERS[None, :, :] * size).reshape(-1, 3)
+    tris = _FACE_TRIS[None, :, :, :] + (BOX_VERTS * np.arange(k, dtype=np.int64))[:, None, None, None]  # (K,6,2,3)
+    tris = tris[vis].reshape(-1, 3).astype(np.int32)
+    return verts, tris, box
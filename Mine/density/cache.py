@@ -0,0 +1,193 @@
+# density/cache.py
+# -*- coding: utf-8 -*-
+"""密度計算結果のディスクキャッシュ（内容アドレス＋サイズ上限付きLRU）
+・キー = 入力ファイルの内容ハッシュ ＋ 計算クラスとパラメータ ＋ 原点/RoIなどの追加条件
+  入力のハッシュは (サイズ, 更新時刻) ごとに覚えておくので、変わっていないファイルは読み直さない
+・値は結果ディレクトリ（results.py）。ヒット時はメモリマップで開くだけなので、点群の読み込みも計算も省ける
+・ヒットしたエントリは更新時刻を今にする。合計サイズが上限を超えたら、更新時刻の古い順に消す
+・書き込みはプロセスごとの一時ディレクトリ→名前の変更。同じキーを複数のプロセスが同時に計算したときは
+  先に置かれたエントリを残し、後のプロセスは自分の分を捨てる（キーが同じなら中身も同じ）ので、
+  複数プロセスから同時に使っても壊れない
+
+使い方例:
+  cache = DensityCache(Path("out/.cache"), max_bytes=4 << 30)
+  res = cache.get_or_compute(input_path, calc, lambda: calc.compute(pts), origin=None)
+  print(cache.summary())
+"""
+
+import json
+import os
+import shutil
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from batch import file_digest, params_digest
+from results import RESULT_VERSION, save_result_dir, read_result_header, load_voxel_result, load_kde_result, load_point_result
+
+# 計算の中身を変えたら上げる（古いエントリは別のキーになり、いずれLRUで消える）
+CACHE_VERSION = 2
+
+# 結果に影響しない計算クラスの属性（キーに含めない）
+_NON_RESULT_ATTRS = ("chunk_size",)
+
+_INPUTS_FILE = "inputs.json"
+
+# 結果の種類ごとの読み込み関数
+_LOADERS = {"voxel": load_voxel_result, "kde": load_kde_result, "point": load_point_result}
+
+
+def _jsonable(v):
+    """キー用にパラメータをJSONへ落とす（ndarrayは値のリスト、dtypeは名前）"""
+    if isinstance(v, np.ndarray):
+        return v.tolist()
+    if isinstance(v, np.dtype):
+        return v.name
+    if isinstance(v, (np.floating, np.integer)):
+        return v.item()
+    if isinstance(v, (list, tuple)):
+        return [_jsonable(x) for x in v]
+    return v
+
+
+def calc_params(calc) -> Dict:
+    """計算クラスのパラメータ（結果に影響するものだけ）"""
+    return {k: _jsonable(v) for k, v in sorted(vars(calc).items()) if k not in _NON_RESULT_ATTRS}
+
+
+def _dir_size(path: Path) -> int:
+    return sum(f.stat().st_size for f in path.iterdir() if f.is_file())
+
+
+class DensityCache:
+    """結果ディレクトリを値とするディスクキャッシュ
+    ・hits / misses / evicted はこのインスタンスでの回数
+    """
+
+    def __init__(self, cache_dir: Path, max_bytes: int):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = int(max_bytes)
+        if self.max_bytes <= 0:
+            raise ValueError("キャッシュの上限サイズは正である必要がある")
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+
+    # --- キー ---
+    def input_digest(self, path: Path) -> str:
+        """入力ファイルの内容ハッシュ（サイズと更新時刻が前回と同じなら覚えている値を使う）"""
+        path = Path(path)
+        st = path.stat()
+        memo_path = self.cache_dir / _INPUTS_FILE
+        try:
+            with memo_path.open("r", encoding="utf-8") as f:
+                memo = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            memo = {}
+        name = str(path.resolve())
+        e = memo.get(name)
+        if e is not None and e["size"] == st.st_size and e["mtime_ns"] == st.st_mtime_ns:
+            return e["sha1"]
+        digest = file_digest(path)
+        memo[name] = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha1": digest}
+        # 一時ファイル→置き換え（同時に書いたプロセスがあっても、どちらかの内容が残るだけ）
+        tmp = memo_path.with_name(f"{_INPUTS_FILE}.{os.getpid()}.tmp")
+        with tmp.open("w", encoding="utf-8") as f:
+            json.dump(memo, f, ensure_ascii=False)
+        os.replace(tmp, memo_path)
+        return digest
+
+    def key(self, input_path: Path, calc, **extra) -> str:
+        """入力・計算クラス・パラメータ・追加条件からキーを作る"""
+        return params_digest({
+            "version": [CACHE_VERSION, RESULT_VERSION],
+            "input": self.input_digest(input_path),
+            "calc": type(calc).__name__,
+            "params": calc_params(calc),
+            "extra": {k: _jsonable(v) for k, v in extra.items()},
+        })
+
+    def _entry(self, key: str) -> Path:
+        return self.cache_dir / f"{key}_result"
+
+    # --- 取得・保存 ---
+    def get(self, key: str):
+        """キーに対応する結果（配列はメモリマップ）。無ければ None"""
+        entry = self._entry(key)
+        try:
+            kind = read_result_header(entry)["kind"]
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        os.utime(entry)  # LRUの「最近使った」印
+        self.hits += 1
+        return _LOADERS[kind](entry)
+
+    def put(self, key: str, res) -> Path:
+        """結果を保存し、上限を超えていれば古いエントリを消す（同じキーのエントリが既にあればそれを残す）"""
+        entry = save_result_dir(self.cache_dir / key, res, overwrite=False)
+        self.evict(keep=entry)
+        return entry
+
+    def get_or_compute(self, input_path: Path, calc, compute: Callable[[], object], **extra):
+        """キャッシュにあればそれを返し、無ければ compute() の結果を保存して返す"""
+        key = self.key(input_path, calc, **extra)
+        res = self.get(key)
+        print(f"[Cache] {'ヒット' if res is not None else 'ミス'}: {key[:12]} ({input_path})")
+        if res is None:
+            res = compute()
+            self.put(key, res)
+        return res
+
+    # --- LRU ---
+    def entries(self) -> List[Tuple[Path, float, int]]:
+        """(エントリ, 最終使用時刻, バイト数) の一覧（古い順）"""
+        out = []
+        for p in self.cache_dir.glob("*_result"):
+            try:
+                out.append((p, p.stat().st_mtime, _dir_size(p)))
+            except OSError:
+                continue  # 他のプロセスが消した
+        out.sort(key=lambda e: e[1])
+        return out
+
+    def evict(self, keep: Optional[Path] = None) -> int:
+        """合計サイズが max_bytes 以下になるまで古いエントリを消す（keep は消さない）。消した数を返す"""
+        entries = self.entries()
+        total = sum(e[2] for e in entries)
+        n = 0
+        for path, _, size in entries:
+            if total <= self.max_bytes:
+                break
+            if keep is not None and path == keep:
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+            n += 1
+        self.evicted += n
+        return n
+
+    def usage(self) -> int:
+        """現在の合計バイト数"""
+        return sum(e[2] for e in self.entries())
+
+    def summary(self) -> str:
+        total = self.hits + self.misses
+        rate = 100.0 * self.hits / total if total else 0.0
+        return (f"[Cache] ヒット {self.hits} / ミス {self.misses}（ヒット率 {rate:.0f}%）, 削除 {self.evicted} 件, "
+                f"使用量 {self.usage() / 1e6:.1f} MB / 上限 {self.max_bytes / 1e6:.0f} MB: {self.cache_dir}")
+
+
+def is_cache_dir(path: Path) -> bool:
+    """キャッシュのディレクトリか（入力ハッシュの記録があるか）。結果を探すときに中へ入らないための判定"""
+    return (Path(path) / _INPUTS_FILE).is_file()
+
+
+def open_cache(args) -> Optional[DensityCache]:
+    """CLI引数からキャッシュを開く（--no-cache なら None）"""
+    if args.no_cache:
+        return None
+    cache_dir = args.cache_dir if args.cache_dir is not None else Path(args.out_root) / ".cache"
+    return DensityCache(cache_dir, int(args.cache_max_gb * (1 << 30)))
@@ -4,9 +4,9 @@
 
 import glob
 import numpy as np
-from typing import Tuple, Optional
+from typing import Iterable, List, Tuple, Optional
 from dataclasses import dataclass
-from utility import aabb_of_points, voxel_index, voxel_center_from_index
+from utility import aabb_of_points, voxel_index, voxel_center_from_index, group_voxels, resolve_dtype, as_shift
 
 @dataclass
 class VoxelDensityResult:
@@ -18,34 +18,153 @@ class VoxelDensityResult:
     origin: np.ndarray      # (3,)
 
 
+def coarsen_voxel_result(res: VoxelDensityResult, factor: int = 2) -> VoxelDensityResult:
+    """ボクセル密度を factor 倍の粗いボクセルへ集約する（点の再走査なし）
+    ・子ボクセル (i,j,k) の親は floor((i,j,k) / factor)。原点は共通
+    ・親の点数は子の点数の和、密度は親ボクセルの体積で割り直す
+    """
+    factor = int(factor)
+    if factor < 2:
+        raise ValueError("factorは2以上である必要がある")
+    parent = np.floor_divide(res.index_ijk, factor)
+    uniq, inverse, _, _ = group_voxels(parent)
+    counts = np.rint(np.bincount(inverse, weights=res.counts, minlength=uniq.shape[0])).astype(np.int64)
+    voxel_size = res.voxel_size * factor
+    vol = float(np.prod(voxel_size))
+    # 座標・密度の型（精度モード）は元の結果に合わせる
+    return VoxelDensityResult(
+        centers=voxel_center_from_index(uniq, res.origin, voxel_size).astype(res.centers.dtype, copy=False),
+        counts=counts,
+        density=(counts.astype(np.float64) / vol).astype(res.density.dtype, copy=False),
+        index_ijk=uniq.astype(np.int64),
+        voxel_size=voxel_size,
+        origin=res.origin.copy(),
+    )
+
+
+def build_voxel_pyramid(base: VoxelDensityResult, levels: int, factor: int = 2) -> List[VoxelDensityResult]:
+    """基準ボクセルから factor 倍ずつ粗くしたピラミッド [base, ×2, ×4, ...] を作る"""
+    if levels <= 0:
+        raise ValueError("levelsは正の整数である必要がある")
+    pyramid = [base]
+    for _ in range(levels - 1):
+        pyramid.append(coarsen_voxel_result(pyramid[-1], factor))
+    return pyramid
+
+
+class VoxelAccumulator:
+    """ボクセルごとの点数と座標和を疎に保持する集計器
+    ・点群をチャンクごとに add_points で流し込める（全点を保持しない）
+    ・同じ origin / voxel_size / shift の集計器どうしは merge で統合できる
+    ・メモリは点数ではなく占有ボクセル数に比例する
+    ・点が局所座標（絶対座標 - shift）なら shift を与える。origin と重心は絶対座標
+    """
+
+    def __init__(self, origin: np.ndarray, voxel_size: np.ndarray, shift: Optional[np.ndarray] = None):
+        self.origin = np.asarray(origin, dtype=np.float64).copy()
+        self.voxel_size = np.asarray(voxel_size, dtype=np.float64).copy()
+        self.shift = as_shift(shift).copy()
+        self.index_ijk = np.zeros((0, 3), dtype=np.int64)
+        self.counts = np.zeros((0,), dtype=np.int64)
+        self.sums = np.zeros((0, 3), dtype=np.float64)
+        self.num_points = 0
+        # 未統合の部分集計（統合はまとめて行い、チャンクごとの再集約を避ける）
+        self._pending = []
+        self._pending_rows = 0
+
+    def add_points(self, points: np.ndarray) -> None:
+        """点群(チャンク)を集計に加える"""
+        if points.shape[0] == 0:
+            return
+        ijk = voxel_index(points, self.origin - self.shift, self.voxel_size)
+        uniq, _, counts, sums = group_voxels(ijk, points)
+        self._push(uniq, counts, sums)
+        self.num_points += int(points.shape[0])
+
+    def merge(self, other: "VoxelAccumulator") -> None:
+        """別の集計器の内容を取り込む"""
+        if not (np.array_equal(self.origin, other.origin) and np.array_equal(self.voxel_size, other.voxel_size)
+                and np.array_equal(self.shift, other.shift)):
+            raise ValueError("originとvoxel_sizeとshiftが同じ集計器どうしでなければ統合できない")
+        other._flush()
+        self._push(other.index_ijk, other.counts, other.sums)
+        self.num_points += other.num_points
+
+    def _push(self, ijk: np.ndarray, counts: np.ndarray, sums: np.ndarray) -> None:
+        self._pending.append((ijk, counts, sums))
+        self._pending_rows += ijk.shape[0]
+        # 保留分が確定分を超えたら統合（統合回数を対数オーダーに抑える）
+        if self._pending_rows > max(self.index_ijk.shape[0], 1 << 16):
+            self._flush()
+
+    def _flush(self) -> None:
+        if not self._pending:
+            return
+        ijk = np.concatenate([self.index_ijk] + [p[0] for p in self._pending], axis=0)
+        cnt = np.concatenate([self.counts] + [p[1] for p in self._pending], axis=0)
+        sums = np.concatenate([self.sums] + [p[2] for p in self._pending], axis=0)
+        self._pending, self._pending_rows = [], 0
+
+        uniq, inverse, _, _ = group_voxels(ijk)
+        m = uniq.shape[0]
+        self.index_ijk = uniq
+        self.counts = np.rint(np.bincount(inverse, weights=cnt, minlength=m)).astype(np.int64)
+        self.sums = np.stack([np.bincount(inverse, weights=sums[:, a], minlength=m) for a in range(3)], axis=1)
+
+    def centroids(self) -> np.ndarray:
+        """各ボクセルの重心（座標和 / 点数 + shift。float64の絶対座標）"""
+        self._flush()
+        return self.sums / np.maximum(self.counts, 1)[:, None].astype(np.float64) + self.shift
+
+    def to_result(self, dtype=np.float64) -> VoxelDensityResult:
+        """集計結果を VoxelDensityCalculator.compute と同じ形式で返す（density は dtype）"""
+        self._flush()
+        vol = float(np.prod(self.voxel_size))
+        return VoxelDensityResult(
+            centers=voxel_center_from_index(self.index_ijk, self.origin, self.voxel_size),
+            counts=self.counts.copy(),
+            density=(self.counts.astype(np.float64) / vol).astype(dtype, copy=False),
+            index_ijk=self.index_ijk.copy(),
+            voxel_size=self.voxel_size.copy(),
+            origin=self.origin.copy(),
+        )
+
+
 class VoxelDensityCalculator:
-    """ボクセル単位の密度（単純な点数/体積）を計算する"""
+    """ボクセル単位の密度（単純な点数/体積）を計算する
+    ・dtype は入力点と density の精度。float32 でもボクセル番号と集計はfloat64/整数で行う
+    ・座標（centers, origin）は常にfloat64の絶対座標。入力点が局所座標（IO.load_local_points）なら
+      shift を与える（origin は絶対座標で指定し、shift を引いた局所の原点で番号を求める）
+    """
 
-    def __init__(self, voxel_size: Tuple[float, float, float]):
+    def __init__(self, voxel_size: Tuple[float, float, float], dtype=np.float64):
         self.voxel_size = np.array(voxel_size, dtype=np.float64)
+        self.dtype = resolve_dtype(dtype)
         if np.any(self.voxel_size <= 0):
             raise ValueError("voxel_sizeは正である必要がある")
 
-    def compute(self, points: np.ndarray, origin: Optional[np.ndarray] = None) -> VoxelDensityResult:
+    def compute(self, points: np.ndarray, origin: Optional[np.ndarray] = None,
+                shift: Optional[np.ndarray] = None) -> VoxelDensityResult:
+        shift = as_shift(shift)
         # AABBに基づく原点設定（未指定ならmin）
         if origin is None:
             pmin, _ = aabb_of_points(points)
-            origin = pmin
-        origin = origin.astype(np.float64)
+            origin = pmin.astype(np.float64) + shift
+        origin = np.asarray(origin, dtype=np.float64)
 
-        # 各点のボクセルインデックス
-        ijk = voxel_index(points, origin, self.voxel_size)
+        # 各点のボクセルインデックス（局所座標の点には局所の原点を使う）
+        ijk = voxel_index(points, origin - shift, self.voxel_size)
 
-        # ユニークなボクセルごとにカウント
-        # uniqueの戻り値：uniq_indicesは各ユニーク行の代表、inverseは元配列→ユニーク行のマッピング
-        uniq, inverse, counts = np.unique(ijk, axis=0, return_inverse=True, return_counts=True)
+        # ユニークなボクセルごとにカウント（int64キーで1次元に集約）
+        # uniqは辞書式昇順のユニークなインデックス、inverseは元配列→ユニーク行のマッピング
+        uniq, inverse, counts, _ = group_voxels(ijk)
 
-        # ボクセル中心座標
+        # ボクセル中心座標（絶対座標、float64）
         centers = voxel_center_from_index(uniq, origin, self.voxel_size)
 
         # 体積と密度
         vol = float(np.prod(self.voxel_size))
-        density = counts.astype(np.float64) / vol
+        density = (counts.astype(np.float64) / vol).astype(self.dtype, copy=False)
 
         return VoxelDensityResult(
             centers=centers,
@@ -54,4 +173,16 @@ class VoxelDensityCalculator:
             index_ijk=uniq.astype(np.int64),
             voxel_size=self.voxel_size.copy(),
             origin=origin.copy(),
-        )
\ No newline at end of file
+        )
+
+    def compute_stream(self, chunks: Iterable[np.ndarray], origin: np.ndarray,
+                       shift: Optional[np.ndarray] = None) -> VoxelDensityResult:
+        """点群をチャンク列として受け取り、compute と同じ結果を返す（アウトオブコア用）
+        ・originは事前に決めておく必要がある（全点のAABB最小は PointCloudIO.scan_aabb で求める）
+        """
+        acc = VoxelAccumulator(np.asarray(origin, dtype=np.float64), self.voxel_size, shift)
+        for pts in chunks:
+            acc.add_points(pts)
+        if acc.num_points == 0:
+            raise ValueError("点群が空である")
+        return acc.to_result(self.dtype)
\ No newline at end of file
@@ -1,26 +1,188 @@
 # ==========================
 # CSV/NPZ書き出し
 # ==========================
+# ・CSVはブロックごとに列を Python の数値リストにし、1行分の書式文字列で行を整形してまとめて書く
+#   （行ごとの csv.writer 呼び出しと NumPy スカラーの整形をしない。整形自体は行ごとの % のままで、
+#    np.char.mod で列ごとに整形する方が要素ごとに呼び出すぶん遅かった）
+# ・列指向の出力（結果ディレクトリ / Parquet / Arrow IPC）も選べる。列を選んで読み戻せる
 
-import csv
+import json
 import numpy as np
 from pathlib import Path
 from cal_den import VoxelDensityResult
+from pointwise import PointDensityResult
 from utility import ensure_dir
-from typing import TYPE_CHECKING
+from results import save_result_dir, read_result_header, result_columns, load_result
+from typing import TYPE_CHECKING, Dict, List, Optional, Sequence, Tuple
 if TYPE_CHECKING:
     from kde import KDEGridResult
 
-def save_voxel_csv(prefix: Path, res: VoxelDensityResult) -> Path:
-    csv_path = prefix.with_suffix(".csv")
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover
+    pa = None
+
+# 出力形式
+#   csv: CSV / npz: 圧縮NPZ（従来形式）/ npy: 結果ディレクトリ（results.py）/ parquet / arrow: Arrow IPC
+OUTPUT_FORMATS = ("csv", "npz", "npy", "parquet", "arrow")
+
+# CSVを書くときに一度に整形する行数（文字列のメモリを抑えるため）
+_CSV_BLOCK_ROWS = 1 << 18
+
+# CSVの各列の書式（voxel_columns / kde_columns の列順）
+_VOXEL_CSV_FMTS = ("%.6f", "%.6f", "%.6f", "%d", "%.8e", "%d", "%d", "%d")
+_KDE_CSV_FMTS = ("%.6f", "%.6f", "%.6f", "%d", "%.8e")
+_KDE_LEVEL_CSV_FMT = "%d"  # 疎グリッドのときだけ付く level 列
+_POINT_CSV_FMTS = ("%.6f", "%.6f", "%.6f", "%d", "%.8e")
+
+
+def _require_pyarrow() -> None:
+    if pa is None:
+        raise ImportError("Parquet/Arrow出力にはpyarrowが必要である。`pip install pyarrow` を実行すること。")
+
+
+def voxel_columns(res: VoxelDensityResult) -> Dict[str, np.ndarray]:
+    """ボクセル密度の結果を列の辞書にする（CSVと同じ列名）"""
+    return result_columns("voxel", vars(res))
+
+
+def kde_columns(res: "KDEGridResult") -> Dict[str, np.ndarray]:
+    """KDEの結果を列の辞書にする（CSVと同じ列名）"""
+    return result_columns("kde", vars(res))
+
+
+def point_columns(res: PointDensityResult) -> Dict[str, np.ndarray]:
+    """点ごとの密度の結果を列の辞書にする（CSVと同じ列名。xyzの横に近傍数と密度）"""
+    return result_columns("point", vars(res))
+
+
+def _kde_csv_fmts(res: "KDEGridResult") -> Tuple[str, ...]:
+    return _KDE_CSV_FMTS + ((_KDE_LEVEL_CSV_FMT,) if res.grid_level is not None else ())
+
+
+def write_csv_columns(csv_path: Path, columns: Dict[str, np.ndarray], fmts: Sequence[str]) -> Path:
+    """列の辞書をCSVに書く
+    ・1行分の書式文字列を作り、ブロックごとに行を整形して（行ごとの % は残る）1回で書き込む
+    ・速くなるのは csv.writer の呼び出しと NumPy スカラーの整形が無くなる分だけ（約95万ボクセルで 5.5s → 2.4s）
+    ・出力は csv.writer（改行 \r\n）で1行ずつ書いた場合とバイト単位で同じ
+    """
     ensure_dir(csv_path)
+    names = list(columns.keys())
+    row_fmt = ",".join(fmts) + "\r\n"
+    n = int(next(iter(columns.values())).shape[0]) if names else 0
     with csv_path.open("w", newline="", encoding="utf-8") as f:
-        w = csv.writer(f)
-        w.writerow(["cx", "cy", "cz", "count", "density", "i", "j", "k"])  # ヘッダ
-        for (c, cnt, den, ijk) in zip(res.centers, res.counts, res.density, res.index_ijk):
-            w.writerow([f"{c[0]:.6f}", f"{c[1]:.6f}", f"{c[2]:.6f}", int(cnt), f"{den:.8e}", int(ijk[0]), int(ijk[1]), int(ijk[2])])
+        f.write(",".join(names) + "\r\n")
+        for start in range(0, n, _CSV_BLOCK_ROWS):
+            block = [np.asarray(columns[c][start:start + _CSV_BLOCK_ROWS]).tolist() for c in names]
+            f.write("".join(map(row_fmt.__mod__, zip(*block))))
+    return csv_path
+
+
+def save_columns(prefix: Path, columns: Dict[str, np.ndarray], meta: Dict, fmt: str) -> Path:
+    """列の辞書を Arrow 系の列指向形式で保存する
+    ・parquet: <prefix>.parquet（圧縮あり。列を選んで読める）
+    ・arrow  : <prefix>.arrow（Arrow IPC、非圧縮。メモリマップで読める）
+    ・meta は voxel_size などのスカラー/小配列（JSONにできるもの）
+    ・.npy の結果ディレクトリは results.save_result_dir を使う
+    """
+    meta = {k: np.asarray(v).tolist() for k, v in meta.items()}
+    if fmt in ("parquet", "arrow"):
+        _require_pyarrow()
+        table = pa.table({name: np.ascontiguousarray(col) for name, col in columns.items()})
+        table = table.replace_schema_metadata({"density_meta": json.dumps(meta)})
+        out_path = prefix.with_suffix("." + fmt)
+        ensure_dir(out_path)
+        if fmt == "parquet":
+            pq.write_table(table, out_path)
+        else:
+            feather.write_feather(table, out_path, compression="uncompressed")
+        return out_path
+    raise ValueError(f"未対応の列指向形式: {fmt}（parquet, arrow のいずれか）")
+
+
+def load_columns(path: Path, columns: Optional[Sequence[str]] = None) -> Tuple[Dict[str, np.ndarray], Dict]:
+    """列指向の出力（結果ディレクトリ / Parquet / Arrow）を列単位で読み戻す: (列の辞書, meta)
+    ・columns を与えるとその列だけを読む（他の列はディスクから読まない）
+    ・結果ディレクトリ / arrow はメモリマップで開くので、読み込み自体はほぼコピー無し
+    """
+    path = Path(path)
+    if path.is_dir():
+        header = read_result_header(path)
+        fields = load_result(path, list(header["fields"]))
+        return result_columns(header["kind"], fields, columns), header["meta"]
+    _require_pyarrow()
+    cols = list(columns) if columns is not None else None
+    if path.suffix == ".parquet":
+        table = pq.read_table(path, columns=cols)
+    elif path.suffix == ".arrow":
+        table = feather.read_table(path, columns=cols, memory_map=True)
+    else:
+        raise ValueError(f"列指向の出力ではない: {path}")
+    raw = (table.schema.metadata or {}).get(b"density_meta", b"{}")
+    return {c: table.column(c).to_numpy() for c in table.column_names}, json.loads(raw)
+
+
+def save_voxel_outputs(prefix: Path, res: VoxelDensityResult, formats: Sequence[str] = ("csv",)) -> List[Path]:
+    """ボクセル密度を指定の形式ですべて書き出し、書き出したパスを返す"""
+    outputs: List[Path] = []
+    for fmt in formats:
+        if fmt == "csv":
+            outputs.append(write_csv_columns(prefix.with_suffix(".csv"), voxel_columns(res), _VOXEL_CSV_FMTS))
+        elif fmt == "npz":
+            outputs.append(_save_voxel_npz(prefix, res))
+        elif fmt == "npy":
+            outputs.append(save_result_dir(prefix, res))
+        else:
+            outputs.append(save_columns(prefix, voxel_columns(res),
+                                        {"voxel_size": res.voxel_size, "origin": res.origin}, fmt))
+    return outputs
+
+
+def save_kde_outputs(prefix: Path, res: "KDEGridResult", formats: Sequence[str] = ("csv",)) -> List[Path]:
+    """KDEの結果を指定の形式ですべて書き出し、書き出したパスを返す"""
+    outputs: List[Path] = []
+    for fmt in formats:
+        if fmt == "csv":
+            outputs.append(write_csv_columns(prefix.with_suffix(".csv"), kde_columns(res), _kde_csv_fmts(res)))
+        elif fmt == "npz":
+            outputs.append(_save_kde_npz(prefix, res))
+        elif fmt == "npy":
+            outputs.append(save_result_dir(prefix, res))
+        else:
+            meta = {"radius": res.radius, "sigma": res.sigma, "grid_U": res.grid_U,
+                    "roi_min": res.roi_min, "roi_max": res.roi_max}
+            outputs.append(save_columns(prefix, kde_columns(res), meta, fmt))
+    return outputs
+
+
+def save_point_outputs(prefix: Path, res: PointDensityResult, formats: Sequence[str] = ("csv",)) -> List[Path]:
+    """点ごとの密度を指定の形式ですべて書き出し、書き出したパスを返す"""
+    outputs: List[Path] = []
+    for fmt in formats:
+        if fmt == "csv":
+            outputs.append(write_csv_columns(prefix.with_suffix(".csv"), point_columns(res), _POINT_CSV_FMTS))
+        elif fmt == "npz":
+            outputs.append(_save_point_npz(prefix, res))
+        elif fmt == "npy":
+            outputs.append(save_result_dir(prefix, res))
+        else:
+            meta = {"radius": res.radius, "sigma": res.sigma, "estimator": res.estimator}
+            outputs.append(save_columns(prefix, point_columns(res), meta, fmt))
+    return outputs
+
+
+def save_voxel_csv(prefix: Path, res: VoxelDensityResult) -> Path:
+    csv_path = write_csv_columns(prefix.with_suffix(".csv"), voxel_columns(res), _VOXEL_CSV_FMTS)
     # NPZ（プログラム連携用）
+    _save_voxel_npz(prefix, res)
+    return csv_path
+
+
+def _save_voxel_npz(prefix: Path, res: VoxelDensityResult) -> Path:
     npz_path = prefix.with_suffix(".npz")
+    ensure_dir(npz_path)
     np.savez_compressed(
         npz_path,
         centers=res.centers,
@@ -30,19 +192,58 @@ def save_voxel_csv(prefix: Path, res: VoxelDensityResult) -> Path:
         voxel_size=res.voxel_size,
         origin=res.origin,
     )
-    return csv_path
+    return npz_path
+
+
+def save_voxel_pyramid_npz(prefix: Path, levels: List[VoxelDensityResult]) -> Path:
+    """多解像度ボクセル密度（ピラミッド）を1つのNPZにまとめて保存
+    ・各列は全レベルを連結した配列。レベルlの行は level_offsets[l]:level_offsets[l+1]
+    ・voxel_sizes[l] がレベルlのボクセルサイズ（originは全レベル共通）
+    """
+    npz_path = prefix.with_name(prefix.stem + "_pyramid.npz")
+    ensure_dir(npz_path)
+    offsets = np.zeros((len(levels) + 1,), dtype=np.int64)
+    np.cumsum([r.counts.shape[0] for r in levels], out=offsets[1:])
+    np.savez_compressed(
+        npz_path,
+        level_offsets=offsets,
+        voxel_sizes=np.stack([r.voxel_size for r in levels], axis=0),
+        origin=levels[0].origin,
+        centers=np.concatenate([r.centers for r in levels], axis=0),
+        counts=np.concatenate([r.counts for r in levels]),
+        density=np.concatenate([r.density for r in levels]),
+        index_ijk=np.concatenate([r.index_ijk for r in levels], axis=0),
+    )
+    return npz_path
+
+
+def save_voxel_pyramid_outputs(prefix: Path, levels: List[VoxelDensityResult],
+                               formats: Sequence[str] = ("npz",)) -> List[Path]:
+    """ピラミッドを指定の形式ですべて書き出し、書き出したパスを返す
+    ・npz: 全レベルを1つのNPZ（<名前>_pyramid.npz）にまとめる
+    ・それ以外: レベルごとに <名前>_L<l> として save_voxel_outputs と同じ形式で書く
+    """
+    outputs: List[Path] = []
+    if "npz" in formats:
+        outputs.append(save_voxel_pyramid_npz(prefix, levels))
+    others = [fmt for fmt in formats if fmt != "npz"]
+    if others:
+        for lv, r in enumerate(levels):
+            outputs += save_voxel_outputs(prefix.with_name(f"{prefix.stem}_L{lv}"), r, others)
+    return outputs
 
 
 def save_kde_csv(prefix: Path, res: "KDEGridResult") -> Path:
-    csv_path = prefix.with_suffix(".csv")
-    ensure_dir(csv_path)
-    with csv_path.open("w", newline="", encoding="utf-8") as f:
-        w = csv.writer(f)
-        w.writerow(["gx", "gy", "gz", "neighbors", "kde"])
-        for (g, n, k) in zip(res.grid_points, res.neighbor_counts, res.kde_values):
-            w.writerow([f"{g[0]:.6f}", f"{g[1]:.6f}", f"{g[2]:.6f}", int(n), f"{k:.8e}"])
+    csv_path = write_csv_columns(prefix.with_suffix(".csv"), kde_columns(res), _kde_csv_fmts(res))
     # NPZ
+    _save_kde_npz(prefix, res)
+    return csv_path
+
+
+def _save_kde_npz(prefix: Path, res: "KDEGridResult") -> Path:
     npz_path = prefix.with_suffix(".npz")
+    ensure_dir(npz_path)
+    optional = {"grid_level": res.grid_level} if res.grid_level is not None else {}
     np.savez_compressed(
         npz_path,
         grid_points=res.grid_points,
@@ -53,5 +254,21 @@ def save_kde_csv(prefix: Path, res: "KDEGridResult") -> Path:
         grid_U=res.grid_U,
         roi_min=res.roi_min,
         roi_max=res.roi_max,
+        **optional,
+    )
+    return npz_path
+
+
+def _save_point_npz(prefix: Path, res: PointDensityResult) -> Path:
+    npz_path = prefix.with_suffix(".npz")
+    ensure_dir(npz_path)
+    np.savez_compressed(
+        npz_path,
+        points=res.points,
+        counts=res.counts,
+        density=res.density,
+        radius=res.radius,
+        sigma=res.sigma,
+        estimator=res.estimator,
     )
-    return csv_path
\ No newline at end of file
+    return npz_path
\ No newline at end of file
@@ -10,54 +10,240 @@
 
 ・ターミナル上でのデバッグ例
 python density/detect.py --input "F:\Experiments\MasterEx\pcd-dataset\PU-GAN\complex\AncientTurtl_aligned.pcd" --mode voxel --voxel-size 0.05 0.05 0.05 --output-prefix .\out\voxel --export-ply
+・RAMに載らない巨大点群はチャンク読み込み（--stream）で集計する
+python density/detect.py --input "F:\Experiments\MasterEx\pcd-dataset\aerial\scan.pcd" --mode voxel --voxel-size 0.5 0.5 0.5 --stream --chunk-size 2000000
+・多解像度（基準, ×2, ×4, ×8）のボクセル密度を1回の走査でまとめて求める
+・入力点ごとの近傍数（半径0.02m）をxyzの横に書き出す（ボクセル/グリッドから点へ戻す処理が要らない）
+python density/detect.py --input "F:\Experiments\MasterEx\pcd-dataset\PU-GAN\complex\AncientTurtl_aligned.pcd" --mode point --radius 0.02 --workers 8
+python density/detect.py --input "F:\Experiments\MasterEx\pcd-dataset\PU-GAN\complex\AncientTurtl_aligned.pcd" --mode pyramid --voxel-size 0.0125 0.0125 0.0125 --pyramid-levels 4 --output-format npz
+・表面付近の格子点だけでKDEを評価し、変化の大きいところを2段細分する（U^3の密グリッドを作らない）
+python density/detect.py --input "F:\Experiments\MasterEx\pcd-dataset\PU-GAN\complex\AncientTurtl_aligned.pcd" --mode kde --voxel-size 0.0125 0.0125 0.0125 --grid-U 256 --radius 0.05 --sigma 0.02 --kde-grid sparse --refine-levels 2
+・タイル分割して複数プロセスで計算する（KDEはタイル境界にradius分のハローを付けるので結果は同じ）
+python density/detect.py --input "F:\Experiments\MasterEx\pcd-dataset\PU-GAN\complex\AncientTurtl_aligned.pcd" --mode kde --voxel-size 0.05 0.05 0.05 --grid-U 64 --workers 8
+・同じ入力・同じパラメータの結果は <out-root>/.cache に残り、次回は読み込みも計算も省く（--no-cache で無効）
+・ディレクトリ内の全PCDを8プロセスで一括処理する（中断しても再実行すれば完了分は飛ばす）
+python density/detect.py --input "F:\Experiments\MasterEx\pcd-dataset\PartAnnotation" --batch --mode voxel --voxel-size 0.05 0.05 0.05 --workers 8
+・読み込み/ボクセル化/KDE/書き出しの段ごとの時間・ピークメモリ・点/秒を表示し、JSONにも残す
+python density/detect.py --input "F:\Experiments\MasterEx\pcd-dataset\PU-GAN\complex\AncientTurtl_aligned.pcd" --mode kde --voxel-size 0.05 0.05 0.05 --profile --profile-out .\out\profile.json
 """
 
 from __future__ import annotations
 
+from pathlib import Path
+import sys
+from typing import List
 import numpy as np
 from IO import PointCloudIO
-from cal_den import VoxelDensityCalculator
-from csv_npz import save_voxel_csv
+from cal_den import VoxelDensityCalculator, build_voxel_pyramid
+from csv_npz import save_voxel_outputs, save_kde_outputs, save_point_outputs, save_voxel_pyramid_outputs
 from kde import PDVKDEDensityCalculator
+from pointwise import PointDensityCalculator
+from regions import extract_low_density_regions, save_low_density_regions
 from CLI import parse_args, parse_roi
-from utility import derive_output_prefix
+from utility import derive_output_prefix, aabb_of_points, local_shift
+from tiling import TiledDensityExecutor
+from batch import run_batch
+from cache import open_cache
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))  # Mine/
+from assist.time import profiler
+
+
+class _InputCloud:
+    """入力点群を必要になった時点で1回だけ読む（キャッシュにヒットすれば読まずに済む）
+    ・--stream 時は全点を読まず、AABBだけ先に1回走査して求める（points は None）
+    ・points / chunks() は局所座標（絶対座標 - shift）。aabb は絶対座標
+      （--dtype float32 では shift = AABB最小。float64 では0）
+    """
+
+    def __init__(self, args, input_path: Path):
+        self.args = args
+        self.path = input_path
+        self._pts = None
+        self._shift = None
+        self._aabb = None
+
+    def _load(self) -> None:
+        with profiler.stage("load") as st:
+            self._pts, self._shift = PointCloudIO.load_local_points(self.path, dtype=self.args.dtype)
+            st.points = self._pts.shape[0]
+
+    @property
+    def points(self):
+        if self._pts is None and not self.args.stream:
+            self._load()
+        return self._pts
+
+    @property
+    def shift(self):
+        if self._shift is None:
+            if self.args.stream:
+                self._shift = local_shift(self.aabb[0], self.args.dtype)
+            else:
+                self._load()
+        return self._shift
+
+    @property
+    def aabb(self):
+        if self._aabb is None:
+            if self.args.stream:
+                with profiler.stage("scan_aabb"):
+                    self._aabb = PointCloudIO.scan_aabb(self.path, self.args.chunk_size)
+            else:
+                pmin, pmax = aabb_of_points(self.points)
+                self._aabb = (pmin + self.shift, pmax + self.shift)
+        return self._aabb
+
+    def chunks(self):
+        return PointCloudIO.iter_points(self.path, self.args.chunk_size, self.args.dtype, self.shift)
+
+
+def _compute_voxel(args, cloud: _InputCloud, calc: VoxelDensityCalculator, executor: TiledDensityExecutor):
+    origin = np.array(args.voxel_origin, dtype=np.float64) if args.voxel_origin is not None else None
+    if args.stream:
+        origin = origin if origin is not None else cloud.aabb[0]
+        with profiler.stage("voxelize"):  # --stream 時は読み込みもこの中
+            return calc.compute_stream(cloud.chunks(), origin=origin, shift=cloud.shift)
+    pts = cloud.points
+    with profiler.stage("voxelize", points=pts.shape[0]):
+        return executor.compute_voxel(calc, pts, origin=origin, shift=cloud.shift)
 
-def main() -> None:
-    args = parse_args()
 
-    # 出力接頭辞（--output-prefix 未指定時は入力から自動生成）
-    output_prefix = args.output_prefix or derive_output_prefix(args.input, args.out_root)
+def _compute_kde(args, cloud: _InputCloud, calc: PDVKDEDensityCalculator, executor: TiledDensityExecutor):
+    roi_min, roi_max = parse_roi(args.roi, np.stack(cloud.aabb))
+    if args.stream:
+        with profiler.stage("voxelize"):  # --stream 時は読み込みもこの中
+            centroids = calc.accumulate_centroids(cloud.chunks(), origin=cloud.aabb[0], shift=cloud.shift)
+        with profiler.stage("KDE"):
+            return executor.kde_from_centroids(calc, centroids, (roi_min, roi_max))
+    pts = cloud.points
+    with profiler.stage("KDE", points=pts.shape[0]):
+        return executor.compute_kde(calc, pts, roi=(roi_min, roi_max), shift=cloud.shift)
 
-    # 入力読み込み
-    pts = PointCloudIO.load_points(args.input)
+
+def _compute_point(cloud: _InputCloud, calc: PointDensityCalculator, executor: TiledDensityExecutor):
+    pts = cloud.points
+    with profiler.stage("point_density", points=pts.shape[0]):
+        return executor.compute_point(calc, pts, shift=cloud.shift)
+
+
+def run_file(args, input_path: Path, output_prefix: Path) -> List[Path]:
+    """1ファイル分の密度計算と書き出し。書き出したファイルのリストを返す
+    ・--batch 時はファイル単位で並列化するので、ファイル内のタイル並列は使わない
+    """
+    outputs: List[Path] = []
+    cloud = _InputCloud(args, input_path)
+    executor = TiledDensityExecutor(1 if args.batch else args.workers)
+    cache = open_cache(args)
+
+    def cached(calc, compute, **extra):
+        # キーには原点/RoIの指定そのものを入れる（auto は入力から決まるので入力ハッシュで区別される）
+        if cache is None:
+            return compute()
+        return cache.get_or_compute(input_path, calc, compute, **extra)
 
     # モード分岐
     if args.mode == "voxel":
-        calc = VoxelDensityCalculator(tuple(args.voxel_size))
-        origin = np.array(args.voxel_origin, dtype=np.float64) if args.voxel_origin is not None else None
-        res = calc.compute(pts, origin=origin)
-        csv_path = save_voxel_csv(output_prefix, res)
-        print(f"[Voxel] CSV: {csv_path}")
+        calc = VoxelDensityCalculator(tuple(args.voxel_size), dtype=args.dtype)
+        res = cached(calc, lambda: _compute_voxel(args, cloud, calc, executor), origin=args.voxel_origin)
+        with profiler.stage("write", points=res.counts.shape[0]):
+            saved = save_voxel_outputs(output_prefix, res, args.output_format)
+        outputs += saved
+        for path in saved:
+            print(f"[Voxel] 出力: {path}")
+        if args.low_regions:
+            # 隣接する低密度ボクセルを領域にまとめる（--stream 時は点の番号は出さない）
+            pts = cloud.points
+            with profiler.stage("regions", points=res.counts.shape[0]):
+                regions = extract_low_density_regions(res, pts, args.low_threshold, args.low_percentile,
+                                                      args.connectivity, args.region_min_voxels,
+                                                      shift=cloud.shift)
+                saved = save_low_density_regions(output_prefix, regions)
+            outputs += saved
+            print(f"[Voxel] 低密度領域: {regions.num_regions} 個（density <= {regions.threshold:.8e}）: {saved[0]}")
         if args.export_ply:
             # ボクセル中心に密度を割り当ててPLY
             ply_path = output_prefix.with_suffix(".ply")
-            PointCloudIO.save_points_with_scalar(res.centers, res.density, ply_path)
+            with profiler.stage("write_ply", points=res.centers.shape[0]):
+                PointCloudIO.save_points_with_scalar(res.centers, res.density, ply_path)
+            outputs.append(ply_path)
             print(f"[Voxel] PLY: {ply_path}")
 
+    elif args.mode == "pyramid":
+        # 基準ボクセルで1回だけ点を数え、粗いレベルは子ボクセルの集約で作る
+        calc = VoxelDensityCalculator(tuple(args.voxel_size), dtype=args.dtype)
+        base = cached(calc, lambda: _compute_voxel(args, cloud, calc, executor), origin=args.voxel_origin)
+        with profiler.stage("pyramid", points=base.counts.shape[0]):
+            levels = build_voxel_pyramid(base, args.pyramid_levels)
+        with profiler.stage("write"):
+            saved = save_voxel_pyramid_outputs(output_prefix, levels, args.output_format)
+        outputs += saved
+        for lv, r in enumerate(levels):
+            print(f"[Pyramid] L{lv}: voxel={r.voxel_size.tolist()} voxels={r.counts.shape[0]}")
+        for path in saved:
+            print(f"[Pyramid] 出力: {path}")
+
     elif args.mode == "kde":
-        roi_min, roi_max = parse_roi(args.roi, pts)
-        calc = PDVKDEDensityCalculator(tuple(args.voxel_size), args.grid_U, args.radius, args.sigma)
-        res = calc.compute(pts, roi=(roi_min, roi_max))
-        csv_path = save_voxel_csv(output_prefix, res)
-        print(f"[KDE] CSV: {csv_path}")
+        calc = PDVKDEDensityCalculator(tuple(args.voxel_size), args.grid_U, args.radius, args.sigma,
+                                       engine=args.kde_engine, dtype=args.dtype,
+                                       bandwidth=args.kde_bandwidth, knn_k=args.knn_k, knn_alpha=args.knn_alpha,
+                                       estimator=args.adaptive_estimator, support=args.kernel_support,
+                                       grid=args.kde_grid, refine_levels=args.refine_levels,
+                                       refine_quantile=args.refine_quantile)
+        res = cached(calc, lambda: _compute_kde(args, cloud, calc, executor), roi=args.roi)
+        with profiler.stage("write", points=res.grid_points.shape[0]):
+            saved = save_kde_outputs(output_prefix, res, args.output_format)
+        outputs += saved
+        for path in saved:
+            print(f"[KDE] 出力: {path}")
         if args.export_ply:
             # グリッド点にKDE値を割り当ててPLY
             ply_path = output_prefix.with_suffix(".ply")
-            PointCloudIO.save_points_with_scalar(res.grid_points, res.kde_values, ply_path)
+            with profiler.stage("write_ply", points=res.grid_points.shape[0]):
+                PointCloudIO.save_points_with_scalar(res.grid_points, res.kde_values, ply_path)
+            outputs.append(ply_path)
             print(f"[KDE] PLY: {ply_path}")
 
+    elif args.mode == "point":
+        calc = PointDensityCalculator(args.radius, args.sigma, estimator=args.point_estimator, dtype=args.dtype)
+        res = cached(calc, lambda: _compute_point(cloud, calc, executor))
+        with profiler.stage("write", points=res.points.shape[0]):
+            saved = save_point_outputs(output_prefix, res, args.output_format)
+        outputs += saved
+        for path in saved:
+            print(f"[Point] 出力: {path}")
+        if args.export_ply:
+            # 入力点に密度を割り当ててPLY
+            ply_path = output_prefix.with_suffix(".ply")
+            with profiler.stage("write_ply", points=res.points.shape[0]):
+                PointCloudIO.save_points_with_scalar(res.points, res.density, ply_path)
+            outputs.append(ply_path)
+            print(f"[Point] PLY: {ply_path}")
+
     else:  # pragma: no cover
         raise AssertionError("到達しない分岐")
+    if cache is not None:
+        print(cache.summary())
+    return outputs
+
+
+def main() -> None:
+    args = parse_args()
+    # --profile-out だけ指定しても計測する（--batch --workers>1 では子プロセスの内訳は集計されない）
+    profiler.enable(args.profile or args.profile_out is not None)
+    if args.batch:
+        with profiler.stage("batch"):
+            run_batch(run_file, args)
+    else:
+        # 出力接頭辞（--output-prefix 未指定時は入力から自動生成）
+        output_prefix = args.output_prefix or derive_output_prefix(args.input, args.out_root)
+        with profiler.stage("total"):
+            run_file(args, args.input, output_prefix)
+
+    if profiler.enabled:
+        profiler.print_report()
+        if args.profile_out is not None:
+            print(f"[Profile] 保存: {profiler.save_report(args.profile_out)}")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
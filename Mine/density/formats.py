@@ -0,0 +1,355 @@
+# density/formats.py
+# -*- coding: utf-8 -*-
+"""点群ファイル（PCD/PLY/OFF/XYZ/PTS）のヘッダ解析と直接読み込み
+Open3Dを通さずにファイルを直接読む。
+・read_xyz / read_cloud: ファイル全体を読む。バイナリは np.memmap で本体をそのまま構造化配列として開き、
+  ASCIIは np.loadtxt（C実装）で数値化する
+・iter_xyz_chunks     : 座標を固定点数ずつ取り出す。RAMより大きい点群でも扱える
+"""
+
+from dataclasses import dataclass, field
+from itertools import islice
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
+import numpy as np
+
+# PCDの (TYPE, SIZE) → numpy型
+_PCD_TYPES = {
+    ("F", 4): "f4", ("F", 8): "f8",
+    ("I", 1): "i1", ("I", 2): "i2", ("I", 4): "i4", ("I", 8): "i8",
+    ("U", 1): "u1", ("U", 2): "u2", ("U", 4): "u4", ("U", 8): "u8",
+}
+
+# PLYのプロパティ型 → numpy型
+_PLY_TYPES = {
+    "char": "i1", "int8": "i1", "uchar": "u1", "uint8": "u1",
+    "short": "i2", "int16": "i2", "ushort": "u2", "uint16": "u2",
+    "int": "i4", "int32": "i4", "uint": "u4", "uint32": "u4",
+    "float": "f4", "float32": "f4", "double": "f8", "float64": "f8",
+}
+
+# テキスト形式として扱う拡張子（1行1点、先頭3列がxyz）
+TEXT_SUFFIXES = (".xyz", ".xyzn", ".xyzrgb", ".txt", ".pts")
+
+# 直接読み込みに対応する拡張子
+NATIVE_SUFFIXES = (".pcd", ".ply", ".off") + TEXT_SUFFIXES
+
+# 局所座標へ変換するときの1チャンクの点数（float64 の一時配列の大きさ）
+_SHIFT_CHUNK = 1 << 20
+
+
+class UnsupportedFormatError(ValueError):
+    """直接読み込みに未対応の形式（呼び出し側でOpen3Dに切り替える目印）"""
+
+
+def _unique_field_names(names: List[str], path: Path) -> List[str]:
+    """構造化型に使えるようにフィールド名をそろえる
+    ・PCLが書くPCDの詰め物フィールド "_" は何度も出てくるので、_pad0, _pad1, ... に付け替える
+    ・それ以外の名前の重複は UnsupportedFormatError
+    """
+    out, n_pad = [], 0
+    for name in names:
+        if name == "_":
+            name, n_pad = f"_pad{n_pad}", n_pad + 1
+        if name in out:
+            raise UnsupportedFormatError(f"同じ名前のフィールド {name} が複数ある: {path}")
+        out.append(name)
+    return out
+
+
+@dataclass
+class CloudHeader:
+    """点群ファイルのヘッダ情報"""
+    fmt: str                      # "pcd" | "ply" | "off" | "xyz"
+    encoding: str                 # "ascii" | "binary"
+    fields: List[str]             # 属性名（xyz以外も含む）
+    num_points: int               # 点数（テキスト形式で不明なら -1）
+    data_offset: int = 0          # バイナリ本体の開始バイト位置
+    header_lines: int = 0         # ASCII本体の前にある行数
+    dtype: Optional[np.dtype] = None                        # バイナリ1点分のレコード型
+    xyz_cols: Tuple[int, int, int] = field(default=(0, 1, 2))  # ASCIIでのx,y,zの列番号
+
+
+def _read_pcd_header(path: Path) -> CloudHeader:
+    meta = {}
+    n_lines = 0
+    with path.open("rb") as f:
+        while True:
+            raw = f.readline()
+            if not raw:
+                raise ValueError(f"PCDヘッダにDATA行が無い: {path}")
+            n_lines += 1
+            line = raw.decode("ascii", errors="replace").strip()
+            if not line or line.startswith("#"):
+                continue
+            key, *vals = line.split()
+            meta[key.upper()] = vals
+            if key.upper() == "DATA":
+                offset = f.tell()
+                break
+
+    fields = _unique_field_names(meta.get("FIELDS", []), path)
+    sizes = [int(v) for v in meta.get("SIZE", [])]
+    types = [v.upper() for v in meta.get("TYPE", [])]
+    counts = [int(v) for v in meta.get("COUNT", ["1"] * len(fields))]
+    if not (len(fields) == len(sizes) == len(types) == len(counts)):
+        raise ValueError(f"PCDヘッダのFIELDS/SIZE/TYPE/COUNTの数が合わない: {path}")
+    for name in ("x", "y", "z"):
+        if name not in fields:
+            raise ValueError(f"PCDに座標フィールド {name} が無い: {path}")
+
+    if "POINTS" in meta:
+        num = int(meta["POINTS"][0])
+    else:
+        num = int(meta["WIDTH"][0]) * int(meta.get("HEIGHT", ["1"])[0])
+
+    data = meta["DATA"][0].lower()
+    if data == "binary_compressed":
+        raise UnsupportedFormatError(f"binary_compressed形式のPCDは直接読み込みに未対応: {path}")
+
+    # ASCII列番号（COUNT>1のフィールドは複数列を占める）
+    col_of, col = {}, 0
+    for name, c in zip(fields, counts):
+        col_of[name] = col
+        col += c
+    descr = []
+    for name, s, t, c in zip(fields, sizes, types, counts):
+        key = (t, s)
+        if key not in _PCD_TYPES:
+            raise UnsupportedFormatError(f"未対応のPCD型 TYPE={t} SIZE={s}: {path}")
+        base = "<" + _PCD_TYPES[key]
+        descr.append((name, base) if c == 1 else (name, base, (c,)))
+    return CloudHeader(
+        fmt="pcd",
+        encoding="binary" if data == "binary" else "ascii",
+        fields=list(fields),
+        num_points=num,
+        data_offset=offset,
+        header_lines=n_lines,
+        dtype=np.dtype(descr),
+        xyz_cols=(col_of["x"], col_of["y"], col_of["z"]),
+    )
+
+
+def _read_ply_header(path: Path) -> CloudHeader:
+    with path.open("rb") as f:
+        if f.readline().strip() != b"ply":
+            raise ValueError(f"PLYではない: {path}")
+        n_lines = 1
+        encoding, endian = "ascii", "<"
+        elements = []  # [(name, count, [(prop, type)])]
+        while True:
+            raw = f.readline()
+            if not raw:
+                raise ValueError(f"PLYヘッダにend_headerが無い: {path}")
+            n_lines += 1
+            tok = raw.decode("ascii", errors="replace").split()
+            if not tok or tok[0] in ("comment", "obj_info"):
+                continue
+            if tok[0] == "format":
+                encoding = "ascii" if tok[1] == "ascii" else "binary"
+                endian = ">" if tok[1] == "binary_big_endian" else "<"
+            elif tok[0] == "element":
+                elements.append((tok[1], int(tok[2]), []))
+            elif tok[0] == "property":
+                if not elements:
+                    raise ValueError(f"elementより前にpropertyがある: {path}")
+                if tok[1] == "list":
+                    elements[-1][2].append((tok[-1], "list"))
+                else:
+                    elements[-1][2].append((tok[2], tok[1]))
+            elif tok[0] == "end_header":
+                offset = f.tell()
+                break
+
+    if not elements or elements[0][0] != "vertex":
+        raise UnsupportedFormatError(f"PLYの先頭要素がvertexではない: {path}")
+    _, num, props = elements[0]
+    names = _unique_field_names([p for p, _ in props], path)
+    for name in ("x", "y", "z"):
+        if name not in names:
+            raise ValueError(f"PLYに座標プロパティ {name} が無い: {path}")
+    if any(t == "list" for _, t in props):
+        raise UnsupportedFormatError(f"vertexにlistプロパティを持つPLYは未対応: {path}")
+    descr = []
+    for name, (_, t) in zip(names, props):
+        if t not in _PLY_TYPES:
+            raise UnsupportedFormatError(f"未対応のPLY型 {t}: {path}")
+        descr.append((name, endian + _PLY_TYPES[t]))
+    return CloudHeader(
+        fmt="ply",
+        encoding=encoding,
+        fields=names,
+        num_points=num,
+        data_offset=offset,
+        header_lines=n_lines,
+        dtype=np.dtype(descr),
+        xyz_cols=(names.index("x"), names.index("y"), names.index("z")),
+    )
+
+
+def _read_off_header(path: Path) -> CloudHeader:
+    """OFF（"OFF" の次の行に頂点数・面数・辺数。"OFF n f e" の1行形式も可）"""
+    with path.open("r", encoding="utf-8-sig", errors="replace") as f:
+        head = f.readline().strip()
+        n_lines = 1
+        if not head.startswith("OFF"):
+            raise ValueError(f"OFF形式ではない（先頭行: {head}）: {path}")
+        counts = head[3:].split()
+        while not counts:
+            raw = f.readline()
+            if not raw:
+                raise ValueError(f"OFFに頂点数の行が無い: {path}")
+            n_lines += 1
+            counts = raw.split("#")[0].split()
+    return CloudHeader(fmt="off", encoding="ascii", fields=["x", "y", "z"], num_points=int(counts[0]),
+                       header_lines=n_lines)
+
+
+def read_header(path: Path) -> CloudHeader:
+    """拡張子からファイル形式を判定し、ヘッダを解析する"""
+    path = Path(path)
+    ext = path.suffix.lower()
+    if ext == ".pcd":
+        return _read_pcd_header(path)
+    if ext == ".ply":
+        return _read_ply_header(path)
+    if ext == ".off":
+        return _read_off_header(path)
+    if ext in TEXT_SUFFIXES:
+        # Leica形式のPTSは先頭行が点数だけの行になっている
+        with path.open("r", encoding="utf-8", errors="replace") as f:
+            tok = f.readline().split()
+        if len(tok) == 1 and tok[0].isdigit():
+            return CloudHeader(fmt="xyz", encoding="ascii", fields=["x", "y", "z"], num_points=int(tok[0]),
+                               header_lines=1)
+        return CloudHeader(fmt="xyz", encoding="ascii", fields=["x", "y", "z"], num_points=-1)
+    raise UnsupportedFormatError(f"直接読み込みに未対応の拡張子: {path}")
+
+
+def _xyz_view(rec: np.ndarray) -> np.ndarray:
+    """構造化配列から (N,3) の座標を取り出す
+    ・x,y,z が同じ型で連続して並んでいれば、コピーせずストライド付きビューを返す
+    ・そうでなければ3列を結合したコピーを返す
+    """
+    fx, fy, fz = (rec.dtype.fields[c] for c in ("x", "y", "z"))
+    t, size = fx[0], fx[0].itemsize
+    if fy[0] == t and fz[0] == t and fy[1] == fx[1] + size and fz[1] == fx[1] + 2 * size and t.shape == ():
+        return np.ndarray(shape=(rec.shape[0], 3), dtype=t, buffer=rec, offset=fx[1],
+                          strides=(rec.dtype.itemsize, size))
+    return np.stack([rec["x"], rec["y"], rec["z"]], axis=1)
+
+
+def _text_column_count(path: Path, skip: int) -> int:
+    """テキスト本体の最初のデータ行の列数"""
+    with path.open("r", encoding="utf-8", errors="replace") as f:
+        for line in islice(f, skip, None):
+            tok = line.split("#")[0].split()
+            if tok:
+                return len(tok)
+    return 0
+
+
+def _text_dtype(h: CloudHeader, path: Path) -> np.dtype:
+    """ASCII本体を読むときの構造化型（ヘッダに型が無い形式は全列float64。4列目以降は c3, c4, ...）"""
+    if h.dtype is not None:
+        return h.dtype
+    n_cols = max(3, _text_column_count(path, h.header_lines))
+    names = ["x", "y", "z"] + [f"c{i}" for i in range(3, n_cols)]
+    return np.dtype([(name, "<f8") for name in names])
+
+
+def shift_to_local(xyz: np.ndarray, shift: np.ndarray, dtype) -> np.ndarray:
+    """座標から局所原点 shift を float64 のまま差し引き、dtype の (N,3) 配列にする
+    ・_SHIFT_CHUNK 点ずつ処理するので、float64 の一時配列はチャンク分で済む
+    """
+    shift = np.asarray(shift, dtype=np.float64)
+    out = np.empty((xyz.shape[0], 3), dtype=dtype)
+    for start in range(0, xyz.shape[0], _SHIFT_CHUNK):
+        out[start:start + _SHIFT_CHUNK] = np.asarray(xyz[start:start + _SHIFT_CHUNK], dtype=np.float64) - shift
+    return out
+
+
+def read_xyz(path: Path, dtype=np.float64, shift: Optional[np.ndarray] = None) -> np.ndarray:
+    """点群ファイルの座標だけを (N,3) の連続配列で返す
+    ・バイナリ: memmap上のxyzのビューから dtype の配列へ1回だけコピーする
+    ・ASCII   : xyzの3列だけを np.loadtxt で数値化する
+    ・shift を与えると、座標から shift を引いた局所座標を返す（shift_to_local）
+    """
+    path = Path(path)
+    h = read_header(path)
+    if h.encoding == "binary":
+        rec = np.memmap(path, dtype=h.dtype, mode="r", offset=h.data_offset, shape=(h.num_points,))
+        xyz = _xyz_view(rec)
+        pts = np.array(xyz, dtype=dtype, order="C") if shift is None else shift_to_local(xyz, shift, dtype)
+        del rec, xyz
+        return pts
+    pts = np.loadtxt(path, dtype=dtype if shift is None else np.float64, usecols=h.xyz_cols,
+                     skiprows=h.header_lines, max_rows=h.num_points if h.num_points >= 0 else None,
+                     comments="#", ndmin=2)
+    return pts if shift is None else shift_to_local(pts, shift, dtype)
+
+
+def read_cloud(path: Path) -> np.ndarray:
+    """点群ファイルを全属性付きの構造化配列（1点1レコード）で返す
+    ・バイナリ: 本体を読み取り専用の np.memmap としてそのまま返す（コピー無し）
+    ・ASCII   : ヘッダの型（無ければ全列float64）で np.loadtxt する
+    ・座標は rec["x"], rec["y"], rec["z"]、その他の属性はヘッダのフィールド名で引ける
+    """
+    path = Path(path)
+    h = read_header(path)
+    if h.encoding == "binary":
+        return np.memmap(path, dtype=h.dtype, mode="r", offset=h.data_offset, shape=(h.num_points,))
+    return np.loadtxt(path, dtype=_text_dtype(h, path), skiprows=h.header_lines,
+                      max_rows=h.num_points if h.num_points >= 0 else None, comments="#", ndmin=1)
+
+
+def iter_xyz_chunks(path: Path, chunk_size: int = 1_000_000, dtype=np.float64,
+                    shift: Optional[np.ndarray] = None) -> Iterator[np.ndarray]:
+    """点群ファイルから座標を chunk_size 点ずつ (n,3) の dtype 配列で返す
+    ・バイナリ: 本体を np.memmap で開き、xyz列だけを切り出す
+    ・ASCII   : chunk_size 行ずつ読み、先頭(またはヘッダ指定)の3列を数値化する
+    ・shift を与えると、チャンクごとに shift を引いた局所座標を返す（shift_to_local）
+    """
+    path = Path(path)
+    chunk_size = max(1, int(chunk_size))
+    h = read_header(path)
+
+    if h.encoding == "binary":
+        rec = np.memmap(path, dtype=h.dtype, mode="r", offset=h.data_offset, shape=(h.num_points,))
+        for start in range(0, h.num_points, chunk_size):
+            xyz = _xyz_view(rec[start:start + chunk_size])
+            yield np.array(xyz, dtype=dtype, order="C") if shift is None else shift_to_local(xyz, shift, dtype)
+        del rec
+        return
+
+    remaining = h.num_points if h.num_points >= 0 else None
+    with path.open("r", encoding="utf-8", errors="replace") as f:
+        lines = islice(f, h.header_lines, None)
+        while remaining is None or remaining > 0:
+            n = chunk_size if remaining is None else min(chunk_size, remaining)
+            block = list(islice(lines, n))
+            if not block:
+                break
+            pts = np.loadtxt(block, dtype=dtype if shift is None else np.float64, usecols=h.xyz_cols,
+                             comments="#", ndmin=2)
+            if shift is not None:
+                pts = shift_to_local(pts, shift, dtype)
+            if remaining is not None:
+                remaining -= len(block)
+            if pts.shape[0] > 0:
+                yield pts
+
+
+def scan_aabb(path: Path, chunk_size: int = 1_000_000) -> Tuple[np.ndarray, np.ndarray, int]:
+    """ファイルを1回走査してAABBと点数を求める（メモリはチャンク1つ分）"""
+    pmin = np.full((3,), np.inf)
+    pmax = np.full((3,), -np.inf)
+    n = 0
+    for pts in iter_xyz_chunks(path, chunk_size):
+        pmin = np.minimum(pmin, pts.min(axis=0))
+        pmax = np.maximum(pmax, pts.max(axis=0))
+        n += pts.shape[0]
+    if n == 0:
+        raise ValueError(f"点群が空、または読み込めない: {path}")
+    return pmin, pmax, n
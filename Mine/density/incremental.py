@@ -0,0 +1,187 @@
+# density/incremental.py
+# -*- coding: utf-8 -*-
+"""逐次フレーム向けのインクリメンタルなボクセル密度
+LiDARのフレームを順に追加・削除しながら、ボクセルごとの点数と座標和を更新し続ける。
+バッチの集約はフレーム（バッチ）の大きさに比例する。地図全体の大きさに比例するのは、
+キー順の配列への挿入/削除（NumPyのコピー）だけで、Pythonのループや辞書は使わない。
+
+使い方例:
+  inc = IncrementalVoxelDensity((0.1, 0.1, 0.1), window=20)
+  for frame in frames:
+      inc.add_frame(frame)        # 21フレーム目からは最古のフレームが自動で抜ける
+      low = inc.lowest(10)        # 低密度ボクセルTop10（ボクセル番号）
+  res = inc.result()              # 現在の VoxelDensityResult
+"""
+
+from collections import deque
+from typing import Deque, Optional, Tuple
+import numpy as np
+
+from utility import voxel_index, voxel_center_from_index, pack_voxel_keys, unpack_voxel_keys, group_voxels
+from cal_den import VoxelDensityResult
+
+# 原点固定のキー空間（各軸 ±2^20 ボクセル。0.05mボクセルで±約52km）
+_KEY_BASE = np.full((3,), -(1 << 20), dtype=np.int64)
+_KEY_EXTENT = np.full((3,), (1 << 21) - 1, dtype=np.int64)
+
+# 座標和の1行（float64 x3）を1要素として挿入/削除するための型（2次元のままの np.insert/np.delete より速い）
+_ROW3 = np.dtype((np.void, 3 * 8))
+
+
+def _insert_rows(a: np.ndarray, at: np.ndarray, rows: np.ndarray) -> np.ndarray:
+    """(M,3) float64 の at の位置に rows を挿入する（np.insert(a, at, rows, axis=0) と同じ）"""
+    out = np.insert(a.view(_ROW3).ravel(), at, np.ascontiguousarray(rows).view(_ROW3).ravel())
+    return out.view(np.float64).reshape(-1, 3)
+
+
+def _delete_rows(a: np.ndarray, idx: np.ndarray) -> np.ndarray:
+    """(M,3) float64 から idx の行を抜く（np.delete(a, idx, axis=0) と同じ）"""
+    return np.delete(a.view(_ROW3).ravel(), idx).view(np.float64).reshape(-1, 3)
+
+
+class IncrementalVoxelDensity:
+    """点の追加・削除・スライディングウィンドウに対応したボクセル密度
+    ・生きているボクセルを int64 キーの昇順（= (i,j,k) の辞書式順）に並べた配列で持ち、
+      バッチのボクセルは searchsorted で位置を引く（Pythonの辞書もボクセルごとのループもない）
+    ・新しいボクセルは np.insert、空になったボクセルは np.delete で、並びを保ったまま入れる/抜く
+      （(i,j,k) は持たず、必要なときにキーから戻す）
+    ・result() はボクセルが変わるまで同じ結果を返す（並べ替えも再計算もしない）
+    """
+
+    def __init__(self, voxel_size: Tuple[float, float, float], origin: Optional[np.ndarray] = None,
+                 window: Optional[int] = None):
+        self.voxel_size = np.asarray(voxel_size, dtype=np.float64)
+        if np.any(self.voxel_size <= 0):
+            raise ValueError("voxel_sizeは正である必要がある")
+        # フレームが流れてくる前提なので原点は固定（既定は座標原点）
+        self.origin = np.zeros((3,)) if origin is None else np.asarray(origin, dtype=np.float64).copy()
+        if window is not None and window <= 0:
+            raise ValueError("windowは正の整数である必要がある")
+        self.window = window
+
+        # 生きているボクセル（キーの昇順）
+        self._keys = np.zeros((0,), dtype=np.int64)
+        self._counts = np.zeros((0,), dtype=np.int64)
+        self._sums = np.zeros((0, 3), dtype=np.float64)
+        self._result: Optional[VoxelDensityResult] = None  # result() のキャッシュ（更新で捨てる）
+        self._frames: Deque[Tuple[np.ndarray, np.ndarray, np.ndarray]] = deque()
+        self.num_points = 0
+
+    # --- 集約 ---
+    def _reduce(self, points: np.ndarray):
+        """バッチをボクセル単位に集約する: (keys[u], counts[u], sums[u,3])（キーの昇順）"""
+        ijk = voxel_index(np.asarray(points, dtype=np.float64), self.origin, self.voxel_size)
+        uniq, _, counts, sums = group_voxels(ijk, points)
+        keys, _, _ = pack_voxel_keys(uniq, _KEY_BASE, _KEY_EXTENT)
+        return keys, counts, sums
+
+    def _index_ijk(self, keys: np.ndarray) -> np.ndarray:
+        return unpack_voxel_keys(keys, _KEY_BASE, _KEY_EXTENT)
+
+    def _apply(self, keys, counts, sums, sign: int) -> None:
+        pos = np.searchsorted(self._keys, keys)
+        found = pos < self._keys.shape[0]
+        found[found] = self._keys[pos[found]] == keys[found]
+        if sign < 0 and not np.all(found):
+            raise ValueError("点が登録されていないボクセルから削除しようとした")
+        hit = pos[found]
+        # バッチ内でボクセルはユニークなので、ファンシーインデックスで直接足せる
+        new_counts = self._counts[hit] + sign * counts[found]
+        if np.any(new_counts < 0):
+            raise ValueError("ボクセルの点数が負になる削除である")
+        self._counts[hit] = new_counts
+        self._sums[hit] += sign * sums[found]
+        self.num_points += sign * int(counts.sum())
+        self._result = None
+
+        # 空になったボクセルを抜く（削除のときだけ起きる）
+        empty = hit[new_counts == 0]
+        if empty.shape[0] > 0:
+            self._keys = np.delete(self._keys, empty)
+            self._counts = np.delete(self._counts, empty)
+            self._sums = _delete_rows(self._sums, empty)
+
+        # 新しいボクセルを並びを保って入れる（追加のときだけ起きる）
+        new = ~found
+        if np.any(new):
+            at = pos[new]
+            self._keys = np.insert(self._keys, at, keys[new])
+            self._counts = np.insert(self._counts, at, counts[new])
+            self._sums = _insert_rows(self._sums, at, sums[new])
+
+    # --- 公開API ---
+    def add_points(self, points: np.ndarray) -> None:
+        """点を追加する（ウィンドウ管理の対象外）"""
+        if points.shape[0] > 0:
+            self._apply(*self._reduce(points), sign=+1)
+
+    def remove_points(self, points: np.ndarray) -> None:
+        """以前に追加した点を取り除く"""
+        if points.shape[0] > 0:
+            self._apply(*self._reduce(points), sign=-1)
+
+    def add_frame(self, points: np.ndarray) -> None:
+        """フレームを追加し、window を超えたら最古のフレームを取り除く
+        ・フレームは点ではなくボクセル単位の集約結果で保持するので、期限切れの処理もO(フレーム)
+        """
+        reduced = self._reduce(points)
+        self._apply(*reduced, sign=+1)
+        self._frames.append(reduced)
+        if self.window is not None:
+            while len(self._frames) > self.window:
+                self.expire_oldest()
+
+    def expire_oldest(self) -> None:
+        """最古のフレームを取り除く"""
+        if not self._frames:
+            raise ValueError("取り除くフレームが無い")
+        self._apply(*self._frames.popleft(), sign=-1)
+
+    @property
+    def num_frames(self) -> int:
+        return len(self._frames)
+
+    @property
+    def num_voxels(self) -> int:
+        return self._keys.shape[0]
+
+    def result(self) -> VoxelDensityResult:
+        """現在の集計を VoxelDensityCalculator.compute と同じ形式で返す
+        ・ボクセルが変わるまでは同じオブジェクトを返す（配列は読み取り専用）
+        """
+        if self._result is None:
+            counts = self._counts.copy()
+            ijk = self._index_ijk(self._keys)
+            vol = float(np.prod(self.voxel_size))
+            res = VoxelDensityResult(
+                centers=voxel_center_from_index(ijk, self.origin, self.voxel_size),
+                counts=counts,
+                density=counts.astype(np.float64) / vol,
+                index_ijk=ijk,
+                voxel_size=self.voxel_size.copy(),
+                origin=self.origin.copy(),
+            )
+            for arr in vars(res).values():
+                arr.setflags(write=False)
+            self._result = res
+        return self._result
+
+    def centroids(self) -> Tuple[np.ndarray, np.ndarray]:
+        """現在のボクセル重心: (index_ijk[M,3], centroids[M,3])"""
+        return self._index_ijk(self._keys), self._sums / self._counts[:, None].astype(np.float64)
+
+    def lowest(self, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """密度の低い順にK個のボクセル: (index_ijk[K,3], counts[K])
+        ・全ボクセルのソートはせず、argpartitionでK個を選んでからその中だけ並べる
+        """
+        cnt = self._counts
+        k = min(int(k), cnt.shape[0])
+        if k <= 0:
+            return np.zeros((0, 3), dtype=np.int64), np.zeros((0,), dtype=np.int64)
+        # K番目の点数を求め、それ未満は全部、同点はキー順（= 配列の並び = compute結果の安定ソート順）で補う
+        kth = np.partition(cnt, k - 1)[k - 1]
+        below = np.flatnonzero(cnt < kth)
+        ties = np.flatnonzero(cnt == kth)[:k - below.shape[0]]
+        sel = np.concatenate([below, ties])
+        sel = sel[np.lexsort((sel, cnt[sel]))]
+        return self._index_ijk(self._keys[sel]), cnt[sel].copy()
@@ -3,12 +3,60 @@
 """PDV流儀のKDE密度推定（ボクセル重心→RoIグリッド→Ball Query→KDE）"""
 
 from dataclasses import dataclass
-from typing import Tuple, Optional
+from typing import Iterable, Tuple, Optional
 import math
 import numpy as np
-import open3d as o3d
 
-from utility import aabb_of_points, voxel_index
+try:
+    import open3d as o3d
+except ImportError:  # pragma: no cover
+    o3d = None
+
+from utility import aabb_of_points, resolve_dtype, as_shift, pack_voxel_keys, unpack_voxel_keys, voxel_index, group_voxels
+from cal_den import VoxelAccumulator
+from neighbors import build_tree, iter_chunks, iter_chunks_by_cost, radius_counts, radius_search_csr, knn_distance
+
+# kde_on_grid の実装
+#   loop   : 1グリッド点ずつOpen3Dで探索（基準実装）
+#   batched: 一括探索＋チャンク評価（loopと数値的に一致）
+#   binned : 重心を格子へビニングしてFFT畳み込み（近似。誤差評価は kde_on_grid_binned を参照）
+KDE_ENGINES = ("loop", "batched", "binned")
+
+# 帯域幅
+#   fixed: 全体で1つの sigma（従来）
+#   knn  : k近傍距離から点ごとに決める適応帯域幅（kde_on_grid_adaptive）
+KDE_BANDWIDTHS = ("fixed", "knn")
+#   sample : 重心ごとの帯域幅 σ_j = α·d_k(c_j)（sample-point推定量）
+#   balloon: グリッド点ごとの帯域幅 σ(g) = α·d_k(g)（balloon推定量）
+ADAPTIVE_ESTIMATORS = ("sample", "balloon")
+
+# グリッド
+#   dense : U×U×U の全格子点を評価する（従来）
+#   sparse: 重心から radius 以内の格子点だけを評価し、勾配の大きいセルを八分木状に細分する（kde_on_sparse_grid）
+GRID_MODES = ("dense", "sparse")
+
+# 細分したセルの8つの子の中心（親セルの中心からのオフセット。単位は親セルの幅の1/4）
+_CHILD_OFFSETS = np.array([[i, j, k] for i in (-1, 1) for j in (-1, 1) for k in (-1, 1)], dtype=np.float64)
+
+# 適応帯域幅の評価で、帯域幅をまとめる区分の幅（区分内の最大/最小がこの比以下）
+_BANDWIDTH_RATIO = 1.25
+# 適応帯域幅の評価で、1回の一括探索で扱う近傍ペア数の目安（メモリ上限）
+_PAIR_BUDGET = 1 << 22
+# 近傍数の見積もりで数えるクエリの間隔（グリッド点は空間的に連続しているので間引いても十分）
+_COST_STRIDE = 16
+
+
+def _fast_fft_len(n: int) -> int:
+    """n以上で素因数が2,3,5のみの長さ（FFTが速い長さ）を返す"""
+    m = int(n)
+    while True:
+        k = m
+        for p in (2, 3, 5):
+            while k % p == 0:
+                k //= p
+        if k == 1:
+            return m
+        m += 1
 
 @dataclass
 class KDEGridResult:
@@ -20,31 +68,70 @@ class KDEGridResult:
     grid_U: int
     roi_min: np.ndarray
     roi_max: np.ndarray
+    # 疎グリッドのときだけ: 各点のセルの細分レベル（0が U×U×U の格子。レベルlのセル幅は 1/2^l）
+    grid_level: Optional[np.ndarray] = None
 
 class PDVKDEDensityCalculator:
-    """PDVの流儀を踏襲した密度推定（簡易版）"""
-    def __init__(self, voxel_size: Tuple[float, float, float], grid_U: int, radius: float, sigma: float):
+    """PDVの流儀を踏襲した密度推定（簡易版）
+    ・dtype は入力点とKDE値の精度。重心・グリッド座標・RoIは常にfloat64の絶対座標で、距離とカーネルもfloat64で計算する
+    ・入力点が局所座標（IO.load_local_points）なら shift を与える（重心に shift を足してからKDEを行う）
+    ・bandwidth="knn" で適応帯域幅（knn_k, knn_alpha, estimator, support）。kde_on_grid_adaptive を参照
+    ・grid="sparse" で疎グリッド（refine_levels, refine_quantile）。kde_on_sparse_grid を参照
+    """
+    def __init__(self, voxel_size: Tuple[float, float, float], grid_U: int, radius: float, sigma: float,
+                 engine: str = "batched", chunk_size: int = 32768, dtype=np.float64,
+                 bandwidth: str = "fixed", knn_k: int = 8, knn_alpha: float = 1.0,
+                 estimator: str = "sample", support: float = 4.0,
+                 grid: str = "dense", refine_levels: int = 0, refine_quantile: float = 0.9):
         self.voxel_size = np.asarray(voxel_size, dtype=np.float64)
+        self.dtype = resolve_dtype(dtype)
         self.grid_U = int(grid_U)
         self.radius = float(radius)
         self.sigma = float(sigma)
+        self.engine = engine
+        self.chunk_size = int(chunk_size)
+        self.bandwidth = bandwidth
+        self.knn_k = int(knn_k)
+        self.knn_alpha = float(knn_alpha)
+        self.estimator = estimator
+        self.support = float(support)
+        self.grid = grid
+        self.refine_levels = int(refine_levels)
+        self.refine_quantile = float(refine_quantile)
         if self.grid_U <= 0:
             raise ValueError("grid_Uは正の整数である必要がある")
         if self.radius <= 0 or self.sigma <= 0:
             raise ValueError("radiusとsigmaは正である必要がある")
+        if self.engine not in KDE_ENGINES:
+            raise ValueError(f"engineは {KDE_ENGINES} のいずれかである必要がある")
+        if self.chunk_size <= 0:
+            raise ValueError("chunk_sizeは正の整数である必要がある")
+        if self.bandwidth not in KDE_BANDWIDTHS:
+            raise ValueError(f"bandwidthは {KDE_BANDWIDTHS} のいずれかである必要がある")
+        if self.estimator not in ADAPTIVE_ESTIMATORS:
+            raise ValueError(f"estimatorは {ADAPTIVE_ESTIMATORS} のいずれかである必要がある")
+        if self.knn_k <= 0 or self.knn_alpha <= 0 or self.support <= 0:
+            raise ValueError("knn_k・knn_alpha・supportは正である必要がある")
+        if self.grid not in GRID_MODES:
+            raise ValueError(f"gridは {GRID_MODES} のいずれかである必要がある")
+        if self.grid == "sparse" and (self.engine == "binned" or self.bandwidth != "fixed"):
+            raise ValueError("疎グリッドは固定帯域幅の loop/batched エンジンでのみ使える")
+        if self.refine_levels < 0 or (self.refine_levels > 0 and self.grid != "sparse"):
+            raise ValueError("refine_levelsは0以上で、細分は疎グリッドでのみ使える")
+        if not 0.0 < self.refine_quantile < 1.0:
+            raise ValueError("refine_quantileは0より大きく1より小さい必要がある")
 
     # --- ボクセル重心 ---
-    def compute_voxel_centroids(self, points: np.ndarray):
+    def compute_voxel_centroids(self, points: np.ndarray, shift: Optional[np.ndarray] = None):
+        """(重心[M,3], ボクセル番号[M,3], 原点[3])。重心と原点は shift を足した絶対座標（float64）"""
+        shift = as_shift(shift)
         pmin, _ = aabb_of_points(points)
         origin = pmin.astype(np.float64)
+        # 重心だけが要るので、点の索引（CSR）まで作る VoxelGrid ではなく group_voxels で集約する（全点のargsortが不要）
         ijk = voxel_index(points, origin, self.voxel_size)
-        uniq, inv = np.unique(ijk, axis=0, return_inverse=True)
-        sums = np.zeros((uniq.shape[0], 3), dtype=np.float64)
-        np.add.at(sums, inv, points)
-        cnt = np.bincount(inv, minlength=uniq.shape[0]).astype(np.float64)
-        cnt[cnt == 0] = 1.0
-        centroids = (sums / cnt[:, None]).astype(np.float64)
-        return centroids, uniq.astype(np.int64), origin
+        uniq, _, cnt, sums = group_voxels(ijk, points)
+        centroids = sums / cnt.astype(np.float64)[:, None]
+        return centroids + shift, uniq.astype(np.int64), origin + shift
 
     # --- グリッド生成 ---
     def generate_grid(self, roi_min: np.ndarray, roi_max: np.ndarray) -> np.ndarray:
@@ -52,12 +139,52 @@ class PDVKDEDensityCalculator:
         mins = roi_min.astype(np.float64); maxs = roi_max.astype(np.float64)
         step = (maxs - mins) / U
         xs = np.arange(U, dtype=np.float64) + 0.5
-        grid = np.stack(np.meshgrid(xs, xs, xs, indexing="ij"), axis=-1)
-        grid = mins[None,None,None,:] + grid * step[None,None,None,:]
+        # 軸ごとの座標からU^3点の配列へ直接書き込む（中間配列を作らない）。
+        # 距離の計算に使うので dtype によらずfloat64（float32 では座標が 1e5 のとき刻みが約8e-3になる）
+        grid = np.empty((U, U, U, 3), dtype=np.float64)
+        grid[..., 0] = (mins[0] + xs * step[0])[:, None, None]
+        grid[..., 1] = (mins[1] + xs * step[1])[None, :, None]
+        grid[..., 2] = (mins[2] + xs * step[2])[None, None, :]
         return grid.reshape(-1, 3)
 
+    def sparse_lattice(self, centroids: np.ndarray, roi_min: np.ndarray, roi_max: np.ndarray,
+                       tree=None) -> Tuple[np.ndarray, np.ndarray]:
+        """generate_grid と同じ格子のうち、いずれかの重心から距離 radius 未満の格子点だけを返す
+        ・それ以外の格子点は近傍が0個なので、密グリッドでも kde=0, 近傍数=0 になる点である
+        ・重心のあるセルを軸ごとに ±ceil(r/step) セルずつ膨張させて候補を作り（箱の膨張は軸ごとに分けられる）、
+          候補の中心から最近傍の重心までの距離で絞る。候補の数は表面付近の帯の体積程度で、U^3 には比例しない
+        戻り値: (格子番号 ijk[G,3]（辞書式昇順 = generate_grid と同じ並び）, 格子点の座標[G,3]（float64）)
+        """
+        U = self.grid_U
+        mins = np.asarray(roi_min, dtype=np.float64)
+        step = (np.asarray(roi_max, dtype=np.float64) - mins) / U
+        h = np.ceil(self.radius / step).astype(np.int64)
+        # RoIから遠い重心は格子の外側1枚に寄せる（寄せた分の余計な候補は距離で落ちる）
+        base, extent = -(h + 1), U + 2 * (h + 1)
+        cell = np.floor((np.asarray(centroids, dtype=np.float64) - mins) / step)
+        cell = np.clip(cell, base, base + extent - 1).astype(np.int64)
+        keys = np.unique(pack_voxel_keys(cell, base, extent)[0])
+        for a in range(3):
+            ijk = unpack_voxel_keys(keys, base, extent)
+            shifted = []
+            for o in range(-int(h[a]), int(h[a]) + 1):
+                s = ijk.copy()
+                s[:, a] += o
+                shifted.append(s[(s[:, a] >= 0) & (s[:, a] < U)])
+            keys = np.unique(pack_voxel_keys(np.concatenate(shifted, axis=0), base, extent)[0])
+        ijk = unpack_voxel_keys(keys, base, extent)
+        ijk = ijk[np.all((ijk >= 0) & (ijk < U), axis=1)]
+        pts = mins + (ijk + 0.5) * step
+        if tree is None:
+            tree = build_tree(centroids)
+        d, _ = tree.query(pts, k=1, distance_upper_bound=self.radius, workers=-1)
+        keep = d < self.radius
+        return ijk[keep], pts[keep]
+
     # --- KDE ---
     def kde_on_grid(self, centroids: np.ndarray, grid_points: np.ndarray):
+        if o3d is None:
+            raise ImportError("loopエンジンにはOpen3Dが必要である。`pip install open3d` を実行するか、batchedエンジンを使うこと。")
         pc = o3d.geometry.PointCloud()
         pc.points = o3d.utility.Vector3dVector(centroids)
         kdt = o3d.geometry.KDTreeFlann(pc)
@@ -78,15 +205,272 @@ class PDVKDEDensityCalculator:
             kde[i] = float(np.sum(kern) / (count * s3))
         return kde, nb
 
+    # --- KDE（バッチ版）---
+    def kde_on_grid_batched(self, centroids: np.ndarray, grid_points: np.ndarray):
+        """kde_on_grid と同じ値を、グリッド点の一括半径探索で求める
+        ・グリッド点を chunk_size ごとに区切り、各チャンクの近傍をCSRで受け取る
+        ・カーネル評価はCSRの平坦配列にまとめて行う（メモリはチャンク内の近傍数に比例）
+        """
+        centroids = np.asarray(centroids, dtype=np.float64)
+        tree = build_tree(centroids)
+
+        r, s = self.radius, self.sigma
+        s3 = s ** 3
+        norm = 1.0 / ((2.0 * math.pi) ** 1.5)
+
+        kde = np.zeros((grid_points.shape[0],), dtype=np.float64)
+        nb  = np.zeros_like(kde, dtype=np.int64)
+        for start, stop in iter_chunks(grid_points.shape[0], self.chunk_size):
+            indptr, _, d2 = radius_search_csr(tree, centroids, grid_points[start:stop], r)
+            count = np.diff(indptr)
+            nb[start:stop] = count
+            if d2.size == 0:
+                continue
+            rows = np.repeat(np.arange(stop - start), count)
+            kern = np.exp(-0.5 * d2 / (s * s)) * norm
+            sums = np.bincount(rows, weights=kern, minlength=stop - start)
+            hit = count > 0
+            kde[start:stop][hit] = sums[hit] / (count[hit] * s3)
+        return kde, nb
+
+    # --- KDE（適応帯域幅）---
+    def knn_bandwidths(self, tree, centroids: np.ndarray, queries: np.ndarray, exclude_self: bool) -> np.ndarray:
+        """帯域幅 σ = α·(k番目の近傍重心までの距離) を1回の一括k-NN探索で求める
+        ・exclude_self: クエリが重心そのもの（sample-point）なら自分自身を数えない
+        ・重心がk個に満たなければ使える最遠の近傍を使い、下限はボクセルサイズの半分とする
+        """
+        k = min(self.knn_k + int(exclude_self), centroids.shape[0])
+        sig = self.knn_alpha * knn_distance(tree, queries, k)
+        return np.maximum(sig, 0.5 * float(np.min(self.voxel_size)))
+
+    def kde_on_grid_adaptive(self, centroids: np.ndarray, grid_points: np.ndarray):
+        """k近傍距離による適応帯域幅のKDE
+        ・sample : f(g) = Σ_j N(g; c_j, σ_j^2 I),  σ_j = α·d_k(c_j)
+        ・balloon: f(g) = Σ_j N(g; c_j, σ(g)^2 I), σ(g) = α·d_k(g)
+        ・値は重心の個数密度[個/m^3]（fixed の「近傍内のカーネル平均」とは定義もスケールも違う）
+        ・カーネルは距離 support·σ で打ち切り、その内側の重心数を近傍数とする
+          （support=4 で打ち切られる質量は約0.1%）
+        ・帯域幅を比 _BANDWIDTH_RATIO ごとの区分にまとめ、区分ごとにその最大の打ち切り半径で一括探索し、
+          各ペアの σ で打ち切り直してからCSRの平坦配列上でまとめて評価する
+        ・一括探索は、先に近傍数を間引いて見積もり、ペア数が _PAIR_BUDGET 程度になるようにクエリを区切る
+          （疎な部分では σ が大きく近傍が多いので、chunk_size の固定分割ではメモリが読めない）
+        戻り値: (kde[G], 近傍数[G], 帯域幅の中央値)
+        """
+        centroids = np.asarray(centroids, dtype=np.float64)
+        tree = build_tree(centroids)
+        norm = 1.0 / ((2.0 * math.pi) ** 1.5)
+        c = self.support
+        g_n = grid_points.shape[0]
+        kde = np.zeros((g_n,), dtype=np.float64)
+        nb = np.zeros((g_n,), dtype=np.int64)
+
+        if self.estimator == "sample":
+            sig = self.knn_bandwidths(tree, centroids, centroids, exclude_self=True)
+        else:
+            sig = self.knn_bandwidths(tree, centroids, grid_points, exclude_self=False)
+        bins = np.floor(np.log(sig / sig.min()) / math.log(_BANDWIDTH_RATIO)).astype(np.int64)
+
+        for b in np.unique(bins):
+            members = np.flatnonzero(bins == b)
+            sig_b = sig[members]
+            r_b = c * float(sig_b.max())
+            if self.estimator == "sample":
+                # 帯域幅はデータ（重心）側：区分内の重心だけで木を作り、全グリッド点から探す
+                data, sub = centroids[members], build_tree(centroids[members])
+                queries = grid_points
+            else:
+                # 帯域幅はクエリ（グリッド点）側：区分内のグリッド点から全重心を探す
+                data, sub = centroids, tree
+                queries = grid_points[members]
+            costs = radius_counts(sub, queries, r_b, stride=_COST_STRIDE)
+            for start, stop in iter_chunks_by_cost(costs, _PAIR_BUDGET, self.chunk_size):
+                indptr, idx, d2 = radius_search_csr(sub, data, queries[start:stop], r_b)
+                if d2.size == 0:
+                    continue
+                rows = np.repeat(np.arange(stop - start), np.diff(indptr))
+                s = sig_b[idx] if self.estimator == "sample" else sig_b[start:stop][rows]
+                keep = d2 < (c * s) ** 2
+                rows, d2, s = rows[keep], d2[keep], s[keep]
+                kern = np.exp(-0.5 * d2 / (s * s)) * norm / (s * s * s)
+                sums = np.bincount(rows, weights=kern, minlength=stop - start)
+                cnts = np.bincount(rows, minlength=stop - start)
+                if self.estimator == "sample":
+                    kde[start:stop] += sums
+                    nb[start:stop] += cnts
+                else:
+                    kde[members[start:stop]] = sums
+                    nb[members[start:stop]] = cnts
+        return kde, nb, float(np.median(sig))
+
+    # --- KDE（疎グリッド＋八分木状の細分）---
+    def kde_on_sparse_grid(self, centroids: np.ndarray, roi_min: np.ndarray, roi_max: np.ndarray):
+        """重心の近くの格子点だけでKDEを評価し、値の変化が大きいセルを細分する
+        ・レベル0: sparse_lattice の格子点を kde_on_grid(_batched) で評価する（密グリッドの非ゼロ部分と同じ値）
+        ・細分の基準は勾配の大きさ。レベル0は隣の格子点との中心差分（無い隣は値0として扱う。近傍が無い点は
+          密グリッドでも0なので、これは密グリッドでの差分と同じ）、レベル1以降は親の中心との差 / 親子の中心間距離
+        ・各レベルで勾配が上位 (1 - refine_quantile) に入るセルを8つの子に分け、子の中心でKDEを評価する。
+          細分したセルは出力から除き、近傍が0個の子も出さない（出力は八分木の葉のうち値があるもの）
+        ・メモリと計算量は表面積（重心の周りの帯）に比例し、RoIの体積（U^3）には比例しない
+        戻り値: (格子点[G,3]（float64）, kde[G], 近傍数[G], 細分レベル[G])
+        """
+        centroids = np.asarray(centroids, dtype=np.float64)
+        tree = build_tree(centroids)
+        evaluate = self.kde_on_grid if self.engine == "loop" else self.kde_on_grid_batched
+        U = self.grid_U
+        step = (np.asarray(roi_max, dtype=np.float64) - np.asarray(roi_min, dtype=np.float64)) / U
+
+        ijk, pts = self.sparse_lattice(centroids, roi_min, roi_max, tree)
+        kde, nb = evaluate(centroids, pts)
+        levels = [[pts, kde, nb, np.ones((pts.shape[0],), dtype=bool)]]
+        grad = self._lattice_gradient(ijk, kde, step) if self.refine_levels > 0 else None
+
+        cur_pts, cur_kde, cur_step = pts, kde, step
+        for _ in range(self.refine_levels):
+            pos = grad > 0
+            if not np.any(pos):
+                break
+            sel = pos & (grad >= np.quantile(grad[pos], self.refine_quantile))
+            levels[-1][3][sel] = False
+            child = (cur_pts[sel][:, None, :] + _CHILD_OFFSETS[None, :, :] * (cur_step / 4.0)).reshape(-1, 3)
+            c_kde, c_nb = evaluate(centroids, child)
+            grad = np.abs(c_kde - np.repeat(cur_kde[sel], 8)) / (float(np.linalg.norm(cur_step)) / 4.0)
+            grad[c_nb == 0] = 0.0  # 値の無い子は細分しない
+            levels.append([child, c_kde, c_nb, c_nb > 0])
+            cur_pts, cur_kde, cur_step = child, c_kde, cur_step / 2.0
+
+        out_pts = np.concatenate([p[k] for p, _, _, k in levels], axis=0)
+        out_kde = np.concatenate([v[k] for _, v, _, k in levels])
+        out_nb = np.concatenate([n[k] for _, _, n, k in levels])
+        out_level = np.concatenate([np.full((int(np.count_nonzero(k)),), lv, dtype=np.int8)
+                                    for lv, (_, _, _, k) in enumerate(levels)])
+        return out_pts, out_kde, out_nb, out_level
+
+    def _lattice_gradient(self, ijk: np.ndarray, values: np.ndarray, step: np.ndarray) -> np.ndarray:
+        """疎な格子点上の値の勾配の大きさ（中心差分。格子に無い隣は値0）
+        ・ijk は辞書式昇順。隣の格子点はキーの二分探索で引く
+        """
+        U = self.grid_U
+        keys, _, _ = pack_voxel_keys(ijk, np.zeros(3, dtype=np.int64), np.full(3, U, dtype=np.int64))
+        strides = (U * U, U, 1)
+        g2 = np.zeros((ijk.shape[0],), dtype=np.float64)
+        if ijk.shape[0] == 0:
+            return g2
+        for a in range(3):
+            side = []
+            for o in (-1, 1):
+                nkey = keys + o * strides[a]
+                pos = np.minimum(np.searchsorted(keys, nkey), keys.shape[0] - 1)
+                found = (ijk[:, a] + o >= 0) & (ijk[:, a] + o < U) & (keys[pos] == nkey)
+                side.append(np.where(found, values[pos], 0.0))
+            g2 += ((side[1] - side[0]) / (2.0 * step[a])) ** 2
+        return np.sqrt(g2)
+
+    # --- KDE（ビニング＋FFT畳み込み版）---
+    def kde_on_grid_binned(self, centroids: np.ndarray, roi_min: np.ndarray, roi_max: np.ndarray):
+        """generate_grid と同じU×U×U格子上のKDEを、ビニングとFFT畳み込みで近似する
+        ・各重心を最寄りの格子点へ寄せてヒストグラム化し、打ち切りガウスカーネル
+          （d^2 < r^2 の球内のみ）と球の指示関数をそれぞれ畳み込む
+        ・前者がカーネル和、後者が近傍数になり、kde = 和 / (近傍数 * σ^3) は kde_on_grid と同じ定義
+        ・計算量は O(G log G)（G: パディング込みの格子点数）で、重心数や近傍数に依存しない
+
+        誤差（kde_on_grid との差）:
+        ・ビニングで各重心は最大 δ = |step|/2（格子セルの半対角）だけ動く
+        ・ガウスカーネルのリプシッツ定数は norm/(σ√e) なので、近傍集合が変わらない格子点では
+            |Δkde| <= δ / (σ√e) * norm / σ^3,   norm = (2π)^(-3/2)
+        ・近傍集合が変わりうるのは、半径rの球面から距離δ以内に重心がある格子点だけで、
+          その場合は近傍数も±その重心数だけずれる。U を上げる（δを小さくする）と両方とも減る
+        """
+        U = self.grid_U
+        mins = np.asarray(roi_min, dtype=np.float64)
+        maxs = np.asarray(roi_max, dtype=np.float64)
+        step = (maxs - mins) / U
+        r, s = self.radius, self.sigma
+        s3 = s ** 3
+        norm = 1.0 / ((2.0 * math.pi) ** 1.5)
+
+        # カーネルの片側半幅（格子点数）と、RoI外の重心を受けるためのパディング
+        h = np.ceil(r / step).astype(np.int64)
+        pad = h + 1
+        L = U + 2 * pad
+
+        # 重心 → 最寄り格子点（パディング込みの座標系）へビニング
+        cell = np.floor((np.asarray(centroids, dtype=np.float64) - mins) / step).astype(np.int64) + pad
+        inside = np.all((cell >= 0) & (cell < L), axis=1)
+        cell = cell[inside]
+        flat = np.ravel_multi_index((cell[:, 0], cell[:, 1], cell[:, 2]), tuple(L))
+        hist = np.bincount(flat, minlength=int(np.prod(L))).astype(np.float64).reshape(tuple(L))
+
+        # 球で打ち切ったカーネルのステンシル（(2h+1)^3）
+        axes = [np.arange(-h[a], h[a] + 1, dtype=np.float64) * step[a] for a in range(3)]
+        dx, dy, dz = np.meshgrid(*axes, indexing="ij")
+        d2 = dx * dx + dy * dy + dz * dz
+        ball = d2 < r * r
+        k_gauss = np.where(ball, np.exp(-0.5 * d2 / (s * s)) * norm, 0.0)
+        k_count = ball.astype(np.float64)
+
+        # 線形畳み込み（巡回しないようゼロ詰め）をFFTで
+        full = L + 2 * h
+        shape = tuple(_fast_fft_len(n) for n in full)
+        f_hist = np.fft.rfftn(hist, s=shape)
+        conv_g = np.fft.irfftn(f_hist * np.fft.rfftn(k_gauss, s=shape), s=shape)
+        conv_c = np.fft.irfftn(f_hist * np.fft.rfftn(k_count, s=shape), s=shape)
+
+        # 格子点 n（0..U-1）は full 座標で n + pad + h
+        sl = tuple(slice(int(pad[a] + h[a]), int(pad[a] + h[a]) + U) for a in range(3))
+        nb = np.rint(conv_c[sl]).astype(np.int64).reshape(-1)
+        ksum = conv_g[sl].reshape(-1)
+
+        kde = np.zeros((U ** 3,), dtype=np.float64)
+        hit = nb > 0
+        kde[hit] = np.maximum(ksum[hit], 0.0) / (nb[hit] * s3)
+        return kde, nb
+
     # --- 実行 ---
-    def compute(self, points: np.ndarray, roi: Optional[Tuple[np.ndarray, np.ndarray]] = None) -> KDEGridResult:
-        centroids, _, _ = self.compute_voxel_centroids(points)
+    def compute(self, points: np.ndarray, roi: Optional[Tuple[np.ndarray, np.ndarray]] = None,
+                shift: Optional[np.ndarray] = None) -> KDEGridResult:
+        centroids, _, _ = self.compute_voxel_centroids(points, shift)
         if roi is None:
-            roi_min, roi_max = aabb_of_points(points)
-        else:
-            roi_min, roi_max = roi
+            pmin, pmax = aabb_of_points(points)
+            roi = (pmin + as_shift(shift), pmax + as_shift(shift))
+        return self.compute_from_centroids(centroids, roi)
+
+    def compute_stream(self, chunks: Iterable[np.ndarray], origin: np.ndarray,
+                       roi: Tuple[np.ndarray, np.ndarray], shift: Optional[np.ndarray] = None) -> KDEGridResult:
+        """点群をチャンク列として受け取り、ボクセル重心を逐次集計してからKDEを行う
+        ・origin は全点のAABB最小（compute_voxel_centroids と同じ原点。絶対座標）を与える
+        """
+        return self.compute_from_centroids(self.accumulate_centroids(chunks, origin, shift), roi)
+
+    def accumulate_centroids(self, chunks: Iterable[np.ndarray], origin: np.ndarray,
+                             shift: Optional[np.ndarray] = None) -> np.ndarray:
+        """チャンク列からボクセル重心だけを集計する（compute_voxel_centroids のストリーミング版）"""
+        acc = VoxelAccumulator(origin, self.voxel_size, shift)
+        for pts in chunks:
+            acc.add_points(pts)
+        if acc.num_points == 0:
+            raise ValueError("点群が空である")
+        return acc.centroids()
+
+    def compute_from_centroids(self, centroids: np.ndarray, roi: Tuple[np.ndarray, np.ndarray]) -> KDEGridResult:
+        """ボクセル重心が既にある場合（ストリーミング集計など）のKDE"""
+        roi_min, roi_max = roi
         roi_min = roi_min - self.radius * 0.5
         roi_max = roi_max + self.radius * 0.5
+        if self.grid == "sparse":
+            grid, kde_vals, nb_counts, level = self.kde_on_sparse_grid(centroids, roi_min, roi_max)
+            return KDEGridResult(grid, kde_vals.astype(self.dtype, copy=False),
+                                 nb_counts, self.radius, self.sigma, self.grid_U, roi_min, roi_max, grid_level=level)
         grid = self.generate_grid(roi_min, roi_max)
-        kde_vals, nb_counts = self.kde_on_grid(centroids, grid)
-        return KDEGridResult(grid, kde_vals, nb_counts, self.radius, self.sigma, self.grid_U, roi_min, roi_max)
+        if self.bandwidth == "knn":
+            # 適応帯域幅は engine によらず一括探索で評価する。sigma には帯域幅の中央値を入れる
+            kde_vals, nb_counts, sigma = self.kde_on_grid_adaptive(centroids, grid)
+            return KDEGridResult(grid, kde_vals.astype(self.dtype, copy=False), nb_counts, self.radius, sigma,
+                                 self.grid_U, roi_min, roi_max)
+        if self.engine == "batched":
+            kde_vals, nb_counts = self.kde_on_grid_batched(centroids, grid)
+        elif self.engine == "binned":
+            kde_vals, nb_counts = self.kde_on_grid_binned(centroids, roi_min, roi_max)
+        else:
+            kde_vals, nb_counts = self.kde_on_grid(centroids, grid)
+        return KDEGridResult(grid, kde_vals.astype(self.dtype, copy=False), nb_counts, self.radius, self.sigma,
+                             self.grid_U, roi_min, roi_max)
@@ -0,0 +1,118 @@
+# density/neighbors.py
+# -*- coding: utf-8 -*-
+"""バッチ近傍探索ユーティリティ
+Open3DのKDTreeFlannは1クエリずつしか問い合わせられないため、
+SciPyのcKDTreeで全クエリを一括処理し、結果を疎なCSR形式で返す。
+"""
+
+from typing import Iterator, Tuple
+import numpy as np
+
+try:
+    from scipy.spatial import cKDTree
+except ImportError:  # pragma: no cover
+    cKDTree = None
+
+
+def require_scipy() -> None:
+    """SciPyが無ければ分かりやすいメッセージで止める"""
+    if cKDTree is None:
+        raise ImportError("バッチ近傍探索にはSciPyが必要である。`pip install scipy` を実行すること。")
+
+
+def build_tree(points: np.ndarray) -> "cKDTree":
+    """(N,3)点群からKD木を作る"""
+    require_scipy()
+    return cKDTree(np.asarray(points, dtype=np.float64))
+
+
+def iter_chunks(n: int, chunk_size: int) -> Iterator[Tuple[int, int]]:
+    """[0, n) を chunk_size ごとの (start, stop) に分割する"""
+    chunk_size = max(1, int(chunk_size))
+    for start in range(0, n, chunk_size):
+        yield start, min(n, start + chunk_size)
+
+
+def iter_chunks_by_cost(costs: np.ndarray, budget: int, max_items: int) -> Iterator[Tuple[int, int]]:
+    """コスト（近傍数など）の合計が budget 程度、要素数が max_items 以下になるように [0, n) を区切る
+    ・1区間は最低1要素
+    """
+    csum = np.cumsum(np.asarray(costs, dtype=np.int64))
+    n = csum.shape[0]
+    start, done = 0, 0
+    while start < n:
+        stop = int(np.searchsorted(csum, done + int(budget), side="right"))
+        stop = min(n, start + int(max_items), max(stop, start + 1))
+        yield start, stop
+        done = int(csum[stop - 1])
+        start = stop
+
+
+def radius_counts(tree: "cKDTree", queries: np.ndarray, radius: float, stride: int = 1) -> np.ndarray:
+    """各クエリの半径内の点数だけを数える（近傍リストは作らないので、チャンク分けの見積もりに使える）
+    ・stride > 1 なら stride 個おきのクエリだけ数え、間のクエリには同じ値を使う（見積もり用）
+    """
+    queries = np.asarray(queries, dtype=np.float64)
+    cnt = np.asarray(tree.query_ball_point(queries[::stride], radius, return_length=True, workers=-1),
+                     dtype=np.int64)
+    return np.repeat(cnt, stride)[:queries.shape[0]]
+
+
+def radius_search_csr(tree: "cKDTree", data: np.ndarray, queries: np.ndarray,
+                      radius: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """全クエリの半径探索を1回で行い、CSR形式の近傍リストを返す
+    ・tree は data から作ったKD木
+    ・戻り値: (indptr[Q+1], indices[nnz], d2[nnz])
+      クエリqの近傍は indices[indptr[q]:indptr[q+1]]、d2 は二乗距離
+    ・Open3D(KDTreeFlann)と揃えるため、境界は d2 < radius^2（厳密に内側）とする
+    """
+    queries = np.asarray(queries, dtype=np.float64)
+    q = queries.shape[0]
+    qtree = cKDTree(queries)
+    pairs = qtree.sparse_distance_matrix(tree, radius, output_type="ndarray")
+    rows = pairs["i"].astype(np.int64)
+    cols = pairs["j"].astype(np.int64)
+
+    # 二乗距離は座標から計算し直す（距離の二乗より丸め誤差が小さい）
+    diff = queries[rows] - data[cols]
+    d2 = np.einsum("ij,ij->i", diff, diff)
+    keep = d2 < radius * radius
+    rows, cols, d2 = rows[keep], cols[keep], d2[keep]
+
+    # 行（クエリ）順に並べてCSR化（クエリ数が16bitに収まれば、uint16の安定ソート＝基数ソートで並べる）
+    order = np.argsort(rows.astype(np.uint16) if q <= 1 << 16 else rows, kind="stable")
+    indices = cols[order]
+    d2 = d2[order]
+    indptr = np.zeros((q + 1,), dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=q), out=indptr[1:])
+    return indptr, indices, d2
+
+
+def knn_distance(tree: "cKDTree", queries: np.ndarray, k: int, chunk_size: int = 1 << 18) -> np.ndarray:
+    """各クエリからk番目に近い点までの距離（k=1が最近傍。クエリ自身が木にあれば距離0で数える）
+    ・k番目の距離だけを受け取るので、(Q,k)の距離・番号配列は作らない
+    ・チャンクごとにSciPyのスレッド並列（workers=-1）で一括探索する
+    """
+    queries = np.asarray(queries, dtype=np.float64)
+    out = np.empty((queries.shape[0],), dtype=np.float64)
+    for start, stop in iter_chunks(queries.shape[0], chunk_size):
+        d, _ = tree.query(queries[start:stop], k=[int(k)], workers=-1)
+        out[start:stop] = d[:, 0]
+    return out
+
+
+def knn_query(tree: "cKDTree", queries: np.ndarray, k: int,
+              chunk_size: int = 1 << 18) -> Tuple[np.ndarray, np.ndarray]:
+    """全クエリのk近傍を一括で求める: (距離[Q,k], 番号[Q,k])
+    ・チャンクごとにSciPyのスレッド並列（workers=-1）で探索する（1クエリずつの問い合わせはしない）
+    ・木の点数がkより少ないときは、足りない分の距離が inf、番号が木の点数になる（SciPyの仕様）
+    """
+    queries = np.asarray(queries, dtype=np.float64)
+    k = int(k)
+    dist = np.empty((queries.shape[0], k), dtype=np.float64)
+    idx = np.empty((queries.shape[0], k), dtype=np.int64)
+    for start, stop in iter_chunks(queries.shape[0], chunk_size):
+        d, i = tree.query(queries[start:stop], k=list(range(1, k + 1)), workers=-1)
+        dist[start:stop], idx[start:stop] = d, i
+    return dist, idx
+
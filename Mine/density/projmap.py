@@ -0,0 +1,170 @@
+# density/projmap.py
+# -*- coding: utf-8 -*-
+"""XY/XZ/YZ の2D密度マップをまとめて作る（投影ごとのヒストグラムを1回の読み込みで計算し、結果の隣にキャッシュする）
+・点をAABBで3軸とも整数のビン番号にしてから、投影ごとに np.bincount で重み付きに数える
+  （np.histogram2d を投影ごとに呼ぶより速く、3投影のビン境界もそろう。最後のビンは右端を含む）
+・最も細かいグリッドは bins * 2^(levels-1)。2x2 ずつ足して粗い段を作り、levels 段のピラミッドにする
+  （段0が最も細かい。段 levels-1 が bins x bins の全体表示）。拡大表示では見えている範囲に合う段を切り出す
+・キャッシュは <結果名>_maps<bins>x<levels>.npz を結果（NPZ/結果ディレクトリ/PLY）と同じ場所に置く。
+  元のファイルのサイズと更新時刻が変わっていれば作り直す
+・各マップは [軸0のビン, 軸1のビン] の向き（np.histogram2d と同じ）。imshow には転置して渡す
+
+使い方例:
+  maps = load_or_build_maps(Path("out/voxel_result"), lambda: load_density_points("out/voxel_result"), bins=256, levels=4)
+  H = maps.maps["xz"][-1]                            # 全体表示（256x256）
+  sub, extent = maps.view("xz", (0.1, 0.2), (0.0, 0.1), max_pixels=512)
+"""
+
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+import os
+import numpy as np
+
+PROJECTIONS = {"xy": (0, 1), "xz": (0, 2), "yz": (1, 2)}
+
+# 1回にビン番号へ変換する点数（巨大な点群でも一時配列を抑える）
+_BIN_CHUNK = 1 << 22
+
+
+@dataclass
+class ProjectionMaps:
+    lo: np.ndarray                     # (3,) AABBの最小
+    hi: np.ndarray                     # (3,) AABBの最大
+    bins: int                          # 段0（最も細かい段）の1辺のビン数
+    maps: Dict[str, List[np.ndarray]]  # 投影名 -> [段0 (bins,bins), 段1 (bins/2,bins/2), ...]
+
+    @property
+    def levels(self) -> int:
+        return len(next(iter(self.maps.values())))
+
+    def extent(self, proj: str) -> List[float]:
+        """imshow の extent（[軸0の最小, 最大, 軸1の最小, 最大]）"""
+        a, b = PROJECTIONS[proj]
+        return [float(self.lo[a]), float(self.hi[a]), float(self.lo[b]), float(self.hi[b])]
+
+    def _span(self, proj: str) -> Tuple[np.ndarray, np.ndarray]:
+        ax = list(PROJECTIONS[proj])
+        lo = self.lo[ax].astype(np.float64)
+        return lo, np.where(self.hi[ax] > lo, self.hi[ax] - lo, 1.0)
+
+    def choose_level(self, proj: str, xlim: Sequence[float], ylim: Sequence[float], max_pixels: int) -> int:
+        """見えている範囲のビン数が両軸とも max_pixels 以下になる、最も細かい段"""
+        lo, span = self._span(proj)
+        frac = np.clip(np.abs(np.array([xlim[1] - xlim[0], ylim[1] - ylim[0]], dtype=np.float64)) / span, 0.0, 1.0)
+        for level in range(self.levels):
+            if np.all(frac * (self.bins >> level) <= max_pixels):
+                return level
+        return self.levels - 1
+
+    def view(self, proj: str, xlim: Sequence[float], ylim: Sequence[float],
+             max_pixels: int = 512) -> Tuple[np.ndarray, List[float]]:
+        """見えている範囲を、合う段から切り出す: (マップの一部, その extent)"""
+        level = self.choose_level(proj, xlim, ylim, max_pixels)
+        H = self.maps[proj][level]
+        n = H.shape[0]
+        lo, span = self._span(proj)
+        cell = span / n
+        i0, i1 = np.clip(np.floor((np.sort(xlim) - lo[0]) / cell[0]).astype(np.int64) + [0, 1], 0, n)
+        j0, j1 = np.clip(np.floor((np.sort(ylim) - lo[1]) / cell[1]).astype(np.int64) + [0, 1], 0, n)
+        extent = [float(lo[0] + i0 * cell[0]), float(lo[0] + i1 * cell[0]),
+                  float(lo[1] + j0 * cell[1]), float(lo[1] + j1 * cell[1])]
+        return H[i0:i1, j0:j1], extent
+
+    def tile(self, proj: str, level: int, i: int, j: int, tile_size: int = 256) -> np.ndarray:
+        """段 level の (i,j) 番目のタイル（端のタイルは小さくなる）"""
+        H = self.maps[proj][level]
+        return H[i * tile_size:(i + 1) * tile_size, j * tile_size:(j + 1) * tile_size]
+
+
+def build_maps(points: np.ndarray, weights: Optional[np.ndarray] = None, bins: int = 256, levels: int = 1,
+               projs: Sequence[str] = tuple(PROJECTIONS)) -> ProjectionMaps:
+    """点群（と重み）から投影ごとのマップのピラミッドを作る"""
+    if bins <= 0 or levels <= 0:
+        raise ValueError("binsとlevelsは正の整数である必要がある")
+    points = np.asarray(points)
+    if points.shape[0] == 0:
+        raise ValueError("点群が空である")
+    base = int(bins) << (int(levels) - 1)
+    lo = points.min(axis=0).astype(np.float64)
+    hi = points.max(axis=0).astype(np.float64)
+    scale = base / np.where(hi > lo, hi - lo, 1.0)
+
+    flat = {p: np.zeros((base * base,), dtype=np.float64) for p in projs}
+    for start in range(0, points.shape[0], _BIN_CHUNK):
+        stop = min(start + _BIN_CHUNK, points.shape[0])
+        ijk = np.floor((points[start:stop] - lo) * scale).astype(np.int64)
+        np.clip(ijk, 0, base - 1, out=ijk)
+        w = None if weights is None else np.asarray(weights[start:stop], dtype=np.float64)
+        for p in projs:
+            a, b = PROJECTIONS[p]
+            flat[p] += np.bincount(ijk[:, a] * base + ijk[:, b], weights=w, minlength=base * base)
+
+    maps = {}
+    for p in projs:
+        H = flat[p].reshape(base, base)
+        pyr = [H]
+        for _ in range(1, levels):
+            n = pyr[-1].shape[0] // 2
+            pyr.append(pyr[-1].reshape(n, 2, n, 2).sum(axis=(1, 3)))
+        maps[p] = pyr
+    return ProjectionMaps(lo=lo, hi=hi, bins=base, maps=maps)
+
+
+# =========================
+# キャッシュ
+# =========================
+def source_stamp(path: Path) -> np.ndarray:
+    """元データの (合計サイズ, 最新の更新時刻[ns])。結果ディレクトリなら中のファイル全体"""
+    path = Path(path)
+    files = [f for f in path.iterdir() if f.is_file()] if path.is_dir() else [path]
+    stats = [f.stat() for f in files]
+    return np.array([sum(s.st_size for s in stats), max((s.st_mtime_ns for s in stats), default=0)], dtype=np.int64)
+
+
+def maps_cache_path(source: Path, bins: int, levels: int) -> Path:
+    source = Path(source)
+    stem = source.name if source.is_dir() else source.stem
+    return source.with_name(f"{stem}_maps{bins}x{levels}.npz")
+
+
+def save_maps(path: Path, maps: ProjectionMaps, stamp: np.ndarray) -> Path:
+    arrays = {f"{p}_{level}": H for p, pyr in maps.maps.items() for level, H in enumerate(pyr)}
+    tmp = path.with_name(f"{path.stem}.{os.getpid()}.tmp.npz")
+    np.savez(str(tmp), lo=maps.lo, hi=maps.hi, bins=np.int64(maps.bins), stamp=stamp,
+             projs=np.array(sorted(maps.maps)), **arrays)
+    os.replace(tmp, path)
+    return path
+
+
+def load_maps(path: Path, levels: int) -> Tuple[ProjectionMaps, np.ndarray]:
+    """キャッシュを読む: (マップ, 作ったときの元データの stamp)"""
+    with np.load(str(path)) as z:
+        maps = {str(p): [z[f"{p}_{level}"] for level in range(levels)] for p in z["projs"]}
+        return ProjectionMaps(lo=z["lo"], hi=z["hi"], bins=int(z["bins"]), maps=maps), z["stamp"]
+
+
+def load_or_build_maps(source: Path, load_points: Callable[[], Tuple[np.ndarray, Optional[np.ndarray]]],
+                       bins: int = 256, levels: int = 1, use_cache: bool = True) -> ProjectionMaps:
+    """キャッシュがあって元データが変わっていなければ読み、無ければ load_points() で1回だけ読み込んで作る
+    ・load_points は (座標[N,3], 重み[N] または None) を返す関数
+    ・3投影とも作ってキャッシュする（どの --proj で開いても使い回せる）
+    """
+    source = Path(source)
+    path = maps_cache_path(source, bins, levels)
+    stamp = source_stamp(source)
+    if use_cache and path.exists():
+        try:
+            maps, cached_stamp = load_maps(path, levels)
+            if np.array_equal(cached_stamp, stamp):
+                return maps
+        except (OSError, KeyError, ValueError):
+            pass  # 壊れたキャッシュは作り直す
+    points, weights = load_points()
+    maps = build_maps(points, weights, bins=bins, levels=levels)
+    if use_cache:
+        try:
+            save_maps(path, maps, stamp)
+        except OSError as e:
+            print(f"[Map] キャッシュを書けなかった（{e}）: {path}")
+    return maps
@@ -1,17 +1,40 @@
 # 低密度ボクセルTop-Kを書き出す（CSV）
+# ・Top-Kは argpartition でK個を選んでからその中だけ並べる（全ボクセルのソートはしない）
+# ・隣接する低密度ボクセルをまとめた「領域」が欲しい場合は regions.py を使う
 
+from pathlib import Path
+import numpy as np
 
-def export_lowest_density_voxels(res, k: int, output_prefix) -> "pathlib.Path":
+from csv_npz import write_csv_columns
+
+_LOWEST_CSV_FMTS = ("%d", "%d", "%d", "%d", "%.8e", "%d", "%.6f", "%.6f", "%.6f")
+
+
+def lowest_k_indices(values: np.ndarray, k: int) -> np.ndarray:
+    """値の小さい順にK個の番号を返す
+    ・結果は np.argsort(values, kind="stable")[:k] と同じ（同値は番号の小さい方が先）
+    """
+    values = np.asarray(values)
+    k = min(int(k), values.shape[0])
+    if k <= 0:
+        return np.zeros((0,), dtype=np.int64)
+    part = np.argpartition(values, k - 1)
+    kth = values[part[k - 1]]
+    # K番目の値より小さいものは part[:k] に全部ある。同値は番号順に補う
+    below = part[:k][values[part[:k]] < kth]
+    ties = np.flatnonzero(values == kth)[:k - below.shape[0]]
+    sel = np.concatenate([below, ties]).astype(np.int64)
+    return sel[np.lexsort((sel, values[sel]))]
+
+
+def export_lowest_density_voxels(res, k: int, output_prefix) -> Path:
     """
     最も密度の低い順にK個のボクセルを抽出し、CSVで保存する。
     出力列: rank, i, j, k, density, count, cx, cy, cz
     ※ ボクセル番号は index_ijk の (i,j,k)
     """
-    import numpy as np
-    from pathlib import Path
-
-    # 抽出と並べ替え（密度昇順、安定ソート）
-    order = np.argsort(res.density, kind="stable")[:k]
+    # 抽出と並べ替え（密度昇順、同値は元の順）
+    order = lowest_k_indices(res.density, k)
     ijk    = res.index_ijk[order]
     dens   = res.density[order]
     cnts   = res.counts[order]
@@ -19,16 +42,10 @@ def export_lowest_density_voxels(res, k: int, output_prefix) -> "pathlib.Path":
 
     # 保存パス（<prefix>_lowest10.csv）
     out_csv = Path(output_prefix).with_name(Path(output_prefix).stem + f"_lowest{k}.csv")
-    out_csv.parent.mkdir(parents=True, exist_ok=True)
-
-    # 書き出し
-    import csv
-    with out_csv.open("w", newline="", encoding="utf-8") as f:
-        w = csv.writer(f)
-        w.writerow(["rank", "i", "j", "k", "density", "count", "cx", "cy", "cz"])
-        for r, (v, d, c, p) in enumerate(zip(ijk, dens, cnts, ctrs), start=1):
-            w.writerow([r, int(v[0]), int(v[1]), int(v[2]), f"{float(d):.8e}", int(c),
-                        f"{float(p[0]):.6f}", f"{float(p[1]):.6f}", f"{float(p[2]):.6f}"])
+    write_csv_columns(out_csv, {
+        "rank": np.arange(1, order.shape[0] + 1), "i": ijk[:, 0], "j": ijk[:, 1], "k": ijk[:, 2],
+        "density": dens, "count": cnts, "cx": ctrs[:, 0], "cy": ctrs[:, 1], "cz": ctrs[:, 2],
+    }, _LOWEST_CSV_FMTS)
 
     # ついでに標準出力にも要約を出す（任意）
     print("[Voxel] 低密度ボクセルTop{}:".format(k))
@@ -0,0 +1,161 @@
+# density/raster.py
+# -*- coding: utf-8 -*-
+"""NumPyだけで点群/ボクセル箱を画像にする簡易ラスタライザとPNG書き出し（表示環境の無いサーバ向け）
+・固定のカメラ（VIEWS）から平行投影し、点/箱を四角いスプラットとして深度バッファ付きで塗る
+  （同じ物体なら視点が変わっても拡大率がそろうよう、AABBの8隅が画像に収まるように合わせる）
+・1回の深度テストはスプラット内の1オフセット分をまとめて処理する（同じ画素に落ちた候補は最も手前だけ残す）
+・PNGは zlib だけで書く（Open3D/matplotlib が無くても書き出せる）
+
+使い方例:
+  img = rasterize_points(points, gray_colors(values), "iso", 800, 600, point_size=2)
+  write_png("out/foo_iso.png", img)
+"""
+
+from pathlib import Path
+from typing import Optional, Sequence, Tuple
+import struct
+import zlib
+import numpy as np
+
+# 視点の名前 -> (注視点から見たカメラの方向, 画面の上方向)
+VIEWS = {
+    "front": ((0.0, -1.0, 0.0), (0.0, 0.0, 1.0)),
+    "side": ((1.0, 0.0, 0.0), (0.0, 0.0, 1.0)),
+    "top": ((0.0, 0.0, 1.0), (0.0, 1.0, 0.0)),
+    "iso": ((1.0, -1.0, 1.0), (0.0, 0.0, 1.0)),
+}
+
+# 背景（グレースケールの点/箱と区別できる暗い青）
+BACKGROUND = (40, 60, 90)
+
+
+def camera_basis(view: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """視点の (画面の右, 画面の上, 視線方向) の単位ベクトル"""
+    direction, up = (np.asarray(v, dtype=np.float64) for v in VIEWS[view])
+    forward = -direction / np.linalg.norm(direction)
+    right = np.cross(forward, up)
+    right /= np.linalg.norm(right)
+    return right, np.cross(right, forward), forward
+
+
+def gray_colors(values: np.ndarray, quantile_max: float = 0.98) -> np.ndarray:
+    """値を上位分位で正規化したグレースケール（0-1, (N,3)）。可視化スクリプトの箱の色と同じ"""
+    values = np.asarray(values, dtype=np.float64)
+    if values.size == 0:
+        return np.zeros((0, 3))
+    vmin = float(values.min())
+    vmax = float(np.quantile(values, quantile_max))
+    s = np.clip((values - vmin) / (vmax - vmin), 0.0, 1.0) if vmax > vmin else np.zeros_like(values)
+    return np.repeat(s[:, None], 3, axis=1)
+
+
+def _aabb_corners(lo: np.ndarray, hi: np.ndarray) -> np.ndarray:
+    return np.array([[hi[0] if i & 1 else lo[0], hi[1] if i & 2 else lo[1], hi[2] if i & 4 else lo[2]]
+                     for i in range(8)], dtype=np.float64)
+
+
+class _Projection:
+    """視点と画像サイズから決まる平行投影（AABBが余白付きで画像に収まる拡大率）"""
+
+    def __init__(self, view: str, width: int, height: int, lo, hi, margin: float = 0.05):
+        self.right, self.up, self.forward = camera_basis(view)
+        self.width, self.height = int(width), int(height)
+        c = _aabb_corners(np.asarray(lo, dtype=np.float64), np.asarray(hi, dtype=np.float64))
+        u, v = c @ self.right, c @ self.up
+        self.u0, self.v1 = float(u.min()), float(v.max())
+        span_u, span_v = max(float(u.max()) - self.u0, 1e-12), max(self.v1 - float(v.min()), 1e-12)
+        self.scale = (1.0 - 2.0 * margin) * min(self.width / span_u, self.height / span_v)
+        # 画像の中央に寄せる
+        self.off_x = 0.5 * (self.width - span_u * self.scale)
+        self.off_y = 0.5 * (self.height - span_v * self.scale)
+
+    def __call__(self, points: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """(画素x, 画素y, 深度)。深度は小さいほど手前"""
+        p = np.asarray(points, dtype=np.float64)
+        x = np.floor((p @ self.right - self.u0) * self.scale + self.off_x).astype(np.int64)
+        y = np.floor((self.v1 - p @ self.up) * self.scale + self.off_y).astype(np.int64)
+        return x, y, p @ self.forward
+
+    def half_extent(self, box_size) -> Tuple[int, int]:
+        """軸に沿った箱を投影したときの、画面上の半幅・半高さ[画素]"""
+        size = np.broadcast_to(np.asarray(box_size, dtype=np.float64), (3,))
+        hx = 0.5 * float(np.abs(self.right) @ size) * self.scale
+        hy = 0.5 * float(np.abs(self.up) @ size) * self.scale
+        return max(int(round(hx)), 0), max(int(round(hy)), 0)
+
+
+def _splat(proj: _Projection, points: np.ndarray, colors: np.ndarray, hx: int, hy: int,
+           background: Sequence[int]) -> np.ndarray:
+    """(2hx+1)x(2hy+1) 画素の四角を深度バッファ付きで塗った画像（(H,W,3) uint8）"""
+    w, h = proj.width, proj.height
+    img = np.empty((h * w, 3), dtype=np.uint8)
+    img[:] = np.asarray(background, dtype=np.uint8)
+    zbuf = np.full((h * w,), np.inf)
+    if points.shape[0] == 0:
+        return img.reshape(h, w, 3)
+    x, y, depth = proj(points)
+    rgb = np.clip(np.asarray(colors, dtype=np.float64) * 255.0 + 0.5, 0, 255).astype(np.uint8)
+    # 手前から並べておけば、同じ画素の候補のうち最初の1つが最も手前になる
+    order = np.argsort(depth, kind="stable")
+    x, y, depth, rgb = x[order], y[order], depth[order], rgb[order]
+
+    for dy in range(-hy, hy + 1):
+        for dx in range(-hx, hx + 1):
+            px, py = x + dx, y + dy
+            inside = (px >= 0) & (px < w) & (py >= 0) & (py < h)
+            pix = (py * w + px)[inside]
+            pix, first = np.unique(pix, return_index=True)
+            d = depth[inside][first]
+            closer = d < zbuf[pix]
+            pix = pix[closer]
+            zbuf[pix] = d[closer]
+            img[pix] = rgb[inside][first[closer]]
+    return img.reshape(h, w, 3)
+
+
+def rasterize_points(points: np.ndarray, colors: np.ndarray, view: str, width: int, height: int,
+                     point_size: int = 1, bounds: Optional[Tuple[np.ndarray, np.ndarray]] = None,
+                     background: Sequence[int] = BACKGROUND) -> np.ndarray:
+    """点を point_size 画素角の四角で塗る。bounds（AABB）省略時は点群自身のAABBに合わせる"""
+    points = np.asarray(points)
+    lo, hi = bounds if bounds is not None else (points.min(axis=0), points.max(axis=0))
+    proj = _Projection(view, width, height, lo, hi)
+    r = max(int(point_size) - 1, 0) // 2
+    return _splat(proj, points, colors, r, r, background)
+
+
+def rasterize_boxes(centers: np.ndarray, colors: np.ndarray, box_size, view: str, width: int, height: int,
+                    background: Sequence[int] = BACKGROUND) -> np.ndarray:
+    """軸に沿った箱（ボクセル）を、投影した外接四角で塗る（正面/側面/上面の視点では箱の見た目と一致する）"""
+    centers = np.asarray(centers)
+    half = 0.5 * np.broadcast_to(np.asarray(box_size, dtype=np.float64), (3,))
+    proj = _Projection(view, width, height, centers.min(axis=0) - half, centers.max(axis=0) + half)
+    hx, hy = proj.half_extent(box_size)
+    return _splat(proj, centers, colors, hx, hy, background)
+
+
+def map_image(H: np.ndarray, quantile_max: float = 0.98) -> np.ndarray:
+    """2D密度マップ（[軸0, 軸1] の向き）を、軸1が上向きのグレースケール画像（(H,W,3) uint8、明るいほど高密度）にする"""
+    g = gray_colors(np.asarray(H, dtype=np.float64).ravel(), quantile_max)[:, 0].reshape(H.shape)
+    g = np.flipud(g.T)
+    return np.repeat((g * 255.0 + 0.5).astype(np.uint8)[:, :, None], 3, axis=2)
+
+
+def write_png(path, img: np.ndarray) -> Path:
+    """(H,W,3) uint8 の画像を8bit RGBのPNGで書く"""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    img = np.ascontiguousarray(img, dtype=np.uint8)
+    h, w = img.shape[:2]
+    # 各行の先頭にフィルタ種別0（なし）を付ける
+    raw = np.concatenate([np.zeros((h, 1), dtype=np.uint8), img.reshape(h, w * 3)], axis=1).tobytes()
+
+    def chunk(tag: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xFFFFFFFF)
+
+    with path.open("wb") as f:
+        f.write(b"\x89PNG\r\n\x1a\n")
+        f.write(chunk(b"IHDR", struct.pack(">IIBBBBB", w, h, 8, 2, 0, 0, 0)))
+        f.write(chunk(b"IDAT", zlib.compress(raw, 6)))
+        f.write(chunk(b"IEND", b""))
+    return path
@@ -0,0 +1,233 @@
+# density/regions.py
+# -*- coding: utf-8 -*-
+"""低密度領域（隣接する低密度ボクセルの連結成分）の抽出
+・密度がしきい値（絶対値またはパーセンタイル）以下のボクセルを選び、6/26近傍で連結なものを1領域にまとめる
+・連結成分のラベル付けは、疎なボクセルキー上の Union-Find をNumPyでまとめて行う（ボクセルごとのループはない）
+・領域ごとに ボクセル数・点数・平均/最小密度・バウンディングボックス・属する点の番号 を返す
+
+使い方例:
+  reg = extract_low_density_regions(res, points, percentile=10)
+  print(reg.num_regions, reg.voxel_count[:5])
+  idx = reg.region_points(0)        # 最大の低密度領域に属する点の番号
+  save_low_density_regions(prefix, reg)
+"""
+
+from dataclasses import dataclass
+from pathlib import Path
+from typing import List, Optional, Tuple
+import numpy as np
+
+from utility import pack_voxel_keys, as_shift
+from cal_den import VoxelDensityResult
+from csv_npz import write_csv_columns
+from voxel_grid import VoxelGrid
+
+# 近傍オフセットのうち辞書式で正の側だけ（辺は片方向で十分なので 26→13, 6→3）
+_HALF_OFFSETS_26 = np.array([[i, j, k] for i in (-1, 0, 1) for j in (-1, 0, 1) for k in (-1, 0, 1)
+                             if (i, j, k) > (0, 0, 0)], dtype=np.int64)
+_HALF_OFFSETS_6 = np.array([[1, 0, 0], [0, 1, 0], [0, 0, 1]], dtype=np.int64)
+
+# CSVの列と書式
+_REGION_CSV_FMTS = ("%d", "%d", "%d", "%.8e", "%.8e",
+                    "%d", "%d", "%d", "%d", "%d", "%d",
+                    "%.6f", "%.6f", "%.6f", "%.6f", "%.6f", "%.6f")
+
+
+@dataclass
+class LowDensityRegions:
+    """低密度領域の抽出結果（領域は voxel_count の降順に 0,1,2,... と番号付け）"""
+    threshold: float             # 使った密度しきい値（density <= threshold が低密度）
+    voxel_ids: np.ndarray        # (S,) 低密度ボクセルの番号（元の結果の行番号）
+    voxel_labels: np.ndarray     # (S,) 各低密度ボクセルの領域番号
+    voxel_count: np.ndarray      # (R,) 領域のボクセル数
+    point_count: np.ndarray      # (R,) 領域の点数
+    mean_density: np.ndarray     # (R,)
+    min_density: np.ndarray      # (R,)
+    bbox_ijk_min: np.ndarray     # (R,3) 領域に含まれるボクセル番号の最小
+    bbox_ijk_max: np.ndarray     # (R,3) 〃 最大（両端を含む）
+    bbox_min: np.ndarray         # (R,3) 領域のAABB（ボクセルの外形）
+    bbox_max: np.ndarray         # (R,3)
+    point_offsets: Optional[np.ndarray] = None  # (R+1,) 領域rの点は point_indices[offsets[r]:offsets[r+1]]
+    point_indices: Optional[np.ndarray] = None  # 点番号を領域順に並べたもの（点群を与えたときのみ）
+
+    @property
+    def num_regions(self) -> int:
+        return int(self.voxel_count.shape[0])
+
+    def region_voxels(self, r: int) -> np.ndarray:
+        """領域rに属するボクセルの番号（元の結果の行番号）"""
+        return self.voxel_ids[self.voxel_labels == r]
+
+    def region_points(self, r: int) -> np.ndarray:
+        """領域rに属する点の番号"""
+        if self.point_indices is None:
+            raise ValueError("点群を与えずに抽出したため、点の番号は無い")
+        return self.point_indices[self.point_offsets[r]:self.point_offsets[r + 1]]
+
+
+def density_threshold(density: np.ndarray, threshold: Optional[float] = None,
+                      percentile: Optional[float] = None) -> float:
+    """低密度とみなす密度しきい値（絶対値かパーセンタイルのどちらか一方を与える）"""
+    if (threshold is None) == (percentile is None):
+        raise ValueError("threshold と percentile はどちらか一方だけを指定すること")
+    if threshold is not None:
+        return float(threshold)
+    if not 0.0 <= percentile <= 100.0:
+        raise ValueError("percentileは0〜100である必要がある")
+    if density.shape[0] == 0:
+        return 0.0
+    return float(np.percentile(density, percentile))
+
+
+def label_voxel_components(index_ijk: np.ndarray, connectivity: int = 26) -> Tuple[np.ndarray, int]:
+    """疎なボクセル集合を連結成分に分ける
+    ・キーを1回ソートし、近傍オフセットごとに searchsorted で隣接ボクセルを引いて辺を作る
+    ・Union-Find は「根どうしを小さい番号へ付け替える → 経路を一括で縮める」を辺が尽きるまで繰り返す
+      （1回の反復はすべて配列演算。反復回数は成分の大きさの対数程度）
+    戻り値: (labels[M], 成分数)。ラベルは各成分の最小行番号の昇順に 0,1,2,...
+    """
+    if connectivity == 6:
+        offs = _HALF_OFFSETS_6
+    elif connectivity == 26:
+        offs = _HALF_OFFSETS_26
+    else:
+        raise ValueError("connectivityは6または26である必要がある")
+    ijk = np.asarray(index_ijk, dtype=np.int64).reshape(-1, 3)
+    m = ijk.shape[0]
+    if m == 0:
+        return np.zeros((0,), dtype=np.int64), 0
+
+    # 両側に1ボクセルの余白を持つキー空間にすれば、近傍のキーはオフセットの足し算で求まる
+    base = ijk.min(axis=0) - 1
+    extent = ijk.max(axis=0) - base + 2
+    keys, _, _ = pack_voxel_keys(ijk, base, extent)
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+
+    us, vs = [], []
+    for d in offs:
+        nk = keys + (d[0] * extent[1] + d[1]) * extent[2] + d[2]
+        pos = np.searchsorted(sorted_keys, nk)
+        pos_c = np.minimum(pos, m - 1)
+        hit = sorted_keys[pos_c] == nk
+        us.append(np.flatnonzero(hit))
+        vs.append(order[pos_c[hit]])
+    u = np.concatenate(us)
+    v = np.concatenate(vs)
+
+    parent = np.arange(m, dtype=np.int64)
+    while True:
+        # 経路圧縮：全員が根を指すまで親を辿る
+        while True:
+            grand = parent[parent]
+            if np.array_equal(grand, parent):
+                break
+            parent = grand
+        ru, rv = parent[u], parent[v]
+        diff = ru != rv
+        if not np.any(diff):
+            break
+        # 既に同じ成分になった辺は次の反復から除く
+        u, v, ru, rv = u[diff], v[diff], ru[diff], rv[diff]
+        # 大きい番号の根を小さい番号の根へ付け替える（親は常に小さい番号なので閉路はできない）
+        np.minimum.at(parent, np.maximum(ru, rv), np.minimum(ru, rv))
+
+    roots, labels = np.unique(parent, return_inverse=True)
+    return labels.reshape(-1).astype(np.int64), int(roots.shape[0])
+
+
+def extract_low_density_regions(res: VoxelDensityResult, points: Optional[np.ndarray] = None,
+                                threshold: Optional[float] = None, percentile: Optional[float] = None,
+                                connectivity: int = 26, min_voxels: int = 1,
+                                shift: Optional[np.ndarray] = None) -> LowDensityRegions:
+    """ボクセル密度の結果から低密度領域を抽出する
+    ・threshold（密度の絶対値）か percentile（密度分布のパーセンタイル）で低密度ボクセルを選ぶ
+    ・min_voxels 未満のボクセル数の領域は捨てる
+    ・points（res を計算した点群）を与えると、領域ごとの点の番号も求める（局所座標なら shift も与える）
+    """
+    if min_voxels <= 0:
+        raise ValueError("min_voxelsは正の整数である必要がある")
+    density = np.asarray(res.density)
+    thr = density_threshold(density, threshold, percentile)
+    sel = np.flatnonzero(density <= thr)
+    labels, _ = label_voxel_components(res.index_ijk[sel], connectivity)
+
+    # 小さい領域を除き、ボクセル数の降順（同数なら元のラベル順）に振り直す
+    sizes = np.bincount(labels)
+    keep = np.flatnonzero(sizes >= min_voxels)
+    keep = keep[np.argsort(-sizes[keep], kind="stable")]
+    relabel = np.full((sizes.shape[0],), -1, dtype=np.int64)
+    relabel[keep] = np.arange(keep.shape[0], dtype=np.int64)
+    labels = relabel[labels]
+    sel, labels = sel[labels >= 0], labels[labels >= 0]
+
+    # 領域順に並べ、区間ごとに集約する
+    order = np.argsort(labels, kind="stable")
+    sel, labels = sel[order], labels[order]
+    r = keep.shape[0]
+    voxel_count = np.bincount(labels, minlength=r).astype(np.int64)
+    starts = np.r_[0, np.cumsum(voxel_count)[:-1]].astype(np.int64)
+    ijk = np.asarray(res.index_ijk)[sel]
+    dens = density[sel].astype(np.float64)
+    if r > 0:
+        ijk_min = np.minimum.reduceat(ijk, starts, axis=0)
+        ijk_max = np.maximum.reduceat(ijk, starts, axis=0)
+        min_density = np.minimum.reduceat(dens, starts)
+    else:
+        ijk_min = ijk_max = np.zeros((0, 3), dtype=np.int64)
+        min_density = np.zeros((0,), dtype=np.float64)
+    vs = np.asarray(res.voxel_size, dtype=np.float64)
+    origin = np.asarray(res.origin, dtype=np.float64)
+
+    out = LowDensityRegions(
+        threshold=thr,
+        voxel_ids=sel,
+        voxel_labels=labels,
+        voxel_count=voxel_count,
+        point_count=np.bincount(labels, weights=np.asarray(res.counts)[sel], minlength=r).astype(np.int64),
+        mean_density=np.bincount(labels, weights=dens, minlength=r) / np.maximum(voxel_count, 1),
+        min_density=min_density,
+        bbox_ijk_min=ijk_min,
+        bbox_ijk_max=ijk_max,
+        bbox_min=origin + ijk_min * vs,
+        bbox_max=origin + (ijk_max + 1) * vs,
+    )
+
+    if points is not None:
+        # 点を同じ原点・サイズでボクセル分割し、低密度ボクセルの点の区間を領域順に連結する
+        grid = VoxelGrid(points, vs, origin=origin - as_shift(shift))
+        gid = grid.lookup(ijk)
+        if np.any(gid < 0):
+            raise ValueError("pointsが res を計算した点群と一致しない（点の無いボクセルがある）")
+        out.point_indices = grid.points_in_voxels(gid)
+        out.point_offsets = np.r_[0, np.cumsum(grid.counts[gid])[starts + voxel_count - 1]] \
+            if r > 0 else np.zeros((1,), dtype=np.int64)
+        out.point_offsets = out.point_offsets.astype(np.int64)
+    return out
+
+
+def save_low_density_regions(prefix: Path, regions: LowDensityRegions) -> List[Path]:
+    """領域の統計を <stem>_regions.csv に、ボクセル/点の所属を <stem>_regions.npz に書く"""
+    prefix = Path(prefix)
+    csv_path = prefix.with_name(prefix.stem + "_regions.csv")
+    columns = {
+        "region": np.arange(regions.num_regions, dtype=np.int64),
+        "voxels": regions.voxel_count,
+        "points": regions.point_count,
+        "mean_density": regions.mean_density,
+        "min_density": regions.min_density,
+        "i0": regions.bbox_ijk_min[:, 0], "j0": regions.bbox_ijk_min[:, 1], "k0": regions.bbox_ijk_min[:, 2],
+        "i1": regions.bbox_ijk_max[:, 0], "j1": regions.bbox_ijk_max[:, 1], "k1": regions.bbox_ijk_max[:, 2],
+        "xmin": regions.bbox_min[:, 0], "ymin": regions.bbox_min[:, 1], "zmin": regions.bbox_min[:, 2],
+        "xmax": regions.bbox_max[:, 0], "ymax": regions.bbox_max[:, 1], "zmax": regions.bbox_max[:, 2],
+    }
+    write_csv_columns(csv_path, columns, _REGION_CSV_FMTS)
+
+    npz_path = prefix.with_name(prefix.stem + "_regions.npz")
+    arrays = {"threshold": np.float64(regions.threshold),
+              "voxel_ids": regions.voxel_ids, "voxel_labels": regions.voxel_labels}
+    if regions.point_indices is not None:
+        arrays["point_offsets"] = regions.point_offsets
+        arrays["point_indices"] = regions.point_indices
+    np.savez_compressed(npz_path, **arrays)
+    return [csv_path, npz_path]
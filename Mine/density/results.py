@@ -0,0 +1,242 @@
+# density/results.py
+# -*- coding: utf-8 -*-
+"""密度計算結果の保存形式（結果ディレクトリ）と読み込みAPI
+・<prefix>_result/ に各フィールドを非圧縮の .npy で置き、header.json に種類・形状・スカラー類を書く
+・読み込みは np.load(mmap_mode="r") なので、開くだけならほぼ一瞬でRAMもほとんど使わない
+  （savez_compressed のNPZは、1列だけ欲しくても配列全体を展開する必要がある）
+・load_result は結果ディレクトリと従来のNPZの両方を同じ辞書形式で返すので、可視化側はどちらでも扱える
+
+使い方例:
+  data = load_result("out/foo_result", fields=["centers", "density"])
+  res = load_voxel_result("out/foo_result")      # VoxelDensityResult（配列はメモリマップ）
+  pts, val = load_density_points("out/foo.npz")  # 可視化用の (座標, 密度)。NPZでも同じ
+"""
+
+import json
+import os
+import shutil
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, Mapping, Optional, Sequence, Tuple, Union
+import numpy as np
+
+from cal_den import VoxelDensityResult
+from pointwise import PointDensityResult
+if TYPE_CHECKING:
+    from kde import KDEGridResult
+
+RESULT_VERSION = 1
+
+# 結果の種類ごとのレイアウト
+#   arrays : 行数分の配列（.npy として保存）
+#   optional: 結果によっては無い（None の）行数分の配列。あるときだけ保存する
+#   meta   : スカラー/小配列（header.json に保存）
+#   columns: 列名 → (フィールド, 列番号)。CSV/列指向出力と同じ列名
+_LAYOUT = {
+    "voxel": {
+        "arrays": ("centers", "counts", "density", "index_ijk"),
+        "meta": ("voxel_size", "origin"),
+        "columns": (("cx", "centers", 0), ("cy", "centers", 1), ("cz", "centers", 2),
+                    ("count", "counts", None), ("density", "density", None),
+                    ("i", "index_ijk", 0), ("j", "index_ijk", 1), ("k", "index_ijk", 2)),
+    },
+    "kde": {
+        "arrays": ("grid_points", "kde_values", "neighbor_counts"),
+        "optional": ("grid_level",),
+        "meta": ("radius", "sigma", "grid_U", "roi_min", "roi_max"),
+        "columns": (("gx", "grid_points", 0), ("gy", "grid_points", 1), ("gz", "grid_points", 2),
+                    ("neighbors", "neighbor_counts", None), ("kde", "kde_values", None),
+                    ("level", "grid_level", None)),
+    },
+    "point": {
+        "arrays": ("points", "counts", "density"),
+        "meta": ("radius", "sigma", "estimator"),
+        "columns": (("x", "points", 0), ("y", "points", 1), ("z", "points", 2),
+                    ("neighbors", "counts", None), ("density", "density", None)),
+    },
+}
+
+# 可視化用の (座標, 値) フィールド
+_DISPLAY_FIELDS = {"voxel": ("centers", "density"), "kde": ("grid_points", "kde_values"), "point": ("points", "density")}
+
+
+def result_kind(res) -> str:
+    """結果オブジェクトの種類（"voxel" | "kde" | "point"）"""
+    if isinstance(res, VoxelDensityResult):
+        return "voxel"
+    return "point" if isinstance(res, PointDensityResult) else "kde"
+
+
+def npz_kind(files: Sequence[str]) -> str:
+    """NPZに入っている配列名から結果の種類を判定する"""
+    if "centers" in files:
+        return "voxel"
+    return "kde" if "grid_points" in files else "point"
+
+
+def npz_result_kind(files: Sequence[str]) -> Optional[str]:
+    """NPZが結果のレイアウト（その種類の arrays と meta が全部ある）なら種類を、そうでなければ None を返す
+    ・ピラミッド（voxel_size が無い）、低密度領域、密度マップのキャッシュなどは None
+    """
+    for kind, layout in _LAYOUT.items():
+        if all(name in files for name in layout["arrays"] + layout["meta"]):
+            return kind
+    return None
+
+
+def result_dir_of(prefix: Path) -> Path:
+    """出力接頭辞に対応する結果ディレクトリ（<stem>_result）"""
+    prefix = Path(prefix)
+    return prefix.with_name(prefix.stem + "_result")
+
+
+def result_columns(kind: str, fields: Mapping[str, np.ndarray],
+                   names: Optional[Sequence[str]] = None) -> Dict[str, np.ndarray]:
+    """フィールドの辞書から列の辞書を作る（列は元配列のビューなのでコピーしない）
+    ・optional のフィールドが無い（None の）結果では、その列は作らない
+    """
+    specs = [s for s in _LAYOUT[kind]["columns"] if fields.get(s[1]) is not None]
+    known = [c for c, _, _ in specs]
+    if names is not None:
+        missing = [c for c in names if c not in known]
+        if missing:
+            raise ValueError(f"存在しない列: {missing}（{kind}の列は {known}）")
+    out = {}
+    for col, src, axis in specs:
+        if names is None or col in names:
+            arr = fields[src]
+            out[col] = arr if axis is None else arr[:, axis]
+    return out
+
+
+def save_result_dir(prefix: Path, res, overwrite: bool = True) -> Path:
+    """結果を <prefix>_result/ に保存する
+    ・プロセスごとの一時ディレクトリ（<prefix>_result.<pid>.tmp）に書いてから名前を変えるので、
+      中断しても壊れた結果ディレクトリは残らず、同じ結果を同時に書くプロセスどうしも互いの一時ディレクトリを消さない
+    ・overwrite=False なら既存の結果を置き換えない。名前の変更で負けた（別のプロセスが先に置いた）ときも
+      自分の一時ディレクトリを捨てて既存の方を返す（キャッシュのように同じキーなら中身が同じ場合に使う）
+    """
+    kind = result_kind(res)
+    layout = _LAYOUT[kind]
+    out_dir = result_dir_of(prefix)
+    if not overwrite and (out_dir / "header.json").is_file():
+        return out_dir
+    tmp_dir = out_dir.with_name(f"{out_dir.name}.{os.getpid()}.tmp")
+    if tmp_dir.exists():
+        shutil.rmtree(tmp_dir)
+    tmp_dir.mkdir(parents=True)
+
+    fields = {}
+    for name in layout["arrays"] + tuple(n for n in layout.get("optional", ()) if getattr(res, n) is not None):
+        arr = np.ascontiguousarray(getattr(res, name))
+        np.save(tmp_dir / f"{name}.npy", arr)
+        fields[name] = {"dtype": arr.dtype.str, "shape": list(arr.shape)}
+    header = {
+        "version": RESULT_VERSION,
+        "kind": kind,
+        "num_rows": int(getattr(res, layout["arrays"][0]).shape[0]),
+        "fields": fields,
+        "meta": {name: np.asarray(getattr(res, name)).tolist() for name in layout["meta"]},
+    }
+    with (tmp_dir / "header.json").open("w", encoding="utf-8") as f:
+        json.dump(header, f, ensure_ascii=False, indent=1)
+
+    if overwrite and out_dir.exists():
+        shutil.rmtree(out_dir)
+    try:
+        tmp_dir.rename(out_dir)
+    except OSError:
+        if overwrite or not (out_dir / "header.json").is_file():
+            raise
+        shutil.rmtree(tmp_dir, ignore_errors=True)  # 先に置かれた結果を使う
+    return out_dir
+
+
+def read_result_header(path: Path) -> Dict:
+    """結果ディレクトリの header.json を読む"""
+    with (Path(path) / "header.json").open("r", encoding="utf-8") as f:
+        header = json.load(f)
+    if header.get("version", 0) > RESULT_VERSION:
+        raise ValueError(f"新しい形式の結果ディレクトリは読めない（version={header['version']}）: {path}")
+    return header
+
+
+def load_result(path: Union[str, Path], fields: Optional[Sequence[str]] = None) -> Dict[str, np.ndarray]:
+    """結果ディレクトリまたはNPZを {フィールド名: 配列} で返す
+    ・結果ディレクトリ: 配列はメモリマップ（読み取り専用）。meta もフィールドとして含める
+    ・NPZ           : fields を与えればその配列だけを展開する
+    ・fields を省略すると全フィールド
+    """
+    path = Path(path)
+    if path.is_dir():
+        header = read_result_header(path)
+        names = list(fields) if fields is not None else list(header["fields"]) + list(header["meta"])
+        out = {}
+        for name in names:
+            if name in header["fields"]:
+                out[name] = np.load(path / f"{name}.npy", mmap_mode="r")
+            elif name in header["meta"]:
+                out[name] = np.asarray(header["meta"][name])
+            else:
+                raise ValueError(f"結果に存在しないフィールド: {name}（{path}）")
+        return out
+    if path.suffix == ".npz":
+        with np.load(str(path)) as data:
+            names = list(fields) if fields is not None else list(data.files)
+            missing = [n for n in names if n not in data.files]
+            if missing:
+                raise ValueError(f"結果に存在しないフィールド: {missing}（{path}）")
+            return {name: data[name] for name in names}
+    raise ValueError(f"結果ディレクトリでもNPZでもない: {path}")
+
+
+def _present(path: Path, names: Sequence[str]) -> Tuple[str, ...]:
+    """結果ディレクトリ/NPZに実際に入っているフィールドだけを返す（optional の判定用）"""
+    path = Path(path)
+    if path.is_dir():
+        stored = read_result_header(path)["fields"]
+    else:
+        with np.load(str(path)) as data:
+            stored = data.files
+    return tuple(n for n in names if n in stored)
+
+
+def load_density_points(path: Union[str, Path]) -> Tuple[np.ndarray, np.ndarray]:
+    """可視化用に (座標[M,3], 値[M]) だけを読む
+    ・ボクセル: (centers, density) / KDE: (grid_points, kde_values) / 点ごと: (points, density)
+    """
+    path = Path(path)
+    if path.is_dir():
+        kind = read_result_header(path)["kind"]
+    else:
+        with np.load(str(path)) as data:
+            kind = npz_kind(data.files)
+    pts_name, val_name = _DISPLAY_FIELDS[kind]
+    data = load_result(path, [pts_name, val_name])
+    return data[pts_name], data[val_name]
+
+
+def load_voxel_result(path: Union[str, Path]) -> VoxelDensityResult:
+    """ボクセル密度の結果を VoxelDensityResult として読む（結果ディレクトリなら配列はメモリマップ）"""
+    data = load_result(path, _LAYOUT["voxel"]["arrays"] + _LAYOUT["voxel"]["meta"])
+    return VoxelDensityResult(**data)
+
+
+def load_kde_result(path: Union[str, Path]) -> "KDEGridResult":
+    """KDEの結果を KDEGridResult として読む（結果ディレクトリなら配列はメモリマップ）"""
+    from kde import KDEGridResult
+    layout = _LAYOUT["kde"]
+    data = load_result(path, layout["arrays"] + layout["meta"] + _present(path, layout["optional"]))
+    return KDEGridResult(
+        grid_points=data["grid_points"], kde_values=data["kde_values"], neighbor_counts=data["neighbor_counts"],
+        radius=float(data["radius"]), sigma=float(data["sigma"]), grid_U=int(data["grid_U"]),
+        roi_min=data["roi_min"], roi_max=data["roi_max"], grid_level=data.get("grid_level"),
+    )
+
+
+def load_point_result(path: Union[str, Path]) -> PointDensityResult:
+    """点ごとの密度の結果を PointDensityResult として読む（結果ディレクトリなら配列はメモリマップ）"""
+    data = load_result(path, _LAYOUT["point"]["arrays"] + _LAYOUT["point"]["meta"])
+    return PointDensityResult(
+        points=data["points"], counts=data["counts"], density=data["density"],
+        radius=float(data["radius"]), sigma=float(data["sigma"]), estimator=str(data["estimator"]),
+    )
@@ -0,0 +1,240 @@
+# density/tiling.py
+# -*- coding: utf-8 -*-
+"""タイル分割による密度計算の並列実行（プロセスプール）
+・点群のAABBをx軸方向のスラブ（タイル）に分け、タイルごとに別プロセスで計算して最後に統合する
+・Voxel: タイル境界をボクセル境界に揃えるので、タイル間でボクセルが重複せず連結だけで統合できる。
+         点は共有メモリに1回だけ置き、タイル分けもワーカーが行う（親は間引いた点で境界を決めるだけで、
+         全点の並べ替え・取り出し・ピクル化をしない）
+・KDE  : グリッド点をタイルに分け、各タイルには半径radiusのハロー（のりしろ）分の重心も渡す。
+         境界付近のグリッド点も近傍を取りこぼさないため、結果は単一プロセスと一致する
+・点ごと: 入力点をタイルに分け、KDEと同じく radius 分のハローの点も渡す（結果は単一プロセスと一致する）
+・入力点が局所座標（IO.load_local_points）なら shift を与える。各計算器の compute と同じく結果は絶対座標
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import List, Optional, Tuple
+import numpy as np
+
+from utility import aabb_of_points, as_shift, voxel_index, voxel_center_from_index, group_voxels
+from cal_den import VoxelDensityCalculator, VoxelDensityResult
+from kde import PDVKDEDensityCalculator, KDEGridResult
+from pointwise import PointDensityCalculator, PointDensityResult
+
+
+# スラブ境界（x方向のボクセル番号の分位）を求めるときに使う点数の上限（等間隔に間引く）
+_BOUND_SAMPLE = 1 << 20
+
+# 共有メモリ上の配列をワーカーに渡すときの記述子: (名前, 形状, 型)
+SharedSpec = Tuple[str, Tuple[int, ...], str]
+
+
+def _share(arr: np.ndarray) -> Tuple[shared_memory.SharedMemory, SharedSpec]:
+    """配列を共有メモリへ1回だけコピーする（呼び出し側で close / unlink すること）"""
+    shm = shared_memory.SharedMemory(create=True, size=max(int(arr.nbytes), 1))
+    np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)[...] = arr
+    return shm, (shm.name, tuple(arr.shape), arr.dtype.str)
+
+
+def _attach(spec: SharedSpec) -> Tuple[shared_memory.SharedMemory, np.ndarray]:
+    """共有メモリ上の配列を開く（配列の参照を消してから close すること）"""
+    name, shape, dtype = spec
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+
+# --- ワーカー（プロセスプールから呼ばれるためモジュール直下に置く）---
+def _voxel_slabs(points_spec: SharedSpec, perm_spec: SharedSpec, start: int, stop: int,
+                 origin: np.ndarray, voxel_size: np.ndarray, bounds: np.ndarray) -> np.ndarray:
+    """入力の [start, stop) 行をスラブ順に並べた行番号を perm[start:stop] に書き、スラブごとの点数を返す"""
+    shm_p, points = _attach(points_spec)
+    shm_i, perm = _attach(perm_spec)
+    try:
+        ix = voxel_index(points[start:stop, :1], origin[:1], voxel_size[:1])[:, 0]
+        tile = np.searchsorted(bounds, ix, side="right")
+        if bounds.shape[0] < np.iinfo(np.int16).max:
+            tile = tile.astype(np.int16)  # 16bit以下の整数の安定ソートは基数ソートになる
+        perm[start:stop] = start + np.argsort(tile, kind="stable")
+        return np.bincount(tile, minlength=bounds.shape[0] + 1)
+    finally:
+        del points, perm
+        shm_p.close()
+        shm_i.close()
+
+
+def _voxel_tile(points_spec: SharedSpec, perm_spec: SharedSpec, segments: List[Tuple[int, int]],
+                origin: np.ndarray, voxel_size: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """1スラブの点（perm の segments 区間の行）を共有メモリから取り出してボクセルごとに数える"""
+    shm_p, points = _attach(points_spec)
+    shm_i, perm = _attach(perm_spec)
+    try:
+        rows = np.concatenate([perm[a:b] for a, b in segments])
+        ijk = voxel_index(points[rows], origin, voxel_size)
+    finally:
+        del points, perm
+        shm_p.close()
+        shm_i.close()
+    uniq, _, counts, _ = group_voxels(ijk)
+    return uniq, counts
+
+
+def _kde_tile(calc: PDVKDEDensityCalculator, centroids: np.ndarray, grid: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    if centroids.shape[0] == 0:
+        return np.zeros((grid.shape[0],), dtype=np.float64), np.zeros((grid.shape[0],), dtype=np.int64)
+    if calc.engine == "loop":
+        return calc.kde_on_grid(centroids, grid)
+    return calc.kde_on_grid_batched(centroids, grid)
+
+
+def _point_tile(calc: PointDensityCalculator, data: np.ndarray, queries: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    return calc.values_at(data, queries)
+
+
+class TiledDensityExecutor:
+    """VoxelDensityCalculator / PDVKDEDensityCalculator をタイル単位で並列実行する"""
+
+    def __init__(self, workers: int, tiles_per_worker: int = 4):
+        self.workers = int(workers)
+        self.tiles_per_worker = int(tiles_per_worker)
+        if self.workers <= 0:
+            raise ValueError("workersは正の整数である必要がある")
+        if self.tiles_per_worker <= 0:
+            raise ValueError("tiles_per_workerは正の整数である必要がある")
+
+    @property
+    def num_tiles(self) -> int:
+        # 負荷の偏りを均すため、ワーカー数より多めにタイルを切る
+        return self.workers * self.tiles_per_worker
+
+    # --- Voxel ---
+    def compute_voxel(self, calc: VoxelDensityCalculator, points: np.ndarray,
+                      origin: Optional[np.ndarray] = None, shift: Optional[np.ndarray] = None) -> VoxelDensityResult:
+        if self.workers == 1:
+            return calc.compute(points, origin=origin, shift=shift)
+        shift = as_shift(shift)
+        if origin is None:
+            origin = aabb_of_points(points)[0].astype(np.float64) + shift
+        origin = np.asarray(origin, dtype=np.float64)
+        local_origin = origin - shift
+
+        # x方向のボクセル番号で、点数がほぼ等しくなるようにスラブ境界を決める（等間隔に間引いた点の分位）
+        # （ワーカーと同じ voxel_index で求める。入力の型で引くと、float32 の点が境界の反対側のタイルに入り、
+        #   同じボクセルが2つのタイルに現れる）
+        n = points.shape[0]
+        sample = points[::max(n // _BOUND_SAMPLE, 1), :1]
+        ix = voxel_index(sample, local_origin[:1], calc.voxel_size[:1])[:, 0]
+        qs = np.linspace(0.0, 1.0, self.num_tiles + 1)[1:-1]
+        bounds = np.unique(np.quantile(ix, qs, method="lower").astype(np.int64))
+        n_tiles = bounds.shape[0] + 1
+
+        # 1) 入力を行ブロックに分け、各ワーカーがブロック内の行をスラブ順に並べる（perm）
+        # 2) スラブ t の行は、各ブロックの perm の連続区間。ワーカーはその区間の点を共有メモリから取り出す
+        blocks = np.unique(np.linspace(0, n, self.num_tiles + 1).astype(np.int64))
+        shm_p, points_spec = _share(np.ascontiguousarray(points))
+        shm_i = shared_memory.SharedMemory(create=True, size=max(n, 1) * 8)
+        perm_spec = (shm_i.name, (n,), np.dtype(np.int64).str)
+        try:
+            with ProcessPoolExecutor(max_workers=self.workers) as pool:
+                futs = [pool.submit(_voxel_slabs, points_spec, perm_spec, int(a), int(b), local_origin,
+                                    calc.voxel_size, bounds) for a, b in zip(blocks[:-1], blocks[1:])]
+                counts = np.stack([f.result() for f in futs])  # (ブロック, スラブ)
+                ends = blocks[:-1, None] + np.cumsum(counts, axis=1)
+                futs = []
+                for t in range(n_tiles):
+                    segments = [(int(e - c), int(e)) for e, c in zip(ends[:, t], counts[:, t]) if c > 0]
+                    if segments:
+                        futs.append(pool.submit(_voxel_tile, points_spec, perm_spec, segments, local_origin,
+                                                calc.voxel_size))
+                parts = [f.result() for f in futs]
+        finally:
+            shm_p.close()
+            shm_p.unlink()
+            shm_i.close()
+            shm_i.unlink()
+
+        # タイルはxのボクセル番号で昇順・互いに素なので、連結すれば全体でも辞書式昇順になる
+        uniq = np.concatenate([p[0] for p in parts], axis=0)
+        counts = np.concatenate([p[1] for p in parts], axis=0)
+        vol = float(np.prod(calc.voxel_size))
+        return VoxelDensityResult(
+            centers=voxel_center_from_index(uniq, origin, calc.voxel_size),
+            counts=counts.astype(np.int64),
+            density=(counts.astype(np.float64) / vol).astype(calc.dtype, copy=False),
+            index_ijk=uniq.astype(np.int64),
+            voxel_size=calc.voxel_size.copy(),
+            origin=origin.copy(),
+        )
+
+    # --- 点ごと ---
+    def compute_point(self, calc: PointDensityCalculator, points: np.ndarray,
+                      shift: Optional[np.ndarray] = None) -> PointDensityResult:
+        if self.workers == 1:
+            return calc.compute(points, shift=shift)
+        x = np.asarray(points[:, 0], dtype=np.float64)
+
+        # x座標で点数がほぼ等しくなるようにタイルを切る
+        qs = np.linspace(0.0, 1.0, self.num_tiles + 1)[1:-1]
+        bounds = np.unique(np.quantile(x, qs))
+        tile = np.searchsorted(bounds, x, side="right")
+        order = np.argsort(tile, kind="stable")
+        offsets = np.searchsorted(tile[order], np.arange(bounds.shape[0] + 2))
+
+        r = calc.radius
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            futs = []
+            for t in range(bounds.shape[0] + 1):
+                ids = order[offsets[t]:offsets[t + 1]]
+                if ids.shape[0] == 0:
+                    continue
+                # ハロー：タイルのx範囲 ± radius に入る点も探索対象に含める
+                x_lo, x_hi = x[ids].min() - r, x[ids].max() + r
+                halo = (x >= x_lo) & (x <= x_hi)
+                futs.append((ids, pool.submit(_point_tile, calc, points[halo], points[ids])))
+            counts = np.empty((x.shape[0],), dtype=np.int64)
+            values = np.empty((x.shape[0],), dtype=np.float64)
+            for ids, fut in futs:
+                counts[ids], values[ids] = fut.result()
+        return calc.make_result(points, counts, values, shift)
+
+    # --- KDE ---
+    def compute_kde(self, calc: PDVKDEDensityCalculator, points: np.ndarray,
+                    roi: Optional[Tuple[np.ndarray, np.ndarray]] = None,
+                    shift: Optional[np.ndarray] = None) -> KDEGridResult:
+        centroids, _, _ = calc.compute_voxel_centroids(points, shift)
+        if roi is None:
+            pmin, pmax = aabb_of_points(points)
+            roi = (pmin + as_shift(shift), pmax + as_shift(shift))
+        return self.kde_from_centroids(calc, centroids, roi)
+
+    def kde_from_centroids(self, calc: PDVKDEDensityCalculator, centroids: np.ndarray,
+                           roi: Tuple[np.ndarray, np.ndarray]) -> KDEGridResult:
+        """compute_from_centroids のタイル並列版
+        ・binnedエンジンはFFTで格子全体を一度に畳み込むため、タイル分割せず単一プロセスで実行する
+        ・適応帯域幅（bandwidth="knn"）も、k近傍を全重心で求める必要があるので単一プロセスで実行する
+        ・疎グリッド（grid="sparse"）は評価する点がもともと少ないので、タイル分割せず単一プロセスで実行する
+        """
+        if self.workers == 1 or calc.engine == "binned" or calc.bandwidth != "fixed" or calc.grid != "dense":
+            return calc.compute_from_centroids(centroids, roi)
+
+        roi_min = roi[0] - calc.radius * 0.5
+        roi_max = roi[1] + calc.radius * 0.5
+        grid = calc.generate_grid(roi_min, roi_max)
+        U = calc.grid_U
+        plane = U * U  # ij順なのでx方向の1面 = 連続するU*U点
+
+        # x方向の格子面をタイルに分ける
+        cuts = np.unique(np.linspace(0, U, min(U, self.num_tiles) + 1).astype(np.int64))
+        r = calc.radius
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            futs = []
+            for a, b in zip(cuts[:-1], cuts[1:]):
+                g = grid[a * plane:b * plane]
+                # ハロー：タイルのx範囲 ± radius に入る重心だけを渡す
+                x_lo, x_hi = g[0, 0] - r, g[-1, 0] + r
+                halo = (centroids[:, 0] >= x_lo) & (centroids[:, 0] <= x_hi)
+                futs.append(pool.submit(_kde_tile, calc, centroids[halo], g))
+            parts = [f.result() for f in futs]
+
+        kde_vals = np.concatenate([p[0] for p in parts]).astype(calc.dtype, copy=False)
+        nb_counts = np.concatenate([p[1] for p in parts])
+        return KDEGridResult(grid, kde_vals, nb_counts, calc.radius, calc.sigma, calc.grid_U, roi_min, roi_max)
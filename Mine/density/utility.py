@@ -4,7 +4,7 @@
 
 from pathlib import Path
 import numpy as np
-from typing import Tuple
+from typing import Optional, Tuple
 
 def ensure_dir(path: Path) -> None:
     """親ディレクトリを作成する（存在すれば何もしない）"""
@@ -20,13 +20,55 @@ def aabb_of_points(points: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
     return pmin, pmax
 
 
+# 精度モード（--dtype）で選べる浮動小数点型
+DTYPES = {"float64": np.float64, "float32": np.float32}
+
+# float32の点群からボクセル番号を求めるときの1チャンクの点数
+_INDEX_CHUNK = 1 << 20
+
+
+def resolve_dtype(dtype) -> np.dtype:
+    """"float32" / "float64" / np.float32 などを np.dtype にそろえる"""
+    dt = np.dtype(DTYPES.get(dtype, dtype) if isinstance(dtype, str) else dtype)
+    if dt not in (np.dtype(np.float32), np.dtype(np.float64)):
+        raise ValueError("dtypeは float32 または float64 である必要がある")
+    return dt
+
+
+def local_shift(pmin: np.ndarray, dtype) -> np.ndarray:
+    """点を dtype で持つときに座標から差し引く局所原点（float64の(3,)）
+    ・float32 の丸めの刻みは座標の絶対値に比例する（1e5 で約8e-3）ので、AABB最小を引いた局所座標で持つ
+    ・float64 は0（絶対座標のまま持つ）
+    """
+    if resolve_dtype(dtype) == np.float64:
+        return np.zeros((3,), dtype=np.float64)
+    return np.asarray(pmin, dtype=np.float64).reshape(3).copy()
+
+
+def as_shift(shift: Optional[np.ndarray]) -> np.ndarray:
+    """局所原点の指定（None は0）を float64 の(3,)にそろえる"""
+    if shift is None:
+        return np.zeros((3,), dtype=np.float64)
+    return np.asarray(shift, dtype=np.float64).reshape(3)
+
+
 def voxel_index(points: np.ndarray, origin: np.ndarray, voxel_size: np.ndarray) -> np.ndarray:
     """各点に対するボクセルインデックス(整数xyz)を計算する
     ・原点originはAABBのmin等を使う
     ・voxel_sizeは各軸の長さ
+    ・float64以外の点群は、チャンクごとにfloat64へ上げてから原点を引く
+      （境界の判定がfloat64の点群と一致し、一時配列もチャンク分で済む）
     """
-    rel = (points - origin) / voxel_size
-    idx = np.floor(rel).astype(np.int64)
+    origin = np.asarray(origin, dtype=np.float64)
+    voxel_size = np.asarray(voxel_size, dtype=np.float64)
+    if points.dtype == np.float64:
+        rel = (points - origin) / voxel_size
+        idx = np.floor(rel).astype(np.int64)
+        return idx
+    idx = np.empty(points.shape, dtype=np.int64)
+    for start in range(0, points.shape[0], _INDEX_CHUNK):
+        rel = (points[start:start + _INDEX_CHUNK].astype(np.float64) - origin) / voxel_size
+        idx[start:start + _INDEX_CHUNK] = np.floor(rel)
     return idx
 
 
@@ -34,11 +76,92 @@ def voxel_center_from_index(index_ijk: np.ndarray, origin: np.ndarray, voxel_siz
     """ボクセルの中心座標をインデックスから求める"""
     return origin + (index_ijk.astype(np.float64) + 0.5) * voxel_size
 
-def derive_output_prefix(input_path: Path, out_root: Path) -> Path:
+
+# ボクセルキーの上限（int64の正の範囲に収める）
+_MAX_VOXEL_KEYS = 1 << 63
+
+
+def pack_voxel_keys(index_ijk: np.ndarray, base: Optional[np.ndarray] = None,
+                    extent: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """整数インデックス(i,j,k)を1本のint64キーに詰める
+    ・key = ((i - bi) * ej + (j - bj)) * ek + (k - bk)  （b: 各軸の最小値, e: 各軸の幅）
+    ・キーの大小は (i,j,k) の辞書式順序と一致する
+    ・base/extent を与えると固定のキー空間を使う（範囲外のインデックスは ValueError）
+    ・幅の積がint64に収まらない場合は ValueError
+    戻り値: (keys[N], base[3], extent[3])
+    """
+    ijk = np.asarray(index_ijk, dtype=np.int64)
+    if base is not None and extent is not None:
+        base = np.asarray(base, dtype=np.int64)
+        extent = np.asarray(extent, dtype=np.int64)
+        rel = ijk - base
+        if np.any(rel < 0) or np.any(rel >= extent):
+            raise ValueError("ボクセルインデックスが固定のキー空間の範囲外にある")
+    elif ijk.shape[0] == 0:
+        return np.zeros((0,), dtype=np.int64), np.zeros((3,), dtype=np.int64), np.ones((3,), dtype=np.int64)
+    else:
+        base = ijk.min(axis=0)
+        extent = ijk.max(axis=0) - base + 1
+    # Pythonの整数で積を取ってオーバーフローを検査する
+    total = int(extent[0]) * int(extent[1]) * int(extent[2])
+    if total >= _MAX_VOXEL_KEYS:
+        raise ValueError(f"ボクセル範囲が広すぎてint64キーに収まらない: extent={extent.tolist()}")
+    rel = ijk - base
+    keys = (rel[:, 0] * extent[1] + rel[:, 1]) * extent[2] + rel[:, 2]
+    return keys, base, extent
+
+
+def unpack_voxel_keys(keys: np.ndarray, base: np.ndarray, extent: np.ndarray) -> np.ndarray:
+    """pack_voxel_keys の逆変換（int64キー → (M,3)インデックス）"""
+    keys = np.asarray(keys, dtype=np.int64)
+    k = keys % extent[2]
+    ij = keys // extent[2]
+    j = ij % extent[1]
+    i = ij // extent[1]
+    return np.stack([i, j, k], axis=1) + base
+
+
+def group_voxels(index_ijk: np.ndarray, points: Optional[np.ndarray] = None):
+    """点ごとのボクセルインデックスをボクセル単位にまとめる（np.unique(axis=0)の置き換え）
+    ・(i,j,k)をint64キーに詰めてから1次元で集約する
+      - キー空間が点数に比べて小さい場合: np.bincountで直接数える（ソート不要）
+      - それ以外: キーを1次元ソートしてまとめる
+    ・出力順は np.unique(index_ijk, axis=0) と同じ（辞書式昇順）
+    戻り値: (uniq_ijk[M,3], inverse[N], counts[M], sums[M,3] or None)
+      sums は points を与えたときの各ボクセル内座標和（重心計算用）
+    """
+    keys, base, extent = pack_voxel_keys(index_ijk)
+    n = keys.shape[0]
+    n_cells = int(np.prod(extent))
+
+    if n_cells <= max(4 * n, 1 << 16):
+        # 稠密な数え上げ：キー → 出現順位の対応表を作る
+        dense = np.bincount(keys, minlength=n_cells)
+        occupied = np.flatnonzero(dense)
+        lut = np.empty((n_cells,), dtype=np.int64)
+        lut[occupied] = np.arange(occupied.shape[0], dtype=np.int64)
+        inverse = lut[keys]
+        uniq_keys = occupied.astype(np.int64)
+        counts = dense[occupied].astype(np.int64)
+    else:
+        uniq_keys, inverse, counts = np.unique(keys, return_inverse=True, return_counts=True)
+        inverse = inverse.reshape(-1).astype(np.int64)
+        counts = counts.astype(np.int64)
+
+    uniq_ijk = unpack_voxel_keys(uniq_keys, base, extent)
+
+    sums = None
+    if points is not None:
+        m = uniq_keys.shape[0]
+        sums = np.stack([np.bincount(inverse, weights=points[:, a], minlength=m) for a in range(3)], axis=1)
+    return uniq_ijk, inverse, counts, sums
+
+def derive_output_prefix(input_path: Path, out_root: Path, base: Optional[Path] = None) -> Path:
     """入力パスから出力接頭辞を自動生成する
     規則：
       - 入力パスに "PartAnnotation" が含まれていれば、そこから下位の相対パスを out_root 配下にミラーする
-      - 含まれなければ、ファイル名だけを out_root 直下に置く
+      - 含まれず base（バッチの入力ディレクトリ）が与えられれば、base からの相対パスをミラーする
+      - どちらでもなければ、ファイル名だけを out_root 直下に置く
     例：
       in:  .\\pcd-dataset\\PartAnnotation\\0269\\...\\foo.pcd
       out: .\\out\\PartAnnotation\\0269\\...\\foo.pcd
@@ -49,6 +172,11 @@ def derive_output_prefix(input_path: Path, out_root: Path) -> Path:
     if anchor in parts:
         idx = parts.index(anchor)
         sub = Path(*parts[idx:])  # "PartAnnotation/..." を保持
+    elif base is not None:
+        try:
+            sub = p.resolve().relative_to(Path(base).resolve())
+        except ValueError:
+            sub = Path(p.name)
     else:
         sub = Path(p.name)        # アンカーが無い場合はファイル名のみ
     return Path(out_root) / sub
\ No newline at end of file
@@ -2,25 +2,32 @@
 """
 メッシュ可視化ツール（Alpha Shape / Voxel Box）
 - 入力: voxel.ply（点群。色は密度の正規化グレースケール）
-- オプション: voxel.npz（centers, voxel_size 等が入っていれば、箱メッシュを作る）
+- オプション: 結果ディレクトリ voxel_result/ または voxel.npz（centers, voxel_size 等が入っていれば、箱メッシュを作る）
+  CLIの既定（--output-format csv npy）で書かれるのは voxel_result/。voxel.npz は --output-format npz のときだけ
 
 使い方例:
   # Alpha Shape（推奨。PLYだけでOK）
   python density/visual/display.py --input F:\Experiments\MasterEx\out\voxel.ply --mode alpha --save out\voxel_alpha_mesh.ply
 
   # Voxel Box（NPZを併用。密度の段差を立体で強調）
-  python density/visual/display.py --input F:\Experiments\MasterEx\out\voxel.ply --mode voxelbox --npz F:\Experiments\MasterEx\out\voxel.npz --box-scale 0.95 --save out\voxel_boxes.ply
-python density/visual/display.py --input "F:\Experiments\MasterEx\out\PartAnnotation\02691156\1a04e3eab45ca15dd86060f189eb133.ply" --mode voxelbox --npz "F:\Experiments\MasterEx\out\PartAnnotation\02691156\1a04e3eab45ca15dd86060f189eb133.npz" --box-scale 0.95 --save out\voxel_boxes.ply
+  python density/visual/display.py --input F:\Experiments\MasterEx\out\voxel.ply --mode voxelbox --npz F:\Experiments\MasterEx\out\voxel_result --box-scale 0.95 --save out\voxel_boxes.ply
+python density/visual/display.py --input "F:\Experiments\MasterEx\out\PartAnnotation\02691156\1a04e3eab45ca15dd86060f189eb133.ply" --mode voxelbox --npz "F:\Experiments\MasterEx\out\PartAnnotation\02691156\1a04e3eab45ca15dd86060f189eb133_result" --box-scale 0.95 --save out\voxel_boxes.ply
   
-  python density/visual/display.py --input "F:\Experiments\MasterEx\down_data\partial_voxel_fps.pcd" --mode voxelbox --npz F:\Experiments\MasterEx\out\voxel.npz --box-scale 0.95 --save out\voxel_boxes.ply
+  python density/visual/display.py --input "F:\Experiments\MasterEx\down_data\partial_voxel_fps.pcd" --mode voxelbox --npz F:\Experiments\MasterEx\out\voxel_result --box-scale 0.95 --save out\voxel_boxes.ply
   """
 import argparse
 import glob
 import os
 from pathlib import Path
+import sys
 import numpy as np
 import open3d as o3d
 
+sys.path.append(str(Path(__file__).resolve().parents[1]))  # density/
+from results import load_result
+from neighbors import build_tree, knn_query
+from boxmesh import BOX_VERTS, KEEP_MODES, select_boxes, voxel_box_arrays
+
 
 # =========================
 # 共通ユーティリティ
@@ -31,25 +38,22 @@ def resolve_first_path(pattern: str) -> Path:
     return Path(hits[0] if hits else pattern)
 
 
-def build_kdtree(pcd: o3d.geometry.PointCloud) -> o3d.geometry.KDTreeFlann:
-    """KD木を作る"""
-    return o3d.geometry.KDTreeFlann(pcd)
+def build_kdtree(pcd: o3d.geometry.PointCloud) -> "cKDTree":
+    """点群の座標からKD木（SciPyのcKDTree）を作る。全クエリを一括で問い合わせるために使う"""
+    return build_tree(np.asarray(pcd.points))
 
 
 def transfer_vertex_colors_from_pcd(mesh: o3d.geometry.TriangleMesh, pcd: o3d.geometry.PointCloud) -> None:
     """メッシュ各頂点に、最も近い点群の色を転写する。
     点群に色がなければグレーにする。
+    ・全頂点の最近傍を1回の一括探索（チャンクごとにスレッド並列）で求め、色は配列の添字でまとめて引く
     """
     if len(pcd.colors) == 0:
         mesh.vertex_colors = o3d.utility.Vector3dVector(np.tile(np.array([[0.7, 0.7, 0.7]]), (len(mesh.vertices), 1)))
         return
     tree = build_kdtree(pcd)
-    verts = np.asarray(mesh.vertices)
-    cols = np.zeros((verts.shape[0], 3), dtype=np.float64)
-    # 逐次最近傍探索（頂点数は通常そこまで大きくないので実用的）
-    for i, v in enumerate(verts):
-        _, idx, _ = tree.search_knn_vector_3d(v, 1)
-        cols[i] = np.asarray(pcd.colors)[idx[0]]
+    _, idx = knn_query(tree, np.asarray(mesh.vertices), 1)
+    cols = np.asarray(pcd.colors)[idx[:, 0]]
     mesh.vertex_colors = o3d.utility.Vector3dVector(cols)
 
 
@@ -66,15 +70,14 @@ def estimate_alpha_from_knn(pcd: o3d.geometry.PointCloud, k: int = 10, sample: i
         rng = np.random.default_rng(0)
         idxs = rng.choice(n, size=sample, replace=False)
     tree = build_kdtree(pcd)
-    dists = []
-    for i in idxs:
-        # k+1 とするのは自分自身(距離0)が含まれるため
-        _, _, d2 = tree.search_knn_vector_3d(pcd.points[i], k + 1)
-        if len(d2) > 1:
-            # 自分自身を除いた最近傍距離を使う
-            dd = np.sqrt(np.asarray(d2[1:], dtype=np.float64))
-            dists.append(np.mean(dd))
-    mean_knn = float(np.mean(dists)) if dists else 0.01
+    # k+1 とするのは自分自身(距離0)が含まれるため。サンプル全点を一括で探索する
+    d, _ = knn_query(tree, np.asarray(pcd.points)[idxs], k + 1)
+    # 自分自身を除いた近傍距離の平均（点数がk+1未満なら、ある分だけで平均する）
+    d = d[:, 1:]
+    valid = np.isfinite(d)
+    has = valid.any(axis=1)
+    per_point = np.where(valid, d, 0.0).sum(axis=1)[has] / valid.sum(axis=1)[has]
+    mean_knn = float(np.mean(per_point)) if per_point.size else 0.01
     return factor * mean_knn
 
 
@@ -114,12 +117,19 @@ def color_from_scalar_linear(s: np.ndarray) -> np.ndarray:
     return np.stack([s, s, s], axis=1)
 
 
-def mesh_from_voxel_boxes(npz_path: Path, box_scale: float = 0.95, quantile_max: float = 0.98) -> o3d.geometry.TriangleMesh:
-    """voxel.npz を使って各ボクセルに箱メッシュを置く。
+def mesh_from_voxel_boxes(npz_path: Path, box_scale: float = 0.95, quantile_max: float = 0.98,
+                          cull_shared: bool = False, max_boxes: int = None,
+                          keep: str = "stratified") -> o3d.geometry.TriangleMesh:
+    """voxel.npz（または結果ディレクトリ *_result）を使って各ボクセルに箱メッシュを置く。
     - box_scale: ボクセルサイズに対する縮小率（重なり防止と視認性向上）
     - quantile_max: 密度の上位分位で正規化上限を切る（極大値で全体が暗くなるのを防ぐ）
+    - cull_shared: 隣り合う箱同士の接する面を省く（box_scale=1 のときに内部の面を描かない）
+    - max_boxes: 箱の数の上限（数十万ボクセルを軽く表示するためのLOD）
+    - keep: max_boxes で残す箱（stratified: 密度の分位ごとに均等 / lowest: 低密度から / highest: 高密度から）
+    箱はテンプレートを全中心にブロードキャストして一括で作る（boxmesh.voxel_box_arrays）
     """
-    data = np.load(str(npz_path))
+    # 使う3フィールドだけを読む（結果ディレクトリならメモリマップ）
+    data = load_result(npz_path, ["centers", "density", "voxel_size"])
     centers = data["centers"]          # (M,3)
     density = data["density"]          # (M,)
     vox = data["voxel_size"]           # (3,)
@@ -134,25 +144,13 @@ def mesh_from_voxel_boxes(npz_path: Path, box_scale: float = 0.95, quantile_max:
     # 箱の実サイズ
     size = np.asarray(vox, dtype=np.float64) * float(box_scale)
 
-    mesh_all = o3d.geometry.TriangleMesh()
-    cols_all = []
-
-    for c, t in zip(centers, dnorm):
-        box = o3d.geometry.TriangleMesh.create_box(width=size[0], height=size[1], depth=size[2])
-        box.compute_vertex_normals()
-        # boxのローカル中心を原点→平行移動
-        box.translate(np.asarray(c, dtype=np.float64) - 0.5 * size)
-        # 色（全頂点同色）
-        col = color_from_scalar_linear(np.array([t]))[0]
-        cols_all.append(np.tile(col, (len(box.vertices), 1)))
-        # 結合
-        mesh_all += box
-
-    mesh_all.vertex_colors = o3d.utility.Vector3dVector(np.vstack(cols_all))
-    mesh_all.remove_duplicated_vertices()
-    mesh_all.remove_degenerate_triangles()
-    mesh_all.remove_duplicated_triangles()
-    mesh_all.remove_non_manifold_edges()
+    idx = select_boxes(density, max_boxes, keep)
+    verts, tris, box = voxel_box_arrays(np.asarray(centers)[idx], size, vox, cull_shared=cull_shared)
+    # 色（箱ごとに全頂点同色）
+    cols = np.repeat(color_from_scalar_linear(dnorm[idx][box]), BOX_VERTS, axis=0)
+
+    mesh_all = o3d.geometry.TriangleMesh(o3d.utility.Vector3dVector(verts), o3d.utility.Vector3iVector(tris))
+    mesh_all.vertex_colors = o3d.utility.Vector3dVector(cols)
     mesh_all.compute_vertex_normals()
     return mesh_all
 
@@ -169,9 +167,13 @@ def parse_args() -> argparse.Namespace:
     ap.add_argument("--knn", type=int, default=10, help="Alpha自動推定のk近傍")
     ap.add_argument("--alpha-factor", type=float, default=1.5, help="Alpha自動推定の倍率")
     # Voxel Box
-    ap.add_argument("--npz", type=str, default=None, help="voxel.npz のパス（voxelboxモードで必須）")
+    ap.add_argument("--npz", type=str, default=None, help="結果ディレクトリ（*_result）または voxel.npz のパス（voxelboxモードで必須）")
     ap.add_argument("--box-scale", type=float, default=0.95, help="箱サイズの縮小率（0<scale<=1）")
     ap.add_argument("--qmax", type=float, default=0.98, help="正規化上限に使う分位（外れ値抑制）")
+    ap.add_argument("--cull-shared", action="store_true", help="隣り合う箱の接する面を省く（--box-scale 1 と併用）")
+    ap.add_argument("--max-boxes", type=int, default=None, help="箱の数の上限（--keep の方法で間引く。未指定なら全ボクセル）")
+    ap.add_argument("--keep", choices=KEEP_MODES, default="stratified",
+                    help="--max-boxes で残す箱（stratified: 密度の分位ごとに均等 / lowest: 低密度から / highest: 高密度から）")
     # 出力
     ap.add_argument("--save", type=str, default=None, help="保存先（.ply 推奨）")
     return ap.parse_args()
@@ -180,13 +182,16 @@ def parse_args() -> argparse.Namespace:
 def main():
     args = parse_args()
     ply_path = resolve_first_path(args.input)
+    if args.npz is not None and not Path(args.npz).exists():
+        raise FileNotFoundError(f"--npz のパスが存在しない: {args.npz}（CLIの既定の出力は <名前>_result/）")
 
     if args.mode == "alpha":
         mesh = mesh_from_alpha_shape(ply_path, alpha=args.alpha, knn=args.knn, factor=args.alpha_factor)
     else:
         if args.npz is None:
             raise ValueError("--mode voxelbox では --npz を指定すること")
-        mesh = mesh_from_voxel_boxes(Path(args.npz), box_scale=args.box_scale, quantile_max=args.qmax)
+        mesh = mesh_from_voxel_boxes(Path(args.npz), box_scale=args.box_scale, quantile_max=args.qmax,
+                                     cull_shared=args.cull_shared, max_boxes=args.max_boxes, keep=args.keep)
 
     # 表示
     o3d.visualization.draw_geometries([mesh], window_name=f"Mesh ({args.mode})")
@@ -2,22 +2,36 @@
 """
 メッシュ可視化ツール（Alpha Shape / Voxel Box）
 - 入力: voxel.ply（点群。色は密度の正規化グレースケール）
-- オプション: voxel.npz（centers, voxel_size 等が入っていれば、箱メッシュを作る）
+- オプション: 結果ディレクトリ voxel_result/ または voxel.npz（centers, voxel_size 等が入っていれば、箱メッシュを作る）
+  CLIの既定（--output-format csv npy）で書かれるのは voxel_result/。voxel.npz は --output-format npz のときだけ
 
 使い方例:
   # Alpha Shape（推奨。PLYだけでOK）
   python density/visual/display.py --input F:\Experiments\MasterEx\out\voxel.ply --mode alpha --save out\voxel_alpha_mesh.ply
 
   # Voxel Box（NPZを併用。密度の段差を立体で強調）
-  python density/visual/display.py --input F:\Experiments\MasterEx\out\voxel.ply --mode voxelbox --npz F:\Experiments\MasterEx\out\voxel.npz --box-scale 0.95 --save out\voxel_boxes.ply
+  python density/visual/display.py --input F:\Experiments\MasterEx\out\voxel.ply --mode voxelbox --npz F:\Experiments\MasterEx\out\voxel_result --box-scale 0.95 --save out\voxel_boxes.ply
+
+  # 密度マップ（3投影を1回の読み込みで作る。ビン分けは voxel_maps256x4.npz にキャッシュ、拡大で細かい段を表示）
+  python density/visual/display2.py --input F:\Experiments\MasterEx\out\voxel.ply --npz F:\Experiments\MasterEx\out\voxel_result --render-map --proj all --map-levels 4
 """
+from __future__ import annotations
+
 import argparse
 import glob
 import os
 from pathlib import Path
+import sys
 import numpy as np
 import open3d as o3d
-from __future__ import annotations
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))  # density/
+sys.path.append(str(Path(__file__).resolve().parents[2]))  # Mine/
+from results import load_result, load_density_points
+from neighbors import build_tree, knn_query
+from boxmesh import BOX_VERTS, KEEP_MODES, select_boxes, voxel_box_arrays
+from projmap import PROJECTIONS, ProjectionMaps, load_or_build_maps
+from assist.time import profiler
 
 try:
     import matplotlib.pyplot as plt
@@ -36,25 +50,22 @@ def resolve_first_path(pattern: str) -> Path:
     return Path(hits[0] if hits else pattern)
 
 
-def build_kdtree(pcd: o3d.geometry.PointCloud) -> o3d.geometry.KDTreeFlann:
-    """KD木を作る"""
-    return o3d.geometry.KDTreeFlann(pcd)
+def build_kdtree(pcd: o3d.geometry.PointCloud) -> "cKDTree":
+    """点群の座標からKD木（SciPyのcKDTree）を作る。全クエリを一括で問い合わせるために使う"""
+    return build_tree(np.asarray(pcd.points))
 
 
 def transfer_vertex_colors_from_pcd(mesh: o3d.geometry.TriangleMesh, pcd: o3d.geometry.PointCloud) -> None:
     """メッシュ各頂点に、最も近い点群の色を転写する。
     点群に色がなければグレーにする。
+    ・全頂点の最近傍を1回の一括探索（チャンクごとにスレッド並列）で求め、色は配列の添字でまとめて引く
     """
     if len(pcd.colors) == 0:
         mesh.vertex_colors = o3d.utility.Vector3dVector(np.tile(np.array([[0.7, 0.7, 0.7]]), (len(mesh.vertices), 1)))
         return
     tree = build_kdtree(pcd)
-    verts = np.asarray(mesh.vertices)
-    cols = np.zeros((verts.shape[0], 3), dtype=np.float64)
-    # 逐次最近傍探索（頂点数は通常そこまで大きくないので実用的）
-    for i, v in enumerate(verts):
-        _, idx, _ = tree.search_knn_vector_3d(v, 1)
-        cols[i] = np.asarray(pcd.colors)[idx[0]]
+    _, idx = knn_query(tree, np.asarray(mesh.vertices), 1)
+    cols = np.asarray(pcd.colors)[idx[:, 0]]
     mesh.vertex_colors = o3d.utility.Vector3dVector(cols)
 
 
@@ -71,15 +82,14 @@ def estimate_alpha_from_knn(pcd: o3d.geometry.PointCloud, k: int = 10, sample: i
         rng = np.random.default_rng(0)
         idxs = rng.choice(n, size=sample, replace=False)
     tree = build_kdtree(pcd)
-    dists = []
-    for i in idxs:
-        # k+1 とするのは自分自身(距離0)が含まれるため
-        _, _, d2 = tree.search_knn_vector_3d(pcd.points[i], k + 1)
-        if len(d2) > 1:
-            # 自分自身を除いた最近傍距離を使う
-            dd = np.sqrt(np.asarray(d2[1:], dtype=np.float64))
-            dists.append(np.mean(dd))
-    mean_knn = float(np.mean(dists)) if dists else 0.01
+    # k+1 とするのは自分自身(距離0)が含まれるため。サンプル全点を一括で探索する
+    d, _ = knn_query(tree, np.asarray(pcd.points)[idxs], k + 1)
+    # 自分自身を除いた近傍距離の平均（点数がk+1未満なら、ある分だけで平均する）
+    d = d[:, 1:]
+    valid = np.isfinite(d)
+    has = valid.any(axis=1)
+    per_point = np.where(valid, d, 0.0).sum(axis=1)[has] / valid.sum(axis=1)[has]
+    mean_knn = float(np.mean(per_point)) if per_point.size else 0.01
     return factor * mean_knn
 
 
@@ -88,24 +98,29 @@ def estimate_alpha_from_knn(pcd: o3d.geometry.PointCloud, k: int = 10, sample: i
 # =========================
 def mesh_from_alpha_shape(ply_path: Path, alpha: float = None, knn: int = 10, factor: float = 1.5) -> o3d.geometry.TriangleMesh:
     """Alpha Shapeで点群から三角メッシュを生成し、頂点色を転写する"""
-    pcd = o3d.io.read_point_cloud(str(ply_path))
+    with profiler.stage("load") as st:
+        pcd = o3d.io.read_point_cloud(str(ply_path))
+        st.points = len(pcd.points)
     if pcd.is_empty():
         raise ValueError(f"点群の読み込みに失敗: {ply_path}")
 
     # Alpha自動推定（未指定時）
     if alpha is None:
-        alpha = estimate_alpha_from_knn(pcd, k=knn, sample=2000, factor=factor)
+        with profiler.stage("alpha_knn"):
+            alpha = estimate_alpha_from_knn(pcd, k=knn, sample=2000, factor=factor)
 
-    mesh = o3d.geometry.TriangleMesh.create_from_point_cloud_alpha_shape(pcd, alpha)
+    with profiler.stage("alpha_shape", points=len(pcd.points)):
+        mesh = o3d.geometry.TriangleMesh.create_from_point_cloud_alpha_shape(pcd, alpha)
 
-    # 簡易クリーンアップ
-    mesh.remove_duplicated_vertices()
-    mesh.remove_degenerate_triangles()
-    mesh.remove_duplicated_triangles()
-    mesh.remove_non_manifold_edges()
+        # 簡易クリーンアップ
+        mesh.remove_duplicated_vertices()
+        mesh.remove_degenerate_triangles()
+        mesh.remove_duplicated_triangles()
+        mesh.remove_non_manifold_edges()
 
     # 頂点色 = 近傍点の色（密度グレースケール）を転写
-    transfer_vertex_colors_from_pcd(mesh, pcd)
+    with profiler.stage("color_transfer", points=len(mesh.vertices)):
+        transfer_vertex_colors_from_pcd(mesh, pcd)
     mesh.compute_vertex_normals()
     return mesh
 
@@ -119,12 +134,20 @@ def color_from_scalar_linear(s: np.ndarray) -> np.ndarray:
     return np.stack([s, s, s], axis=1)
 
 
-def mesh_from_voxel_boxes(npz_path: Path, box_scale: float = 0.95, quantile_max: float = 0.98) -> o3d.geometry.TriangleMesh:
-    """voxel.npz を使って各ボクセルに箱メッシュを置く。
+def mesh_from_voxel_boxes(npz_path: Path, box_scale: float = 0.95, quantile_max: float = 0.98,
+                          cull_shared: bool = False, max_boxes: int | None = None,
+                          keep: str = "stratified") -> o3d.geometry.TriangleMesh:
+    """voxel.npz（または結果ディレクトリ *_result）を使って各ボクセルに箱メッシュを置く。
     - box_scale: ボクセルサイズに対する縮小率（重なり防止と視認性向上）
     - quantile_max: 密度の上位分位で正規化上限を切る（極大値で全体が暗くなるのを防ぐ）
+    - cull_shared: 隣り合う箱同士の接する面を省く（box_scale=1 のときに内部の面を描かない）
+    - max_boxes: 箱の数の上限（数十万ボクセルを軽く表示するためのLOD）
+    - keep: max_boxes で残す箱（stratified: 密度の分位ごとに均等 / lowest: 低密度から / highest: 高密度から）
+    箱はテンプレートを全中心にブロードキャストして一括で作る（boxmesh.voxel_box_arrays）
     """
-    data = np.load(str(npz_path))
+    # 使う3フィールドだけを読む（結果ディレクトリならメモリマップ）
+    with profiler.stage("load"):
+        data = load_result(npz_path, ["centers", "density", "voxel_size"])
     centers = data["centers"]          # (M,3)
     density = data["density"]          # (M,)
     vox = data["voxel_size"]           # (3,)
@@ -139,26 +162,16 @@ def mesh_from_voxel_boxes(npz_path: Path, box_scale: float = 0.95, quantile_max:
     # 箱の実サイズ
     size = np.asarray(vox, dtype=np.float64) * float(box_scale)
 
-    mesh_all = o3d.geometry.TriangleMesh()
-    cols_all = []
-
-    for c, t in zip(centers, dnorm):
-        box = o3d.geometry.TriangleMesh.create_box(width=size[0], height=size[1], depth=size[2])
-        box.compute_vertex_normals()
-        # boxのローカル中心を原点→平行移動
-        box.translate(np.asarray(c, dtype=np.float64) - 0.5 * size)
-        # 色（全頂点同色）
-        col = color_from_scalar_linear(np.array([t]))[0]
-        cols_all.append(np.tile(col, (len(box.vertices), 1)))
-        # 結合
-        mesh_all += box
-
-    mesh_all.vertex_colors = o3d.utility.Vector3dVector(np.vstack(cols_all))
-    mesh_all.remove_duplicated_vertices()
-    mesh_all.remove_degenerate_triangles()
-    mesh_all.remove_duplicated_triangles()
-    mesh_all.remove_non_manifold_edges()
-    mesh_all.compute_vertex_normals()
+    with profiler.stage("boxes", points=centers.shape[0]):
+        idx = select_boxes(density, max_boxes, keep)
+        verts, tris, box = voxel_box_arrays(np.asarray(centers)[idx], size, vox, cull_shared=cull_shared)
+        # 色（箱ごとに全頂点同色）
+        cols = np.repeat(color_from_scalar_linear(dnorm[idx][box]), BOX_VERTS, axis=0)
+
+    with profiler.stage("to_mesh", points=verts.shape[0]):
+        mesh_all = o3d.geometry.TriangleMesh(o3d.utility.Vector3dVector(verts), o3d.utility.Vector3iVector(tris))
+        mesh_all.vertex_colors = o3d.utility.Vector3dVector(cols)
+        mesh_all.compute_vertex_normals()
     return mesh_all
 
 
@@ -174,18 +187,29 @@ def parse_args() -> argparse.Namespace:
     ap.add_argument("--knn", type=int, default=10, help="Alpha自動推定のk近傍")
     ap.add_argument("--alpha-factor", type=float, default=1.5, help="Alpha自動推定の倍率")
     # Voxel Box
-    ap.add_argument("--npz", type=str, default=None, help="voxel.npz のパス（voxelboxモードで必須）")
+    ap.add_argument("--npz", type=str, default=None, help="結果ディレクトリ（*_result）または voxel.npz のパス（voxelboxモードで必須）")
     ap.add_argument("--box-scale", type=float, default=0.95, help="箱サイズの縮小率（0<scale<=1）")
     ap.add_argument("--qmax", type=float, default=0.98, help="正規化上限に使う分位（外れ値抑制）")
+    ap.add_argument("--cull-shared", action="store_true", help="隣り合う箱の接する面を省く（--box-scale 1 と併用）")
+    ap.add_argument("--max-boxes", type=int, default=None, help="箱の数の上限（--keep の方法で間引く。未指定なら全ボクセル）")
+    ap.add_argument("--keep", choices=KEEP_MODES, default="stratified",
+                    help="--max-boxes で残す箱（stratified: 密度の分位ごとに均等 / lowest: 低密度から / highest: 高密度から）")
     # 出力
     ap.add_argument("--save", type=str, default=None, help="保存先（.ply 推奨）")
 
     # parse_args() にオプションを追加
     ap.add_argument("--render-map", action="store_true", help="2D密度マップを生成・表示・保存する")
-    ap.add_argument("--proj", choices=["xy", "xz", "yz"], default="xy", help="密度マップの投影平面")
+    ap.add_argument("--proj", choices=["xy", "xz", "yz", "all"], default="xy", help="密度マップの投影平面（all で3投影とも）")
     ap.add_argument("--bins", type=int, default=256, help="密度マップのビン数")
+    ap.add_argument("--map-levels", type=int, default=1,
+                    help="密度マップのピラミッドの段数（2以上なら bins*2^(段数-1) まで細かく数え、拡大すると細かい段を表示する）")
+    ap.add_argument("--no-map-cache", action="store_true", help="ビン分けしたマップをキャッシュしない（毎回読み込み直す）")
     ap.add_argument("--map-save", type=str, default=None, help="密度マップの保存先（未指定なら--inputと同じ場所に自動保存）")
 
+    # プロファイル
+    ap.add_argument("--profile", action="store_true", help="読み込み/メッシュ生成/書き出しなどの段ごとの計測結果を表示する")
+    ap.add_argument("--profile-out", type=str, default=None, help="計測結果の保存先（.json または .csv）")
+
     return ap.parse_args()
 
 def derive_auto_paths(input_ply: Path, mode: str, proj: str) -> tuple[Path, Path]:
@@ -199,78 +223,106 @@ def derive_auto_paths(input_ply: Path, mode: str, proj: str) -> tuple[Path, Path
     return out_mesh, out_map
 
 # メッシュ生成関数群の下に追加
-def render_density_map(npz_path: Path | None, ply_path: Path, proj: str = "xy", bins: int = 256) -> tuple[object, np.ndarray]:
-    """2D密度マップを作る
-    優先: NPZの centers(座標) と density(重み)
-    代替: PLYの点群とカラー(グレースケール→重み)
-    proj: 'xy' | 'xz' | 'yz'
+def _density_map_source(npz_path: Path | None, ply_path: Path):
+    """密度マップの元データ: (キャッシュの基準にするパス, (座標, 重み) を読む関数)
+    優先: NPZ/結果ディレクトリの centers(座標) と density(重み)（KDEなら grid_points と kde_values）
+    代替: NPZ/結果ディレクトリを指定しなかったときだけ、PLYの点群とカラー(グレースケール→重み)
+    ・指定したパスが無ければ FileNotFoundError（PLYの色に黙って切り替えない）
     """
-    # 投影軸の選択
-    if proj == "xy":
-        ax0, ax1 = 0, 1
-        axes_label = ("X", "Y")
-    elif proj == "xz":
-        ax0, ax1 = 0, 2
-        axes_label = ("X", "Z")
-    elif proj == "yz":
-        ax0, ax1 = 1, 2
-        axes_label = ("Y", "Z")
-    else:
-        raise ValueError("--proj は xy/xz/yz のいずれか")
+    if npz_path is not None:
+        if not Path(npz_path).exists():
+            raise FileNotFoundError(f"--npz のパスが存在しない: {npz_path}（CLIの既定の出力は <名前>_result/）")
+        return Path(npz_path), lambda: load_density_points(npz_path)
 
-    # データ取得（優先: NPZ）
-    pts2 = None
-    w = None
-    if npz_path is not None and Path(npz_path).exists():
-        data = np.load(str(npz_path))
-        centers = data["centers"] if "centers" in data else data["grid_points"]
-        w = data["density"] if "density" in data else data.get("kde_values", None)
-        if w is None:
-            # 最低限、重み無しでカウント密度にする
-            w = np.ones((centers.shape[0],), dtype=np.float64)
-        pts2 = centers[:, [ax0, ax1]].astype(np.float64)
-    else:
+    def load_ply():
         # 代替: PLYから（色をグレーにして重み化）
         pcd = o3d.io.read_point_cloud(str(ply_path))
         if pcd.is_empty():
             raise ValueError(f"PLYの読み込みに失敗: {ply_path}")
         pts = np.asarray(pcd.points, dtype=np.float64)
-        pts2 = pts[:, [ax0, ax1]]
         if len(pcd.colors) > 0:
-            col = np.asarray(pcd.colors, dtype=np.float64)
-            w = col.mean(axis=1)  # グレースケールを重みとみなす
-        else:
-            w = np.ones((pts.shape[0],), dtype=np.float64)
+            return pts, np.asarray(pcd.colors, dtype=np.float64).mean(axis=1)  # グレースケールを重みとみなす
+        return pts, None
+    return Path(ply_path), load_ply
 
-    # 2Dヒストグラム（重み付き）
-    x, y = pts2[:, 0], pts2[:, 1]
-    H, xedges, yedges = np.histogram2d(x, y, bins=bins, weights=w)
-    H = H.T  # imshowで上向きにするため転置
 
-    # 描画
-    fig = plt.figure()
-    plt.imshow(H, origin="lower", extent=[xedges[0], xedges[-1], yedges[0], yedges[-1]])
-    plt.xlabel(axes_label[0])
-    plt.ylabel(axes_label[1])
-    plt.title(f"Density map ({proj.upper()})")
-    plt.colorbar(label="density (arbitrary units)")
-    plt.tight_layout()
-    return fig, H
+def _attach_zoom(ax, im, maps: ProjectionMaps, proj: str, max_pixels: int) -> None:
+    """拡大/移動のたびに、見えている範囲をピラミッドの合う段から切り出して差し替える
+    ・段ごとのビンの合計を全体表示の段の単位にそろえる（1段細かくなるごとに4倍）
+    """
+    top = maps.levels - 1
+
+    def on_lims(_ax):
+        level = maps.choose_level(proj, ax.get_xlim(), ax.get_ylim(), max_pixels)
+        sub, extent = maps.view(proj, ax.get_xlim(), ax.get_ylim(), max_pixels)
+        if sub.size == 0:
+            return
+        im.set_data(sub.T * float(4 ** (top - level)))
+        im.set_extent(extent)
+
+    ax.callbacks.connect("xlim_changed", on_lims)
+    ax.callbacks.connect("ylim_changed", on_lims)
+
+
+def render_density_maps(npz_path: Path | None, ply_path: Path, projs=("xy", "xz", "yz"), bins: int = 256,
+                        levels: int = 1, use_cache: bool = True) -> dict[str, tuple[object, np.ndarray]]:
+    """複数の投影の2D密度マップを作る: {投影名: (figure, 全体表示のマップ)}
+    ・元データの読み込みとビン分けは1回だけ（3投影とも projmap.build_maps で同時に数える）。
+      結果は元データの隣にキャッシュし、次回は読み込み自体を省く
+    ・levels>1 なら bins * 2^(levels-1) まで細かいピラミッドを作り、拡大すると細かい段に切り替わる
+    """
+    source, load_points = _density_map_source(npz_path, ply_path)
+    with profiler.stage("bins"):
+        maps = load_or_build_maps(source, load_points, bins=bins, levels=levels, use_cache=use_cache)
+
+    out = {}
+    for proj in projs:
+        a, b = PROJECTIONS[proj]
+        labels = "XYZ"
+        H = maps.maps[proj][-1].T  # imshowで上向きにするため転置
+
+        # 描画
+        fig = plt.figure()
+        im = plt.imshow(H, origin="lower", extent=maps.extent(proj))
+        plt.xlabel(labels[a])
+        plt.ylabel(labels[b])
+        plt.title(f"Density map ({proj.upper()})")
+        plt.colorbar(label="density (arbitrary units)")
+        plt.tight_layout()
+        if maps.levels > 1:
+            _attach_zoom(plt.gca(), im, maps, proj, bins)
+        out[proj] = (fig, H)
+    return out
+
+
+def render_density_map(npz_path: Path | None, ply_path: Path, proj: str = "xy", bins: int = 256) -> tuple[object, np.ndarray]:
+    """2D密度マップを1投影だけ作る（render_density_maps の1投影版）
+    proj: 'xy' | 'xz' | 'yz'
+    """
+    if proj not in PROJECTIONS:
+        raise ValueError("--proj は xy/xz/yz のいずれか")
+    return render_density_maps(npz_path, ply_path, projs=(proj,), bins=bins)[proj]
 
 
 def main():
     args = parse_args()
+    profiler.enable(args.profile or args.profile_out is not None)
     ply_path = resolve_first_path(args.input)
+    if args.npz is not None and not Path(args.npz).exists():
+        raise FileNotFoundError(f"--npz のパスが存在しない: {args.npz}（CLIの既定の出力は <名前>_result/）")
 
     if args.mode == "alpha":
-        mesh = mesh_from_alpha_shape(ply_path, alpha=args.alpha, knn=args.knn, factor=args.alpha_factor)
+        with profiler.stage("mesh"):
+            mesh = mesh_from_alpha_shape(ply_path, alpha=args.alpha, knn=args.knn, factor=args.alpha_factor)
     else:
         if args.npz is None:
             raise ValueError("--mode voxelbox では --npz を指定すること")
-        mesh = mesh_from_voxel_boxes(Path(args.npz), box_scale=args.box_scale, quantile_max=args.qmax)
+        with profiler.stage("mesh"):
+            mesh = mesh_from_voxel_boxes(Path(args.npz), box_scale=args.box_scale, quantile_max=args.qmax,
+                                         cull_shared=args.cull_shared, max_boxes=args.max_boxes, keep=args.keep)
 
     # ここで自動保存パスを決定
-    auto_mesh_path, auto_map_path = derive_auto_paths(ply_path, args.mode, args.proj)
+    auto_mesh_path, _ = derive_auto_paths(ply_path, args.mode, args.proj)
 
     # 表示（3Dメッシュ）
     o3d.visualization.draw_geometries([mesh], window_name=f"Mesh ({args.mode})")
@@ -278,7 +330,8 @@ def main():
     # メッシュ保存：--save 未指定なら入力と同じ場所に自動保存
     mesh_out = Path(args.save) if args.save else auto_mesh_path
     mesh_out.parent.mkdir(parents=True, exist_ok=True)
-    o3d.io.write_triangle_mesh(str(mesh_out), mesh, write_triangle_uvs=False)
+    with profiler.stage("write", points=len(mesh.vertices)):
+        o3d.io.write_triangle_mesh(str(mesh_out), mesh, write_triangle_uvs=False)
     print(f"保存: {mesh_out.resolve()}")
 
     # 密度マップ：要求時に生成して保存＋表示
@@ -286,13 +339,30 @@ def main():
         if plt is None:
             print("matplotlib未導入のため密度マップをスキップする。`pip install matplotlib` を実行する。")
         else:
-            fig, _ = render_density_map(Path(args.npz) if args.npz else None, ply_path, proj=args.proj, bins=args.bins)
-            map_out = Path(args.map_save) if args.map_save else auto_map_path
-            map_out.parent.mkdir(parents=True, exist_ok=True)
-            fig.savefig(str(map_out), dpi=150)
-            print(f"密度マップ保存: {map_out.resolve()}")
+            projs = list(PROJECTIONS) if args.proj == "all" else [args.proj]
+            with profiler.stage("density_map"):
+                figs = render_density_maps(Path(args.npz) if args.npz else None, ply_path, projs=projs, bins=args.bins,
+                                           levels=args.map_levels, use_cache=not args.no_map_cache)
+                for proj, (fig, _) in figs.items():
+                    if args.map_save and len(projs) == 1:
+                        map_out = Path(args.map_save)
+                    elif args.map_save:
+                        map_save = Path(args.map_save)
+                        map_out = map_save.with_name(f"{map_save.stem}_{proj}{map_save.suffix}")
+                    else:
+                        map_out = derive_auto_paths(ply_path, args.mode, proj)[1]
+                    map_out.parent.mkdir(parents=True, exist_ok=True)
+                    with profiler.stage("write"):
+                        fig.savefig(str(map_out), dpi=150)
+                    print(f"密度マップ保存: {map_out.resolve()}")
             plt.show()
 
+    # 段ごとの計測結果（表示ウィンドウを開いている時間は含まない）
+    if profiler.enabled:
+        profiler.print_report()
+        if args.profile_out is not None:
+            print(f"[Profile] 保存: {profiler.save_report(args.profile_out)}")
+
 
 
 if __name__ == "__main__":
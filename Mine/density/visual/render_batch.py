@@ -0,0 +1,333 @@
+# -*- coding: utf-8 -*-
+"""
+密度可視化のヘッドレス一括描画（表示ウィンドウを開かずに、ディレクトリ内の全結果のPNGを書く）
+- 入力: ディレクトリ（配下の結果NPZと結果ディレクトリ *_result/。--clouds を付けると点群ファイル .pcd/.ply/.off/.xyz/.pts も）
+    ドット始まりのディレクトリ（<out-root>/.cache など）と結果キャッシュには入らない。
+    同じ出力名になる入力（foo.npz と foo_result/ など）は1つだけ描く（結果ディレクトリ > NPZ > 点群ファイル）
+- 出力: --out-root 配下に、入力ディレクトリからの相対パスをミラーして
+    <名前>_<視点>.png     ボクセルは箱メッシュ、KDE/点ごとの結果と点群は点で描く（視点は --views。固定のカメラ）
+    <名前>_map_<投影>.png 2D密度マップ（--maps。ビン分けは projmap のキャッシュを使う）
+- 描画: --backend auto なら Open3D のオフスクリーン描画を試し、使えなければ NumPy の簡易ラスタライザ（raster.py）で描く
+- 並列: --workers 個のプロセスにファイル単位で配る（オフスクリーン描画器はプロセスごとに1回だけ作る）
+
+使い方例:
+  python density/visual/render_batch.py --input F:\Experiments\MasterEx\out --out-root F:\Experiments\MasterEx\qa --workers 8
+  python density/visual/render_batch.py --input out --out-root qa --backend numpy --views iso top --maps --clouds
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import zipfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import numpy as np
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))  # density/
+from boxmesh import BOX_VERTS, KEEP_MODES, select_boxes, voxel_box_arrays
+from IO import PointCloudIO
+from projmap import PROJECTIONS, load_or_build_maps
+from raster import BACKGROUND, VIEWS, gray_colors, map_image, rasterize_boxes, rasterize_points, write_png
+from cache import is_cache_dir
+from results import load_density_points, load_result, npz_result_kind, read_result_header
+from utility import derive_output_prefix
+
+try:
+    import open3d as o3d
+except ImportError:
+    o3d = None
+
+CLOUD_SUFFIXES = (".pcd", ".ply", ".off", ".xyz", ".pts")
+
+# Open3Dのオフスクリーン描画の視野角[deg]
+_FOV = 40.0
+
+# 値の無い点群を --max-points で間引くときの乱数シード（同じ入力なら毎回同じ点を描く）
+_SUBSAMPLE_SEED = 0
+
+
+# =========================
+# 入力
+# =========================
+def result_npz_kind(path: Path) -> str | None:
+    """NPZが結果（ボクセル/KDE/点ごと）なら種類、それ以外（ピラミッド・低密度領域・マップのキャッシュ等）は None"""
+    try:
+        with np.load(str(path)) as data:
+            return npz_result_kind(data.files)
+    except (OSError, ValueError, zipfile.BadZipFile):
+        return None
+
+
+def find_inputs(root: Path, clouds: bool = False) -> list[Path]:
+    """描画する結果（と点群ファイル）を列挙する。root がファイルならそれだけ
+    ・NPZは結果のレイアウトのものだけ。結果ディレクトリの中、ドット始まりのディレクトリ、キャッシュには入らない
+    """
+    root = Path(root)
+    if not root.is_dir():
+        return [root]
+    found = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        here = Path(dirpath)
+        walk = []
+        for name in sorted(dirnames):
+            sub = here / name
+            if name.startswith(".") or is_cache_dir(sub):
+                continue
+            if name.endswith("_result") and (sub / "header.json").is_file():
+                found.append(sub)
+            else:
+                walk.append(name)
+        dirnames[:] = walk
+        for name in filenames:
+            p = here / name
+            if p.suffix == ".npz":
+                if result_npz_kind(p) is not None:
+                    found.append(p)
+            elif clouds and p.suffix.lower() in CLOUD_SUFFIXES:
+                found.append(p)
+    return sorted(found)
+
+
+def _input_rank(path: Path) -> int:
+    """同じ出力名の入力のどれを描くか（小さいほど優先: 結果ディレクトリ > NPZ > 点群ファイル）"""
+    if path.is_dir():
+        return 0
+    return 1 if path.suffix == ".npz" else 2
+
+
+def plan_outputs(files: list[Path], out_root: Path, base: Path) -> tuple[dict[Path, Path], list[Path]]:
+    """(入力 -> 出力接頭辞, 出力名が重なるので描かない入力)
+    ・PNGは <出力先>/<display_name>_<視点>.png なので、同じディレクトリで display_name が同じ入力は上書きし合う
+      （--workers > 1 では同時に書いて壊れる）。_input_rank の最も小さい1つだけを残す
+    """
+    jobs: dict[Path, Path] = {}
+    owner: dict[Path, Path] = {}
+    skipped = []
+    for f in sorted(files, key=lambda f: (_input_rank(f), str(f))):
+        prefix = derive_output_prefix(f, out_root, base)
+        name = prefix.parent / display_name(f)
+        if name in owner:
+            skipped.append(f)
+            continue
+        owner[name] = f
+        jobs[f] = prefix
+    return dict(sorted(jobs.items())), sorted(skipped)
+
+
+def display_name(path: Path) -> str:
+    """出力ファイル名の元（結果ディレクトリは _result を除く）"""
+    if path.is_dir():
+        return path.name[:-len("_result")] if path.name.endswith("_result") else path.name
+    return path.stem
+
+
+def load_item(path: Path) -> tuple[np.ndarray, np.ndarray | None, np.ndarray | None]:
+    """(座標[N,3], 値[N] または None, ボクセルサイズ(3,) または None)
+    ・結果: 可視化用の座標と値。ボクセルの結果ならボクセルサイズも返す
+    ・点群ファイル: 座標だけ（値は None）
+    """
+    if path.is_dir() or path.suffix == ".npz":
+        kind = read_result_header(path)["kind"] if path.is_dir() else result_npz_kind(path)
+        if kind is None:
+            raise ValueError(f"結果のNPZではない（centers/grid_points/points と付随する値が揃っていない）: {path}")
+        pts, vals = load_density_points(path)
+        vox = load_result(path, ["voxel_size"])["voxel_size"] if kind == "voxel" else None
+        return np.asarray(pts), np.asarray(vals), vox
+    return PointCloudIO.load_points(path), None, None
+
+
+# =========================
+# 描画
+# =========================
+_RENDERERS: dict = {}
+
+
+def offscreen_renderer(width: int, height: int):
+    """このプロセスのOpen3Dオフスクリーン描画器（作れない環境では None。結果はプロセス内で使い回す）"""
+    key = (width, height)
+    if key not in _RENDERERS:
+        renderer = None
+        if o3d is not None:
+            try:
+                renderer = o3d.visualization.rendering.OffscreenRenderer(width, height)
+                renderer.scene.set_background([c / 255.0 for c in BACKGROUND] + [1.0])
+            except Exception as e:
+                print(f"[Render] オフスクリーン描画が使えないため NumPy で描く: {e}", file=sys.stderr)
+                renderer = None
+        _RENDERERS[key] = renderer
+    return _RENDERERS[key]
+
+
+def _o3d_geometry(pts: np.ndarray, cols: np.ndarray, vox: np.ndarray | None, args):
+    """(ジオメトリ, マテリアル)。ボクセルは箱メッシュ（接する面は省く）、それ以外は点"""
+    mat = o3d.visualization.rendering.MaterialRecord()
+    if vox is not None:
+        size = np.asarray(vox, dtype=np.float64) * float(args.box_scale)
+        verts, tris, box = voxel_box_arrays(pts, size, vox, cull_shared=True)
+        geom = o3d.geometry.TriangleMesh(o3d.utility.Vector3dVector(verts), o3d.utility.Vector3iVector(tris))
+        geom.vertex_colors = o3d.utility.Vector3dVector(np.repeat(cols[box], BOX_VERTS, axis=0))
+        geom.compute_vertex_normals()
+        mat.shader = "defaultLit"
+    else:
+        geom = o3d.geometry.PointCloud(o3d.utility.Vector3dVector(np.asarray(pts, dtype=np.float64)))
+        geom.colors = o3d.utility.Vector3dVector(cols)
+        mat.shader = "defaultUnlit"
+        mat.point_size = float(args.point_size)
+    return geom, mat
+
+
+def _render_o3d(renderer, geom, mat, view: str, lo: np.ndarray, hi: np.ndarray, out: Path) -> Path:
+    scene = renderer.scene
+    scene.clear_geometry()
+    scene.add_geometry("density", geom, mat)
+    center = 0.5 * (lo + hi)
+    radius = max(0.5 * float(np.linalg.norm(hi - lo)), 1e-9)
+    direction, up = (np.asarray(v, dtype=np.float64) for v in VIEWS[view])
+    # AABBの外接球が視野に収まる距離から見る
+    eye = center + direction / np.linalg.norm(direction) * radius / np.sin(np.radians(0.5 * _FOV))
+    renderer.setup_camera(_FOV, center, eye, up)
+    out.parent.mkdir(parents=True, exist_ok=True)
+    o3d.io.write_image(str(out), renderer.render_to_image())
+    return out
+
+
+def subsample(n: int, max_points: int | None, seed: int = _SUBSAMPLE_SEED) -> np.ndarray:
+    """n 点から最大 max_points 点を無作為に選んだ番号（元の順）。max_points が None か n 以上なら全点
+    ・値が無い点群には密度の高い順が使えず、先頭からの連続した区間だとファイル内の並び（走査線など）に偏る
+    """
+    if max_points is None or max_points >= n:
+        return np.arange(n)
+    if max_points <= 0:
+        raise ValueError("max_pointsは正の整数である必要がある")
+    return np.sort(np.random.default_rng(seed).choice(n, size=max_points, replace=False))
+
+
+def render_one(path: Path, out_prefix: Path, args) -> list[Path]:
+    """1つの結果/点群について、全視点（と --maps なら全投影）のPNGを書き、書いたパスを返す"""
+    pts, vals, vox = load_item(path)
+    if pts.shape[0] == 0:
+        raise ValueError(f"点群が空である: {path}")
+    name = display_name(path)
+    # 値が無い点群は高さで濃淡を付ける
+    cols = gray_colors(vals if vals is not None else pts[:, 2], args.qmax)
+    # 結果は --keep の方法（既定は密度の分位ごとに均等）、値の無い点群は無作為に間引く
+    keep = select_boxes(vals, args.max_points, args.keep) if vals is not None else subsample(pts.shape[0], args.max_points)
+    pts_k, cols_k = pts[keep], cols[keep]
+    half = 0.0 if vox is None else 0.5 * np.asarray(vox, dtype=np.float64) * float(args.box_scale)
+    lo, hi = pts.min(axis=0) - half, pts.max(axis=0) + half
+
+    outputs = []
+    renderer = offscreen_renderer(args.width, args.height) if args.backend != "numpy" else None
+    if renderer is None and args.backend == "o3d":
+        raise RuntimeError("Open3Dのオフスクリーン描画が使えない（--backend auto か numpy を指定すること）")
+    geom = _o3d_geometry(pts_k, cols_k, vox, args) if renderer is not None else None
+    for view in args.views:
+        out = out_prefix.with_name(f"{name}_{view}.png")
+        if renderer is not None:
+            outputs.append(_render_o3d(renderer, geom[0], geom[1], view, lo, hi, out))
+        elif vox is not None:
+            size = np.asarray(vox, dtype=np.float64) * float(args.box_scale)
+            outputs.append(write_png(out, rasterize_boxes(pts_k, cols_k, size, view, args.width, args.height)))
+        else:
+            img = rasterize_points(pts_k, cols_k, view, args.width, args.height,
+                                   point_size=args.point_size, bounds=(lo, hi))
+            outputs.append(write_png(out, img))
+
+    if args.maps:
+        maps = load_or_build_maps(path, lambda: (pts, vals), bins=args.bins, levels=1, use_cache=not args.no_map_cache)
+        for proj in PROJECTIONS:
+            out = out_prefix.with_name(f"{name}_map_{proj}.png")
+            outputs.append(write_png(out, map_image(maps.maps[proj][0], args.qmax)))
+    return outputs
+
+
+def _timed(path: Path, out_prefix: Path, args) -> tuple[list[Path], float]:
+    t0 = time.perf_counter()
+    outputs = render_one(path, out_prefix, args)
+    return outputs, time.perf_counter() - t0
+
+
+# =========================
+# CLI
+# =========================
+def parse_args() -> argparse.Namespace:
+    ap = argparse.ArgumentParser(description="密度可視化のヘッドレス一括描画（PNG）")
+    ap.add_argument("--input", type=Path, required=True, help="結果を探すディレクトリ（または結果/点群ファイル1つ）")
+    ap.add_argument("--out-root", type=Path, required=True, help="PNGの出力先（入力からの相対パスをミラーする）")
+    ap.add_argument("--clouds", action="store_true", help="結果だけでなく点群ファイル（.pcd/.ply/.off/.xyz/.pts）も描く")
+    ap.add_argument("--views", nargs="+", choices=list(VIEWS), default=list(VIEWS), help="視点（固定のカメラ。複数可）")
+    ap.add_argument("--maps", action="store_true", help="XY/XZ/YZ の2D密度マップも書く")
+    ap.add_argument("--bins", type=int, default=256, help="密度マップのビン数")
+    ap.add_argument("--no-map-cache", action="store_true", help="密度マップのビン分けを結果の隣にキャッシュしない")
+    ap.add_argument("--backend", choices=["auto", "o3d", "numpy"], default="auto",
+                    help="描画方法（auto: Open3Dのオフスクリーン描画が使えなければNumPy）")
+    ap.add_argument("--width", type=int, default=800, help="画像の幅[px]")
+    ap.add_argument("--height", type=int, default=600, help="画像の高さ[px]")
+    ap.add_argument("--point-size", type=int, default=2, help="点の大きさ[px]")
+    ap.add_argument("--box-scale", type=float, default=0.95, help="箱サイズの縮小率（0<scale<=1）")
+    ap.add_argument("--qmax", type=float, default=0.98, help="正規化上限に使う分位（外れ値抑制）")
+    ap.add_argument("--max-points", type=int, default=None,
+                    help="1枚に描く点/箱の上限（結果は --keep の方法、点群は無作為に残す。未指定なら全部）")
+    ap.add_argument("--keep", choices=KEEP_MODES, default="stratified",
+                    help="--max-points で結果から残す点/箱（stratified: 密度の分位ごとに均等 / lowest: 低密度から / highest: 高密度から）")
+    ap.add_argument("--workers", type=int, default=1, help="並列プロセス数（ファイル単位）")
+    return ap.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.workers <= 0:
+        raise ValueError("--workers は正の整数である必要がある")
+    files = find_inputs(args.input, clouds=args.clouds)
+    if not files:
+        raise ValueError(f"描画する結果が見つからない: {args.input}")
+    base = args.input if args.input.is_dir() else args.input.parent
+    jobs, skipped = plan_outputs(files, args.out_root, base)
+    for f in skipped:
+        print(f"[Render] 出力名が重なるため飛ばす: {f}")
+    files = list(jobs)
+    print(f"[Render] 入力 {len(files)} 件（視点 {len(args.views)}、マップ {'あり' if args.maps else 'なし'}）")
+
+    stats = {"done": 0, "failed": 0, "images": 0}
+
+    def _finish(f: Path, outputs: list[Path], sec: float) -> None:
+        stats["done"] += 1
+        stats["images"] += len(outputs)
+        print(f"[Render] ({stats['done'] + stats['failed']}/{len(files)}) {f} {len(outputs)}枚 {sec:.2f}s")
+
+    def _fail(f: Path, e: BaseException) -> None:
+        stats["failed"] += 1
+        print(f"[Render] 失敗: {f}: {e}", file=sys.stderr)
+
+    if args.workers == 1:
+        for f, prefix in jobs.items():
+            try:
+                outputs, sec = _timed(f, prefix, args)
+            except Exception as e:
+                _fail(f, e)
+                continue
+            _finish(f, outputs, sec)
+    else:
+        # 大きい結果から投入し、最後に1つだけ長いジョブが残るのを避ける
+        order = sorted(jobs, key=lambda f: f.stat().st_size if f.is_file() else 0, reverse=True)
+        with ProcessPoolExecutor(max_workers=args.workers) as pool:
+            futs = {pool.submit(_timed, f, jobs[f], args): f for f in order}
+            for fut in as_completed(futs):
+                f = futs[fut]
+                try:
+                    outputs, sec = fut.result()
+                except Exception as e:
+                    _fail(f, e)
+                    continue
+                _finish(f, outputs, sec)
+
+    print(f"[Render] 完了 {stats['done']} 件（{stats['images']} 枚）, 失敗 {stats['failed']} 件")
+    if stats["failed"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+# density/voxel_grid.py
+# -*- coding: utf-8 -*-
+"""疎なボクセル索引 VoxelGrid
+点群を1回だけボクセル分割し、点をボクセルキー順（CSR順）に並べて保持する。
+密度計算・ノイズ付与・部分ダウンサンプリングなど、ボクセル単位で点を扱う処理で共有する。
+（ボクセルごとの点数や重心だけが要り、点の番号を引かない処理は utility.group_voxels の方が速い。全点のargsortが要らないため）
+
+使い方例:
+  grid = VoxelGrid(points, voxel_size=0.05)
+  v = grid.lookup([[3, 4, 5]])[0]          # (i,j,k) → ボクセル番号（無ければ -1）
+  idx = grid.point_indices(v)              # そのボクセルに属する点の番号
+  nb = grid.neighbors([v], connectivity=26)  # 隣接ボクセル番号（無ければ -1）
+"""
+
+from typing import Optional, Union
+import numpy as np
+
+from utility import voxel_index, voxel_center_from_index, pack_voxel_keys, unpack_voxel_keys
+
+# 6近傍 / 26近傍のオフセット
+_OFFSETS_6 = np.array([[-1, 0, 0], [1, 0, 0], [0, -1, 0], [0, 1, 0], [0, 0, -1], [0, 0, 1]], dtype=np.int64)
+_OFFSETS_26 = np.array([[i, j, k] for i in (-1, 0, 1) for j in (-1, 0, 1) for k in (-1, 0, 1)
+                        if (i, j, k) != (0, 0, 0)], dtype=np.int64)
+
+# キー空間がこの大きさ以下なら、キー → ボクセル番号を配列で直接引く（O(1)）
+_DENSE_LOOKUP_LIMIT = 1 << 24
+
+
+class VoxelGrid:
+    """点群の疎なボクセル索引（CSR形式）
+    ・keys[M]       : 占有ボクセルのint64キー（昇順 = (i,j,k)の辞書式順）
+    ・index_ijk[M,3]: 占有ボクセルの整数インデックス
+    ・offsets[M+1]  : ボクセルvの点は order[offsets[v]:offsets[v+1]]
+    ・order[N]      : 点番号をボクセル順に並べたもの
+    ・inverse[N]    : 各点が属するボクセル番号
+    """
+
+    def __init__(self, points: np.ndarray, voxel_size: Union[float, np.ndarray],
+                 origin: Optional[np.ndarray] = None):
+        if points.ndim != 2 or points.shape[1] != 3:
+            raise ValueError("pointsは(N,3)の配列である必要がある")
+        self.points = points
+        self.voxel_size = np.broadcast_to(np.asarray(voxel_size, dtype=np.float64), (3,)).copy()
+        if np.any(self.voxel_size <= 0):
+            raise ValueError("voxel_sizeは正である必要がある")
+        if origin is None:
+            origin = np.min(points, axis=0) if points.shape[0] > 0 else np.zeros((3,))
+        self.origin = np.asarray(origin, dtype=np.float64).copy()
+
+        ijk = voxel_index(points, self.origin, self.voxel_size)
+        keys, self._base, self._extent = pack_voxel_keys(ijk)
+
+        # キーでソートし、同じキーの連続区間をボクセルとする
+        self.order = np.argsort(keys, kind="stable")
+        sorted_keys = keys[self.order]
+        n = sorted_keys.shape[0]
+        starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]]) if n > 0 \
+            else np.zeros((0,), dtype=np.int64)
+        self.keys = sorted_keys[starts]
+        self.offsets = np.r_[starts, n].astype(np.int64)
+        self.index_ijk = unpack_voxel_keys(self.keys, self._base, self._extent)
+
+        self.inverse = np.empty((n,), dtype=np.int64)
+        self.inverse[self.order] = np.repeat(np.arange(self.keys.shape[0], dtype=np.int64), np.diff(self.offsets))
+
+        self._lut = None
+        n_cells = int(np.prod(self._extent))
+        if n_cells <= _DENSE_LOOKUP_LIMIT:
+            self._lut = np.full((n_cells,), -1, dtype=np.int64)
+            self._lut[self.keys] = np.arange(self.keys.shape[0], dtype=np.int64)
+
+    # --- 基本情報 ---
+    @property
+    def num_voxels(self) -> int:
+        return int(self.keys.shape[0])
+
+    @property
+    def counts(self) -> np.ndarray:
+        """各ボクセルの点数"""
+        return np.diff(self.offsets)
+
+    def centers(self) -> np.ndarray:
+        """各ボクセルの中心座標"""
+        return voxel_center_from_index(self.index_ijk, self.origin, self.voxel_size)
+
+    def centroids(self) -> np.ndarray:
+        """各ボクセルに属する点の重心"""
+        m = self.num_voxels
+        sums = np.stack([np.bincount(self.inverse, weights=self.points[:, a], minlength=m) for a in range(3)], axis=1)
+        return sums / np.maximum(self.counts, 1)[:, None].astype(np.float64)
+
+    # --- 検索 ---
+    def lookup(self, index_ijk: np.ndarray) -> np.ndarray:
+        """(Q,3)の整数インデックス → ボクセル番号（占有されていなければ -1）"""
+        ijk = np.asarray(index_ijk, dtype=np.int64).reshape(-1, 3)
+        rel = ijk - self._base
+        valid = np.all((rel >= 0) & (rel < self._extent), axis=1)
+        out = np.full((ijk.shape[0],), -1, dtype=np.int64)
+        if not np.any(valid):
+            return out
+        rel = rel[valid]
+        keys = (rel[:, 0] * self._extent[1] + rel[:, 1]) * self._extent[2] + rel[:, 2]
+        if self._lut is not None:
+            out[valid] = self._lut[keys]
+        else:
+            pos = np.searchsorted(self.keys, keys)
+            pos_c = np.minimum(pos, max(self.num_voxels - 1, 0))
+            hit = (pos < self.num_voxels) & (self.keys[pos_c] == keys)
+            out[np.flatnonzero(valid)[hit]] = pos[hit]
+        return out
+
+    def lookup_points(self, points: np.ndarray) -> np.ndarray:
+        """任意の座標が入るボクセルの番号（占有されていなければ -1）"""
+        return self.lookup(voxel_index(np.asarray(points, dtype=np.float64), self.origin, self.voxel_size))
+
+    def neighbors(self, voxel_ids: np.ndarray, connectivity: int = 26) -> np.ndarray:
+        """ボクセル番号ごとに隣接ボクセル番号を返す（(Q,6) または (Q,26)、無ければ -1）"""
+        if connectivity == 6:
+            offs = _OFFSETS_6
+        elif connectivity == 26:
+            offs = _OFFSETS_26
+        else:
+            raise ValueError("connectivityは6または26である必要がある")
+        ids = np.asarray(voxel_ids, dtype=np.int64).reshape(-1)
+        cand = self.index_ijk[ids][:, None, :] + offs[None, :, :]
+        return self.lookup(cand.reshape(-1, 3)).reshape(ids.shape[0], offs.shape[0])
+
+    # --- ボクセル単位の点の取り出し ---
+    def point_indices(self, voxel_id: int) -> np.ndarray:
+        """ボクセルに属する点の番号（元の点群での番号）"""
+        return self.order[self.offsets[voxel_id]:self.offsets[voxel_id + 1]]
+
+    def voxel_points(self, voxel_id: int) -> np.ndarray:
+        """ボクセルに属する点の座標"""
+        return self.points[self.point_indices(voxel_id)]
+
+    def points_in_voxels(self, voxel_ids: np.ndarray) -> np.ndarray:
+        """複数ボクセルに属する点の番号をまとめて返す（ボクセル順）"""
+        ids = np.asarray(voxel_ids, dtype=np.int64).reshape(-1)
+        lens = self.counts[ids]
+        starts = self.offsets[ids]
+        # 各ボクセル区間 [starts, starts+lens) を連結した位置列を作る
+        pos = np.arange(int(lens.sum()), dtype=np.int64) + np.repeat(starts - (np.cumsum(lens) - lens), lens)
+        return self.order[pos]
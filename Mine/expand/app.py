@@ -1,6 +1,12 @@
+import sys
+from pathlib import Path
 import numpy as np
 import open3d as o3d
 
+# 共有のボクセル索引（Mine/density/voxel_grid.py）
+sys.path.append(str(Path(__file__).resolve().parents[1] / "density"))
+from voxel_grid import VoxelGrid
+
 # 非一様サンプリング（参考コードより）
 def nonuniform_sampling(num, sample_num):
     sample = set()
@@ -22,32 +28,25 @@ def voxel_downsample_partial(pcd, voxel_size=0.1, downsample_ratio=0.3):
     # 点群をnumpy化
     pts = np.asarray(pcd.points)
 
-    # 各点をボクセルインデックスに割り当て
-    min_bound = pts.min(axis=0)
-    voxel_indices = np.floor((pts - min_bound) / voxel_size).astype(int)
-
-    # ボクセルごとの点のインデックスを収集
-    from collections import defaultdict
-    voxel_to_indices = defaultdict(list)
-    for idx, v in enumerate(voxel_indices):
-        voxel_to_indices[tuple(v)].append(idx)
+    # 各点をボクセルに割り当て（原点はAABB最小）
+    grid = VoxelGrid(pts, voxel_size)
 
     # 1つだけランダムにボクセルを選択
-    chosen_voxel = list(voxel_to_indices.keys())[np.random.randint(len(voxel_to_indices))]
-    chosen_indices = voxel_to_indices[chosen_voxel]
+    chosen_voxel = np.random.randint(grid.num_voxels)
+    chosen_indices = grid.point_indices(chosen_voxel)
 
     # 部分的にダウンサンプリング（nonuniform_samplingで残す）
     keep_num = max(1, int(len(chosen_indices) * downsample_ratio))
     sampled_idx = nonuniform_sampling(len(chosen_indices), keep_num)
-    keep_indices_in_voxel = [chosen_indices[i] for i in sampled_idx]
+    keep_indices_in_voxel = chosen_indices[sampled_idx]
 
     # 色をつける（赤=疎にしたボクセル、灰色=それ以外）
     colors = np.tile(np.array([[0.5, 0.5, 0.5]]), (pts.shape[0], 1))  # 全体を灰色
     colors[keep_indices_in_voxel] = np.array([1.0, 0.0, 0.0])  # 残った疎ボクセルは赤
 
     # 最終的に疎ボクセルは残した点だけ、それ以外は全部そのまま保持
-    keep_indices_total = set(range(len(pts))) - set(chosen_indices)  # 他のボクセルは全保持
-    keep_indices_total = list(keep_indices_total) + keep_indices_in_voxel
+    others = np.flatnonzero(grid.inverse != chosen_voxel)  # 他のボクセルは全保持
+    keep_indices_total = np.concatenate([others, keep_indices_in_voxel])
 
     new_pcd = o3d.geometry.PointCloud()
     new_pcd.points = o3d.utility.Vector3dVector(pts[keep_indices_total])
@@ -14,6 +14,11 @@ from einops import repeat
 from models.utils import *
 import time
 from datetime import datetime
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Mine'))
+from assist.time import StageProfiler
+
+# per-stage timings (load / infer / write / chamfer); infer times also go into cd.txt
+profiler = StageProfiler(enabled=True)
 
 def _normalize_point_cloud(pc):
     # b, n, 3
@@ -69,37 +74,42 @@ def test(model, args):
         counter = 0
         txt_result = []
         for i, path in enumerate(test_input_path):
-            pcd = o3d.io.read_point_cloud(path)
-            pcd_name = path.split('/')[-1]
-            gt = torch.Tensor(np.asarray(o3d.io.read_point_cloud(os.path.join(args.gt_dir, pcd_name)).points)).unsqueeze(0).cuda()
-            input_pcd = np.array(pcd.points)
-            input_pcd = torch.from_numpy(input_pcd).float().cuda()
-            input_pcd = rearrange(input_pcd, 'n c -> c n').contiguous()
-            input_pcd = input_pcd.unsqueeze(0)
+            with profiler.stage('load') as st:
+                pcd = o3d.io.read_point_cloud(path)
+                pcd_name = path.split('/')[-1]
+                gt = torch.Tensor(np.asarray(o3d.io.read_point_cloud(os.path.join(args.gt_dir, pcd_name)).points)).unsqueeze(0).cuda()
+                input_pcd = np.array(pcd.points)
+                input_pcd = torch.from_numpy(input_pcd).float().cuda()
+                input_pcd = rearrange(input_pcd, 'n c -> c n').contiguous()
+                input_pcd = input_pcd.unsqueeze(0)
+                st.points = input_pcd.shape[-1]
 
             input_pcd, centroid, furthest_distance = normalize_point_cloud(input_pcd)
 
             # === 推論開始 ===
-            start_time = time.time()
-            pcd_upsampled = upsampling(args, model, input_pcd)
-            pcd_upsampled = centroid + pcd_upsampled * furthest_distance
-            if args.r == 16:
-                pcd_upsampled, centroid, furthest_distance = normalize_point_cloud(pcd_upsampled)
-                pcd_upsampled = upsampling(args, model, pcd_upsampled)
+            torch.cuda.synchronize()
+            with profiler.stage('infer', points=input_pcd.shape[-1]) as st:
+                pcd_upsampled = upsampling(args, model, input_pcd)
                 pcd_upsampled = centroid + pcd_upsampled * furthest_distance
-            end_time = time.time()
-            infer_time = end_time - start_time
+                if args.r == 16:
+                    pcd_upsampled, centroid, furthest_distance = normalize_point_cloud(pcd_upsampled)
+                    pcd_upsampled = upsampling(args, model, pcd_upsampled)
+                    pcd_upsampled = centroid + pcd_upsampled * furthest_distance
+                torch.cuda.synchronize()
+            infer_time = st.seconds
             total_time += infer_time
             # === 推論終了 ===
 
-            saved_pcd = rearrange(pcd_upsampled.squeeze(0), 'c n -> n c').contiguous()
-            saved_pcd = saved_pcd.detach().cpu().numpy()
-            save_folder = os.path.join(args.save_dir, 'xyz')
-            if not os.path.exists(save_folder):
-                os.makedirs(save_folder)
-            np.savetxt(os.path.join(save_folder, pcd_name), saved_pcd, fmt='%.6f')
+            with profiler.stage('write', points=pcd_upsampled.shape[-1]):
+                saved_pcd = rearrange(pcd_upsampled.squeeze(0), 'c n -> n c').contiguous()
+                saved_pcd = saved_pcd.detach().cpu().numpy()
+                save_folder = os.path.join(args.save_dir, 'xyz')
+                if not os.path.exists(save_folder):
+                    os.makedirs(save_folder)
+                np.savetxt(os.path.join(save_folder, pcd_name), saved_pcd, fmt='%.6f')
 
-            cd = chamfer_sqrt(pcd_upsampled.permute(0,2,1).contiguous(), gt).cpu().item()
+            with profiler.stage('chamfer', points=pcd_upsampled.shape[-1]):
+                cd = chamfer_sqrt(pcd_upsampled.permute(0,2,1).contiguous(), gt).cpu().item()
             txt_result.append(f'{pcd_name}: CD={cd * 1e3:.4f}, Time={infer_time:.3f} sec')
             total_cd += cd
             counter += 1.0
@@ -126,14 +136,16 @@ def test_flexible(model, args):
         counter = 0
         txt_result = []
         for i, path in enumerate(test_input_path):
-            pcd = o3d.io.read_point_cloud(path)
-            pcd_name = path.split('/')[-1]
-            gt = torch.Tensor(np.asarray(o3d.io.read_point_cloud(os.path.join(args.gt_dir, pcd_name)).points)).unsqueeze(0).cuda()
-            input_pcd = np.array(pcd.points)
-            input_pcd = torch.from_numpy(input_pcd).float().cuda()
-            input_pcd = rearrange(input_pcd, 'n c -> c n').contiguous()
-            target_num = int(args.r * input_pcd.shape[-1])
-            input_pcd = input_pcd.unsqueeze(0)
+            with profiler.stage('load') as st:
+                pcd = o3d.io.read_point_cloud(path)
+                pcd_name = path.split('/')[-1]
+                gt = torch.Tensor(np.asarray(o3d.io.read_point_cloud(os.path.join(args.gt_dir, pcd_name)).points)).unsqueeze(0).cuda()
+                input_pcd = np.array(pcd.points)
+                input_pcd = torch.from_numpy(input_pcd).float().cuda()
+                input_pcd = rearrange(input_pcd, 'n c -> c n').contiguous()
+                target_num = int(args.r * input_pcd.shape[-1])
+                input_pcd = input_pcd.unsqueeze(0)
+                st.points = input_pcd.shape[-1]
 
             tmp_up_rate = float(args.r)
             if tmp_up_rate / 4.0 > 1.0:
@@ -142,29 +154,29 @@ def test_flexible(model, args):
                 input_pcd = centroid + input_pcd * furthest_distance
 
             torch.cuda.synchronize()
-            start_time = time.time() # Start to calculate time
-
-            input_pcd, centroid, furthest_distance = normalize_point_cloud(input_pcd)
-            pcd_upsampled = upsampling(args, model, input_pcd)
-            pcd_upsampled = centroid + pcd_upsampled * furthest_distance
+            with profiler.stage('infer', points=input_pcd.shape[-1]) as st: # Start to calculate time
+                input_pcd, centroid, furthest_distance = normalize_point_cloud(input_pcd)
+                pcd_upsampled = upsampling(args, model, input_pcd)
+                pcd_upsampled = centroid + pcd_upsampled * furthest_distance
 
-            if pcd_upsampled.shape[-1] > target_num:
-                pcd_upsampled = pcd_upsampled[:, :, (pcd_upsampled.shape[-1]-target_num):]
+                if pcd_upsampled.shape[-1] > target_num:
+                    pcd_upsampled = pcd_upsampled[:, :, (pcd_upsampled.shape[-1]-target_num):]
 
-            torch.cuda.synchronize()
-            end_time = time.time()
-            infer_time = end_time - start_time
+                torch.cuda.synchronize()
+            infer_time = st.seconds
             total_time += infer_time
 
-            saved_pcd = rearrange(pcd_upsampled.squeeze(0), 'c n -> n c').contiguous()
-            saved_pcd = saved_pcd.detach().cpu().numpy()
-            save_folder = os.path.join(args.save_dir, 'xyz')
-            if not os.path.exists(save_folder):
-                os.makedirs(save_folder)
-            np.savetxt(os.path.join(save_folder, pcd_name), saved_pcd, fmt='%.6f')
+            with profiler.stage('write', points=pcd_upsampled.shape[-1]):
+                saved_pcd = rearrange(pcd_upsampled.squeeze(0), 'c n -> n c').contiguous()
+                saved_pcd = saved_pcd.detach().cpu().numpy()
+                save_folder = os.path.join(args.save_dir, 'xyz')
+                if not os.path.exists(save_folder):
+                    os.makedirs(save_folder)
+                np.savetxt(os.path.join(save_folder, pcd_name), saved_pcd, fmt='%.6f')
             
             
-            cd = chamfer_sqrt(pcd_upsampled.permute(0,2,1).contiguous(), gt).cpu().item()
+            with profiler.stage('chamfer', points=pcd_upsampled.shape[-1]):
+                cd = chamfer_sqrt(pcd_upsampled.permute(0,2,1).contiguous(), gt).cpu().item()
             txt_result.append(f'{pcd_name}: CD={cd * 1e3:.4f}, Time={infer_time:.3f} sec')   
             total_cd += cd
             counter += 1.0
@@ -190,6 +202,7 @@ if __name__ == '__main__':
     parser.add_argument('--gt_dir', default='./output', type=str, help='path to folder of gt point clouds')
     parser.add_argument('--save_dir', default='pcd', type=str, help='save upsampled point cloud and results')
     parser.add_argument('--ckpt', default='./output', type=str, help='checkpoints')
+    parser.add_argument('--profile', action='store_true', help='print per-stage timings and save profile.json/profile.csv to save_dir')
     args = parser.parse_args()
     
     st = time.time()
@@ -213,4 +226,8 @@ if __name__ == '__main__':
     
     en = time.time()
     print(f'Total time: {en - st} seconds')
+    if args.profile:
+        profiler.print_report()
+        profiler.save_report(os.path.join(args.save_dir, 'profile.json'))
+        profiler.save_report(os.path.join(args.save_dir, 'profile.csv'))
     # print(f'The number of patches: {patch}')
\ No newline at end of file